@@ -10,7 +10,7 @@ from .models import (
     ProjectElement,
     Template, TemplateStage, TemplateConstruction,
     TemplateElement,
-    Client
+    Client, ExportJob, Blob
 )
 
 
@@ -19,6 +19,7 @@ class ElementDocumentsInline(admin.StackedInline):
     model = ElementDocument
     extra = 0
     classes = ["collapse"]
+    raw_id_fields = ("blob",)
 
 
 class ProjectInline(admin.StackedInline):
@@ -37,6 +38,7 @@ class ConstructionDocumentInline(admin.StackedInline):
     model = ConstructionDocument
     extra = 0
     classes = ["collapse"]
+    raw_id_fields = ("blob",)
 
 
 class ConstructionElementInline(admin.StackedInline):
@@ -67,6 +69,7 @@ class NestedProjectnDocumentsInline(nested_admin.NestedStackedInline):
     model = ProjectDocument
     extra = 0
     classes = ["collapse"]
+    raw_id_fields = ("blob",)
 
 
 class NestedProjectElementInline(nested_admin.NestedStackedInline):
@@ -147,3 +150,14 @@ class AdminProject(nested_admin.NestedModelAdmin):
 @admin.register(Template)
 class AdminTemplate(nested_admin.NestedModelAdmin):
     inlines = [NestedTemplateStageInline,]
+
+
+@admin.register(ExportJob)
+class AdminExportJob(admin.ModelAdmin):
+    list_display = ("project", "report", "status", "created_at", "finished_at")
+
+
+@admin.register(Blob)
+class AdminBlob(admin.ModelAdmin):
+    list_display = ("file", "hash", "size", "created_at")
+    search_fields = ("hash",)
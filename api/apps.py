@@ -1,6 +1,24 @@
 from django.apps import AppConfig
+from django.db.models.signals import pre_migrate
+
+
+def create_extensions(using, **kwargs):
+    """Create PostgreSQL extensions required by indexes of models"""
+    from django.db import connections
+
+    connection = connections[using]
+    if connection.vendor != "postgresql":
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        pre_migrate.connect(create_extensions, sender=self)
@@ -0,0 +1,46 @@
+"""Async versions of read endpoints for ASGI mode
+
+Django 4.0 has no async ORM, so every view runs the sync view with its
+queries in a thread pool (`thread_sensitive=False`), instead of the one
+thread, which ASGI handler uses for all sync views. The event loop is
+free while queries run, so slow reads don't block other requests.
+Writes stay on sync views.
+"""
+from asgiref.sync import sync_to_async
+
+from django.db import close_old_connections
+
+from .views import (
+    ParentCategoryViewSet, ElementViewSet, ConstructionViewset,
+    ProjectViewset, TemplateViewset, ClientViewSet,
+)
+
+
+def in_thread_pool(view):
+    """Async view, which runs sync `view` and renders response in thread pool"""
+
+    def run(request, *args, **kwargs):
+        try:
+            response = view(request, *args, **kwargs)
+            if hasattr(response, "render"):
+                response.render()
+            return response
+        finally:
+            # Thread of the pool keeps his own connection
+            close_old_connections()
+
+    run = sync_to_async(run, thread_sensitive=False)
+
+    async def async_view(request, *args, **kwargs):
+        return await run(request, *args, **kwargs)
+
+    async_view.csrf_exempt = True
+    return async_view
+
+
+parent_categories = in_thread_pool(ParentCategoryViewSet.as_view({"get": "list"}))
+elements = in_thread_pool(ElementViewSet.as_view({"get": "list"}))
+constructions = in_thread_pool(ConstructionViewset.as_view({"get": "list"}))
+project = in_thread_pool(ProjectViewset.as_view({"get": "retrieve"}))
+template = in_thread_pool(TemplateViewset.as_view({"get": "retrieve"}))
+clients = in_thread_pool(ClientViewSet.as_view({"get": "list"}))
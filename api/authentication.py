@@ -0,0 +1,83 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from rest_framework.authentication import TokenAuthentication
+
+
+class TokenCache:
+    """LRU cache of token key to `(user, token)` with TTL, local to process
+
+    Entries are dropped by signals when token is deleted or user is changed
+    in this process. Other processes see such changes after `ttl` seconds.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value):
+        if self.maxsize <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for key, (expires, (user, token)) in list(self._entries.items()):
+                if user.pk == user_id:
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / requests, 4) if requests else 0,
+        }
+
+
+token_cache = TokenCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TTL)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """`TokenAuthentication`, which keeps users of tokens in `token_cache`"""
+
+    def authenticate_credentials(self, key):
+        credentials = token_cache.get(key)
+        if credentials is None:
+            credentials = super().authenticate_credentials(key)
+            token_cache.set(key, credentials)
+        return credentials
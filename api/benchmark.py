@@ -0,0 +1,224 @@
+"""Benchmark of hot API endpoints on current database
+
+Every scenario is a request through the whole Django stack by test client.
+Latency is measured by `repeat` runs, queries and peak of memory by one
+more run under `tracemalloc`, which slows down code. Changes of scenarios
+are rolled back, so the dataset stays the same between runs.
+"""
+import io
+import statistics
+import subprocess
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+import openpyxl
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework.test import APIClient
+
+from .models import Element, Project, ProjectElement
+
+# Compared values of results, higher values are worse
+METRICS = ("p50_ms", "p95_ms", "queries", "peak_kb")
+
+
+@dataclass
+class Scenario:
+    name: str
+    method: str
+    # Returns url and data of request
+    request: Callable[["Context"], tuple]
+    format: Optional[str] = None
+
+
+@dataclass
+class Context:
+    project: Project
+    stage_id: int
+    element_id: int
+    stage_data: dict
+    search: str
+    parent_category_id: int
+    import_rows: int
+
+
+def _import_file(context: Context) -> io.BytesIO:
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(["Название"])
+    for i in range(context.import_rows):
+        ws.append([f"Импорт {i}", "шт", "кг", 1, 2, "MATERIAL", "", 0.5, 1, 1, context.parent_category_id])
+    file = io.BytesIO()
+    wb.save(file)
+    file.seek(0)
+    file.name = "elements.xlsx"
+    return file
+
+
+SCENARIOS = [
+    Scenario("project_retrieve", "get", lambda c: (reverse("api:projects-detail", args=(c.project.pk,)), None)),
+    Scenario(
+        "stage_patch", "patch",
+        lambda c: (reverse("api:projects-stages", args=(c.project.pk, c.stage_id)), c.stage_data),
+        format="json",
+    ),
+    Scenario("project_clone", "post", lambda c: (reverse("api:projects-clone", args=(c.project.pk,)), None)),
+    Scenario(
+        "project_update_price", "get",
+        lambda c: (reverse("api:projects-update-price", args=(c.project.pk,)), None),
+    ),
+    Scenario(
+        "element_update_price", "post",
+        lambda c: (reverse("api:elements-update-price", args=(c.element_id,)), None),
+    ),
+    Scenario(
+        "excel_foreman", "get",
+        lambda c: (reverse("api:projects-excel/foreman", args=(c.project.pk,)), None),
+    ),
+    Scenario(
+        "excel_purchaser", "get",
+        lambda c: (reverse("api:projects-excel/purchaser", args=(c.project.pk,)), None),
+    ),
+    Scenario(
+        "excel_estimate", "get",
+        lambda c: (reverse("api:projects-excel/estimate", args=(c.project.pk,)), None),
+    ),
+    Scenario("elements_export", "post", lambda c: (reverse("api:elements-export"), None)),
+    Scenario("elements_import", "post", lambda c: (reverse("api:elements-import"), {"file": _import_file(c)})),
+    Scenario("element_search", "get", lambda c: (reverse("api:elements-list"), {"title": c.search})),
+]
+
+
+def context(project_id: Optional[int] = None, import_rows: int = 500) -> Context:
+    """Largest project or project with `project_id` and data of its requests"""
+    projects = Project.objects.all()
+    if project_id is None:
+        project = projects.order_by("-total_price", "pk").first()
+    else:
+        project = projects.get(pk=project_id)
+    if project is None:
+        raise Project.DoesNotExist("No projects, run `seed` command first")
+
+    client = _client()
+    data = client.get(reverse("api:projects-detail", args=(project.pk,))).data
+    stage = data["stages"][0]
+    # Change count of every element, so stage is updated as a whole
+    constructions = stage["constructions"]
+    for construction in constructions:
+        for element in construction["elements"]:
+            element["count"] = element["count"] + 1
+
+    element = ProjectElement.objects.filter(construction__stage__project=project, element__isnull=False).first()
+    title, parent_category_id = Element.objects.values_list("title", "parent_category_id").first() or ("", 0)
+
+    return Context(
+        project=project,
+        stage_id=stage["id"],
+        element_id=element.element_id if element else 0,
+        stage_data={"constructions": constructions},
+        search=title.split()[0] if title else "",
+        parent_category_id=parent_category_id,
+        import_rows=import_rows,
+    )
+
+
+def _client() -> APIClient:
+    client = APIClient(raise_request_exception=False)
+    user = get_user_model().objects.filter(is_superuser=True).first()
+    client.force_authenticate(user or get_user_model()(username="benchmark", is_staff=True))
+    return client
+
+
+def _request(client: APIClient, scenario: Scenario, context: Context) -> int:
+    url, data = scenario.request(context)
+    with transaction.atomic():
+        response = getattr(client, scenario.method)(url, data, format=scenario.format)
+        if getattr(response, "streaming", False):
+            for _ in response.streaming_content:
+                pass
+        transaction.set_rollback(True)
+    return response.status_code
+
+
+def _percentile(values: List[float], percent: int) -> float:
+    values = sorted(values)
+    return values[max(round(len(values) * percent / 100) - 1, 0)]
+
+
+def run_scenario(scenario: Scenario, context: Context, repeat: int) -> dict:
+    client = _client()
+    # Warm up caches and lazy imports
+    status = _request(client, scenario, context)
+
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        _request(client, scenario, context)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            _request(client, scenario, context)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "status": status,
+        "p50_ms": round(statistics.median(latencies), 2),
+        "p95_ms": round(_percentile(latencies, 95), 2),
+        "p99_ms": round(_percentile(latencies, 99), 2),
+        "mean_ms": round(statistics.mean(latencies), 2),
+        "queries": len(queries),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def run(names: Optional[List[str]] = None, repeat: int = 20, project_id: Optional[int] = None,
+        import_rows: int = 500) -> dict:
+    """Run scenarios with `names` or all of them, return results with metadata"""
+    scenarios = [s for s in SCENARIOS if not names or s.name in names]
+    # Test client uses `testserver` host
+    with override_settings(ALLOWED_HOSTS=["testserver"]):
+        ctx = context(project_id, import_rows)
+        results = {scenario.name: run_scenario(scenario, ctx, repeat) for scenario in scenarios}
+
+    return {
+        "commit": _commit(),
+        "created_at": timezone.now().isoformat(),
+        "database": connection.vendor,
+        "repeat": repeat,
+        "project": ctx.project.pk,
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict) -> Dict[str, dict]:
+    """Relative change of `METRICS` of every scenario, present in both results"""
+    changes = {}
+    for name, result in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        changes[name] = {
+            metric: round((result[metric] - before[metric]) / before[metric] * 100, 1) if before[metric] else 0.0
+            for metric in METRICS
+        }
+    return changes
@@ -0,0 +1,94 @@
+import hashlib
+import os
+from typing import Iterable, List
+
+from django.core.files import File
+from django.db import models, transaction
+from django.db.models import Exists, OuterRef
+
+from .models import Blob
+
+GC_BATCH_SIZE = 500
+
+
+def file_hash(file: File) -> str:
+    """SHA-256 of `file` content"""
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def store(file: File) -> Blob:
+    """Get blob with content of `file`, the file is saved only for new content
+
+    Must be called in transaction: the blob row is locked until documents
+    referencing it are inserted, so garbage collection can't delete it.
+    """
+    hash = file_hash(file)
+    blob = Blob.objects.select_for_update().filter(hash=hash).first()
+    if blob:
+        return blob
+
+    name = os.path.basename(file.name)
+    blob = Blob(hash=hash, size=file.size)
+    blob.file.save(f"{hash[:2]}/{hash[2:]}/{name}", file, save=False)
+
+    saved = blob.file
+    blob, created = Blob.objects.get_or_create(
+        hash=hash, defaults={"file": saved.name, "size": blob.size}
+    )
+    if created:
+        return blob
+
+    # Same content is stored by concurrent request
+    saved.storage.delete(saved.name)
+    return Blob.objects.select_for_update().get(pk=blob.pk)
+
+
+def attach(model, files: Iterable[File], **parent) -> List[models.Model]:
+    """Create documents of `model` for `files` with `parent` fields, e.g. `element=element`
+
+    Files with the same content share one blob.
+    """
+    with transaction.atomic():
+        documents = []
+        for file in files:
+            blob = store(file)
+            documents.append(model(file=blob.file.name, blob=blob, **parent))
+        return model.objects.bulk_create(documents)
+
+
+def orphans():
+    """Blobs which aren't referenced by any document
+
+    Computed with anti-joins against every table with a foreign key to
+    blobs, so no reference counter has to be kept in sync.
+    """
+    queryset = Blob.objects.all()
+    for relation in Blob._meta.related_objects:
+        queryset = queryset.filter(
+            ~Exists(relation.related_model.objects.filter(**{relation.field.name: OuterRef("pk")}))
+        )
+    return queryset
+
+
+def collect_garbage(batch_size: int = GC_BATCH_SIZE) -> int:
+    """Delete orphaned blobs and their files in batches, return count of deleted blobs"""
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            blobs = list(
+                orphans().select_for_update(skip_locked=True).order_by("pk")[:batch_size]
+            )
+            if not blobs:
+                return deleted
+
+            Blob.objects.filter(pk__in=[blob.pk for blob in blobs]).delete()
+            for blob in blobs:
+                transaction.on_commit(lambda file=blob.file: file.storage.delete(file.name))
+
+        deleted += len(blobs)
+        if len(blobs) < batch_size:
+            return deleted
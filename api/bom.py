@@ -0,0 +1,71 @@
+import csv
+from typing import Iterable, Iterator
+
+from django.db.models import Case, Count, F, Min, QuerySet, Sum, Value, When
+
+from .models import ProjectElement
+from .pricing import EXPRESSIONS
+
+# Keys of rows and titles of columns in reports
+COLUMNS = (
+    ("name", "Наименование"),
+    ("original_title", "Описание"),
+    ("quantity", "Кол-во"),
+    ("measure", "ед-изм"),
+    ("converted_quantity", "Кол-во"),
+    ("second_measure", "доп ед-изм"),
+    ("total_cost", "Сумма"),
+    ("total_weight", "Вес итого"),
+    ("total_volume", "Объем итого"),
+    ("dimension", "Размер"),
+)
+
+
+def bill_of_materials(elements: QuerySet) -> QuerySet:
+    """Rows of `elements` grouped by catalog element, measures and dimension
+
+    Elements, which aren't from catalog, are grouped by title too. Counts,
+    converted counts, cost, weight and volume are summed by one query.
+    """
+    return elements.annotate(
+        custom_title=Case(When(element__isnull=True, then=F("title")), default=Value("")),
+    ).values(
+        "element", "custom_title", "type", "measure", "second_measure", "dimension",
+    ).annotate(
+        name=Min("title"),
+        original_title=Min("element__title"),
+        quantity=Sum("count"),
+        converted_quantity=Sum(EXPRESSIONS["converted_count"]),
+        total_cost=Sum(EXPRESSIONS["cost"]),
+        total_price=Sum(EXPRESSIONS["price"]),
+        total_weight=Sum(EXPRESSIONS["weight"]),
+        total_volume=Sum(EXPRESSIONS["volume"]),
+        occurrences=Count("id"),
+    ).order_by("type", "name", "element")
+
+
+def project_bill_of_materials(project_id: int) -> QuerySet:
+    return bill_of_materials(ProjectElement.objects.filter(construction__stage__project_id=project_id))
+
+
+def projects_bill_of_materials(projects: QuerySet, type: str = ProjectElement.Type.MATERIAL) -> QuerySet:
+    """Elements of `type` of all `projects` summed together, projects are filtered by subquery"""
+    return bill_of_materials(
+        ProjectElement.objects.filter(construction__stage__project__in=projects.values("id"), type=type)
+    )
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows: Iterable[dict]) -> Iterator[str]:
+    """Lines of CSV table of `rows` by `COLUMNS`, written one by one for streaming
+
+    Table starts with BOM, so Excel opens it as UTF-8.
+    """
+    writer = csv.writer(_Echo())
+    yield "\ufeff" + writer.writerow([title for _, title in COLUMNS])
+    for row in rows:
+        yield writer.writerow([row[key] for key, _ in COLUMNS])
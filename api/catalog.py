@@ -0,0 +1,108 @@
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, F, Window
+from django.db.models.functions import RowNumber
+
+from .models import ParentCategory, Element, Revision
+from .search import parse_filters
+from .serializers import ParentCategorySerializer
+
+CATEGORIES = "categories"
+ELEMENTS = "elements"
+
+
+def category_tree(type: str = None) -> list:
+    """Parent categories with nested categories and subcategories
+
+    Tree is built from three queries and cached by revision of categories,
+    so every change of categories makes new cache key. With `type` only
+    parent categories of this type and without type are returned.
+    """
+    key = f"category-tree:{Revision.get(CATEGORIES)}"
+    tree = cache.get(key)
+
+    if tree is None:
+        queryset = ParentCategory.objects.prefetch_related("categories__subcategories").order_by("id")
+        tree = ParentCategorySerializer(queryset, many=True).data
+        cache.set(key, tree, settings.CATEGORY_TREE_TIMEOUT)
+
+    if type:
+        tree = [category for category in tree if category["type"] in (type, ParentCategory.Type.NO)]
+
+    return tree
+
+
+def _group_page(queryset, offset: int, limit: int) -> list:
+    """Rows of `queryset` from `offset` to `offset + limit` inside every subcategory"""
+    queryset = queryset.annotate(
+        subcategory_title=F("subcategory__title"),
+        row_number=Window(
+            RowNumber(),
+            partition_by=[F("subcategory")],
+            order_by=[F("title").asc(), F("id").asc()],
+        ),
+    ).values().order_by()
+    inner, params = queryset.query.sql_with_params()
+
+    qn = connection.ops.quote_name
+    sql = f"""
+        SELECT * FROM ({inner}) AS t
+        WHERE t.{qn("row_number")} > %s AND t.{qn("row_number")} <= %s
+        ORDER BY t.{qn("subcategory_id")}, t.{qn("row_number")}
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, (*params, offset, offset + limit))
+        columns = [column[0] for column in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    for row in rows:
+        del row["row_number"]
+    return rows
+
+
+def element_groups(params) -> list:
+    """Elements grouped by subcategories, ordered by title of subcategory
+
+    Every group has `count` of all its elements and a page of elements
+    from `offset` of `limit` size, filtered by `FILTERS` from `params`.
+    Counts are computed with one aggregate query, pages with one query
+    numbering rows inside every subcategory. Result is cached by
+    revision of elements.
+    """
+    try:
+        limit = min(int(params.get("limit", settings.ELEMENT_GROUP_SIZE)), settings.ELEMENT_GROUP_MAX_SIZE)
+        offset = max(int(params.get("offset", 0)), 0)
+    except ValueError:
+        limit, offset = settings.ELEMENT_GROUP_SIZE, 0
+    limit = max(limit, 0)
+
+    filters = parse_filters(Element, params)
+    query = urlencode(sorted({**filters, "limit": limit, "offset": offset}.items()))
+    key = f"element-groups:{Revision.get(ELEMENTS)}:{query}"
+    groups = cache.get(key)
+
+    if groups is None:
+        queryset = Element.objects.filter(**filters)
+        counts = queryset.values("subcategory", "subcategory__title").annotate(
+            count=Count("id")
+        ).order_by("subcategory__title", "subcategory")
+
+        elements = {}
+        for element in _group_page(queryset, offset, limit):
+            elements.setdefault(element["subcategory_id"], []).append(element)
+
+        groups = [
+            {
+                "id": group["subcategory"],
+                "title": group["subcategory__title"],
+                "count": group["count"],
+                "elements": elements.get(group["subcategory"], []),
+            }
+            for group in counts
+        ]
+        cache.set(key, groups, settings.ELEMENT_GROUPS_TIMEOUT)
+
+    return groups
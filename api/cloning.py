@@ -0,0 +1,191 @@
+import copy
+from typing import Dict, Iterable
+
+from django.db import connection, models, transaction
+
+from .models import (
+    Construction, ConstructionDocument, ConstructionElement, ElementDocument,
+    Project, ProjectDocument, ProjectStage,
+    ProjectConstruction, ProjectConstructionDocument,
+    ProjectElement, ProjectElementDocument,
+    Template, TemplateStage, TemplateConstruction, TemplateElement,
+)
+from .rollups import refresh_totals
+
+
+def copy_instance(instance: models.Model) -> models.Model:
+    """Insert copy of `instance` row and return it"""
+    instance = copy.copy(instance)
+    instance.pk = None
+    instance._state.adding = True
+    instance.save()
+    return instance
+
+
+def copy_rows(
+    model, parent_field: str, parent_map: Dict[int, int], target=None, target_parent_field: str = None
+) -> Dict[int, int]:
+    """Copy rows of `model`, which `parent_field` is in keys of `parent_map`
+
+    Copies are linked to parents from values of `parent_map`. Ids of copies
+    are taken from the table sequence in the same order as originals, rows
+    are copied with one `INSERT ... SELECT` statement.
+
+    With `target` rows are copied to table of other model, like template
+    rows to project ones: columns of the same fields are copied, other
+    columns of `target` get defaults of fields.
+
+    Returns map of original ids to ids of copies.
+    """
+    if not parent_map:
+        return {}
+
+    target = target or model
+    target_parent_field = target_parent_field or parent_field
+
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    target_table = target._meta.db_table
+    pk = model._meta.pk.column
+    target_pk = target._meta.pk.column
+    parent_column = model._meta.get_field(parent_field).column
+    target_parent_column = target._meta.get_field(target_parent_field).column
+
+    source_columns = {field.column for field in model._meta.concrete_fields}
+    fields = [
+        field for field in target._meta.concrete_fields
+        if not field.primary_key and field.column != target_parent_column
+    ]
+    columns = [qn(field.column) for field in fields]
+    copied = [field.column in source_columns and field.column != parent_column for field in fields]
+    values = [
+        f"t.{qn(field.column)}" if is_copied else f"CAST(%s AS {field.db_type(connection)})"
+        for field, is_copied in zip(fields, copied)
+    ]
+    defaults = [
+        field.get_db_prep_save(field.get_default(), connection)
+        for field, is_copied in zip(fields, copied) if not is_copied
+    ]
+
+    sql = f"""
+        WITH parents (old_id, new_id) AS (
+            SELECT * FROM unnest(%s::bigint[], %s::bigint[])
+        ),
+        ids AS (
+            SELECT
+                t.{qn(pk)} AS old_id,
+                nextval(pg_get_serial_sequence(%s, %s)) AS new_id,
+                parents.new_id AS parent_id
+            FROM {qn(table)} AS t
+            JOIN parents ON parents.old_id = t.{qn(parent_column)}
+            ORDER BY t.{qn(pk)}
+        ),
+        inserted AS (
+            INSERT INTO {qn(target_table)} ({qn(target_pk)}, {qn(target_parent_column)}, {", ".join(columns)})
+            SELECT ids.new_id, ids.parent_id, {", ".join(values)}
+            FROM {qn(table)} AS t
+            JOIN ids ON ids.old_id = t.{qn(pk)}
+        )
+        SELECT old_id, new_id FROM ids
+    """
+    params = [list(parent_map.keys()), list(parent_map.values()), target_table, target_pk, *defaults]
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return dict(cursor.fetchall())
+
+
+def link_documents(model, target, field: str, ids: Iterable[int]):
+    """Copy documents of catalog objects to rows, which reference them by `field`
+
+    `model` is document of catalog object, like `ConstructionDocument`,
+    `target` is document of row with `ids`, like `ProjectConstructionDocument`,
+    both reference their objects by `field`. Takes one `INSERT ... SELECT`.
+    Rows are snapshots of catalog documents, like in `ProjectStageUpsert`,
+    only the blob of file is shared.
+    """
+    ids = list(ids)
+    if not ids:
+        return
+
+    qn = connection.ops.quote_name
+    rows = target._meta.get_field(field).related_model
+    parent_column = model._meta.get_field(field).column
+    target_parent_column = target._meta.get_field(field).column
+    columns = [
+        qn(f.column) for f in target._meta.concrete_fields
+        if not f.primary_key and f.column != target_parent_column
+    ]
+
+    sql = f"""
+        INSERT INTO {qn(target._meta.db_table)} ({qn(target_parent_column)}, {", ".join(columns)})
+        SELECT r.{qn(rows._meta.pk.column)}, {", ".join(f"d.{c}" for c in columns)}
+        FROM {qn(model._meta.db_table)} AS d
+        JOIN {qn(rows._meta.db_table)} AS r ON r.{qn(rows._meta.get_field(field).column)} = d.{qn(parent_column)}
+        WHERE r.{qn(rows._meta.pk.column)} = ANY(%s)
+        ORDER BY r.{qn(rows._meta.pk.column)}, d.{qn(model._meta.pk.column)}
+    """
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [ids])
+
+
+def clone_project(project: Project) -> Project:
+    """Copy project with stages, constructions, elements and their documents"""
+    with transaction.atomic():
+        new_project = copy_instance(project)
+        projects = {project.pk: new_project.pk}
+
+        copy_rows(ProjectDocument, "project", projects)
+        stages = copy_rows(ProjectStage, "project", projects)
+        constructions = copy_rows(ProjectConstruction, "stage", stages)
+        copy_rows(ProjectConstructionDocument, "construction", constructions)
+        elements = copy_rows(ProjectElement, "construction", constructions)
+        copy_rows(ProjectElementDocument, "element", elements)
+
+    return new_project
+
+
+def copy_template(template: Template, project: Project):
+    """Copy stages, constructions and elements of `template` to `project`
+
+    Documents of catalog constructions and elements are linked to copies,
+    like for constructions added to stage. Takes fixed number of queries
+    for template of any size.
+    """
+    with transaction.atomic():
+        stages = copy_rows(
+            TemplateStage, "template", {template.pk: project.pk},
+            target=ProjectStage, target_parent_field="project"
+        )
+        constructions = copy_rows(TemplateConstruction, "stage", stages, target=ProjectConstruction)
+        elements = copy_rows(TemplateElement, "construction", constructions, target=ProjectElement)
+
+        link_documents(ConstructionDocument, ProjectConstructionDocument, "construction", constructions.values())
+        link_documents(ElementDocument, ProjectElementDocument, "element", elements.values())
+
+        refresh_totals(list(stages.values()))
+
+
+def clone_template(template: Template) -> Template:
+    """Copy template with stages, constructions and elements"""
+    with transaction.atomic():
+        new_template = copy_instance(template)
+
+        stages = copy_rows(TemplateStage, "template", {template.pk: new_template.pk})
+        constructions = copy_rows(TemplateConstruction, "stage", stages)
+        copy_rows(TemplateElement, "construction", constructions)
+
+    return new_template
+
+
+def clone_construction(construction: Construction) -> Construction:
+    """Copy catalog construction with elements and documents"""
+    with transaction.atomic():
+        new_construction = copy_instance(construction)
+        constructions = {construction.pk: new_construction.pk}
+
+        copy_rows(ConstructionElement, "construction", constructions)
+        copy_rows(ConstructionDocument, "construction", constructions)
+
+    return new_construction
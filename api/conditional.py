@@ -0,0 +1,48 @@
+from typing import Optional, Tuple
+
+from django.core.exceptions import ValidationError
+from django.db.models import QuerySet
+from django.http import HttpRequest, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .media import url_window
+
+
+def conditional(request: HttpRequest, queryset: QuerySet, pk, **extra) -> Tuple[Optional[HttpResponse], dict]:
+    """Check conditional headers of `request` against revision of object `pk`
+
+    Only revision and modification time of object are selected, with `extra`
+    expressions of versions of related data added to `ETag`. Returns
+    `304 Not Modified` response, if object isn't changed, else `None` and
+    `ETag` and `Last-Modified` headers for full response.
+    """
+    try:
+        version = queryset.filter(pk=pk).annotate(**extra).values("revision", "updated_at", *extra).first()
+    except (ValueError, TypeError, ValidationError):
+        # Invalid `pk` is answered by `get_object()` with `404 Not Found`
+        return None, {}
+    if version is None:
+        return None, {}
+
+    updated_at = version["updated_at"].timestamp()
+    # Signed urls of documents in response change with window
+    parts = (queryset.model._meta.model_name, pk, version["revision"], updated_at, url_window())
+    parts += tuple(version[name] for name in extra)
+    etag = quote_etag("-".join(str(part) for part in parts))
+    headers = {"ETag": etag, "Last-Modified": http_date(updated_at)}
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(updated_at))
+    if response is not None:
+        for name, value in headers.items():
+            response.headers[name] = value
+    return response, headers
+
+
+def conditional_revision(request: HttpRequest, name: str, revision: int) -> Tuple[Optional[HttpResponse], dict]:
+    """Same as `conditional` for collection versioned by `Revision` with `name`"""
+    etag = quote_etag(f"{name}-{revision}-{url_window()}")
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        response.headers["ETag"] = etag
+    return response, {"ETag": etag}
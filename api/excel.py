@@ -1,25 +1,76 @@
+import tempfile
+import time
 from typing import List
 
 import openpyxl
-from openpyxl.worksheet.worksheet import Worksheet
-from openpyxl.cell import Cell
+from openpyxl.worksheet._write_only import WriteOnlyWorksheet
+from openpyxl.cell import WriteOnlyCell
 from openpyxl import Workbook
 from openpyxl.styles import Alignment, PatternFill
+from openpyxl.utils import column_index_from_string
 
-from .models import Element
-from django.db import models
+from .bom import COLUMNS, project_bill_of_materials
+from .catalog import ELEMENTS
+from .loaders import report_tree
+from .models import Element, Revision
+from django.db import models, transaction
 from django.core.exceptions import ValidationError
+from django.http import FileResponse
 
-def insert_cells(ws: Worksheet, ws_row: int, cells: dict):
-    """Insert cell value on row of `ws_row`, getted by column letter from `cells`"""
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+IMPORT_BATCH_SIZE = 1000
+IMPORT_MAX_ERRORS = 1000
+
+
+def insert_cells(ws: WriteOnlyWorksheet, ws_row: int, cells: dict):
+    """Append row of `ws_row` with cell values, getted by column letter from `cells`
+
+    Worksheets are write-only, so rows must be inserted in order.
+    """
+    row = []
     for key, value in cells.items():
-        ws[f"{key}{ws_row}"] = value.get("value")
-        ws[f"{key}{ws_row}"].alignment = value.get("alignment", None)
+        index = column_index_from_string(key)
+        if len(row) < index:
+            row.extend([None] * (index - len(row)))
+
+        cell = WriteOnlyCell(ws, value=value.get("value"))
+        if value.get("alignment"):
+            cell.alignment = value["alignment"]
+        if value.get("fill"):
+            cell.fill = value["fill"]
+        row[index - 1] = cell
+
+    ws.append(row)
     return ws, ws_row + 1
 
 
-def foreman(project):
-    stages = project["stages"]
+def insert_merged_cells(ws: WriteOnlyWorksheet, ws_row: int, start: str, end: str, cells: dict):
+    """Merge cells from `start` to `end` column on row of `ws_row` and append the row"""
+    ws.merged_cells.add(f"{start}{ws_row}:{end}{ws_row}")
+    return insert_cells(ws, ws_row, cells)
+
+
+def save_workbook(wb: Workbook):
+    """Save write-only workbook to temporary file, opened for reading"""
+    file = tempfile.TemporaryFile()
+    wb.save(file)
+    file.seek(0)
+    return file
+
+
+def workbook_response(wb: Workbook, filename: str) -> FileResponse:
+    """Stream saved workbook by chunks, instead of load it into memory"""
+    return FileResponse(
+        save_workbook(wb),
+        as_attachment=True,
+        filename=filename,
+        content_type=XLSX_CONTENT_TYPE
+    )
+
+
+def foreman(project_id: int):
+    stages = report_tree(project_id)
     ws1_row = 1
     ws2_row = 1
     ws3_row = 1
@@ -28,23 +79,21 @@ def foreman(project):
     ws2_index = 1
     ws3_index = 1
 
-    wb = openpyxl.Workbook()
-    ws1 = wb.active
-    ws1.title = "Список работ (Бригадир)"
+    wb = openpyxl.Workbook(write_only=True)
+    ws1 = wb.create_sheet("Список работ (Бригадир)")
     ws2 = wb.create_sheet("Список материалов (Бригадир)")
     ws3 = wb.create_sheet("Список общий (Бригадир)")
 
     for stage in stages:
-        ws1.merge_cells(f"A{ws3_row}:I{ws3_row}")
-        ws2.merge_cells(f"A{ws3_row}:I{ws3_row}")
-        ws3.merge_cells(f"A{ws3_row}:I{ws3_row}")
-        ws1[f"A{ws3_row}"] = ws2[f"A{ws3_row}"] = ws3[f"A{ws3_row}"] = f"Этап {stage['order']}. {stage['title']}"
-        ws1[f"A{ws3_row}"].alignment = Alignment(horizontal="center")
-        ws2[f"A{ws3_row}"].alignment = Alignment(horizontal="center")
-        ws3[f"A{ws3_row}"].alignment = Alignment(horizontal="center")
-        ws1_row += 1
-        ws2_row += 1
-        ws3_row += 1
+        cells = {
+            "A": {
+                "value": f"Этап {stage['order']}. {stage['title']}",
+                "alignment": Alignment(horizontal="center")
+            }
+        }
+        ws1, ws1_row = insert_merged_cells(ws1, ws1_row, "A", "I", cells)
+        ws2, ws2_row = insert_merged_cells(ws2, ws2_row, "A", "I", cells)
+        ws3, ws3_row = insert_merged_cells(ws3, ws3_row, "A", "I", cells)
 
         col_headers_work = {
             "B": {"value": "Наименование"},
@@ -52,7 +101,7 @@ def foreman(project):
             "D": {"value": "Кол-во"},
             "E": {"value": "ед-изм"}
         }
-        col_headers = {**cells_work,
+        col_headers = {**col_headers_work,
                 "F": {"value": "Кол-во"},
                 "G": {"value": "доп ед-изм"},
                 "H": {"value": "Вес"},
@@ -85,7 +134,7 @@ def foreman(project):
                             "value": element["title"]
                         },
                         "C": {
-                            "value": element["original_title"]
+                            "value": element.get("original_title")
                         },
                         "D": {
                             "value": element["count"],
@@ -97,7 +146,7 @@ def foreman(project):
                     }
                 cells = {**cells_work,
                         "F": {
-                            "value": element["count"] * element["conversion_rate"],
+                            "value": element["converted_count"],
                             "alignment": Alignment(horizontal="right")
                         },
                         "G": {
@@ -129,24 +178,25 @@ def foreman(project):
     return wb
 
 
-def purchaser(project):
-    stages = project["stages"]
+def purchaser(project_id: int):
+    stages = report_tree(project_id)
     ws1_row = 1
     ws2_row = 1
 
     ws1_index = 1
-    ws2_index = 1
 
-    wb = openpyxl.Workbook()
-    ws1 = wb.active
-    ws1.title = "Список материалов по этапам (Закупщик)"
+    wb = openpyxl.Workbook(write_only=True)
+    ws1 = wb.create_sheet("Список материалов по этапам (Закупщик)")
     ws2 = wb.create_sheet("Список материалов общий (Закупщик)")
 
-    for stage_index, stage in enumerate(stages):
-        ws1.merge_cells(f"A{ws1_row}:F{ws1_row}")
-        ws1[f"A{ws1_row}"] = f"Этап {stage['order']}. {stage['title']}"
-        ws1[f"A{ws1_row}"].alignment = Alignment(horizontal="center")
-        ws1_row += 1
+    for stage in stages:
+        cells = {
+            "A": {
+                "value": f"Этап {stage['order']}. {stage['title']}",
+                "alignment": Alignment(horizontal="center")
+            }
+        }
+        ws1, ws1_row = insert_merged_cells(ws1, ws1_row, "A", "F", cells)
 
         cells = {
             "B": {"value": "Наименование"},
@@ -162,8 +212,6 @@ def purchaser(project):
             "L": {"value": "Размер"}
         }
         ws1, ws1_row = insert_cells(ws1, ws1_row, cells)
-        if stage_index == 0:
-            ws2, ws2_row = insert_cells(ws2, ws2_row, cells)
 
         constructions = stage["constructions"]
         for count_construction, construction in enumerate(constructions, start=1):
@@ -185,7 +233,7 @@ def purchaser(project):
                         "value": element["title"]
                     },
                     "C": {
-                        "value": element["original_title"]
+                        "value": element.get("original_title")
                     },
                     "D": {
                         "value": element["count"],
@@ -195,7 +243,7 @@ def purchaser(project):
                         "value": element["measure"]
                     },
                     "F": {
-                        "value": element["count"] * element["conversion_rate"],
+                        "value": element["converted_count"],
                     },
                     "G": {
                         "value": element["second_measure"]
@@ -222,46 +270,86 @@ def purchaser(project):
                     ws1, ws1_row = insert_cells(ws1, ws1_row, cells)
                     ws1_index += 1
 
-                cells["A"]["value"] = f"{count_construction}.{ws2_index}"
-                cells["I"]["value"] = f"=D{ws2_row}*H{ws2_row}"
-                ws2, ws2_row = insert_cells(ws2, ws2_row, cells)
-                ws2_index += 1
-
             count_construction += 1
 
+    # Elements of all stages summed by catalog element, measures and dimension
+    cells = {
+        "B": {"value": "Наименование"},
+        "C": {"value": "Описание"},
+        "D": {"value": "Кол-во"},
+        "E": {"value": "ед-изм"},
+        "F": {"value": "Кол-во"},
+        "G": {"value": "доп ед-изм"},
+        "H": {"value": "Цена/ед"},
+        "I": {"value": "Сумма"},
+        "J": {"value": "Вес итого"},
+        "K": {"value": "Объем итого"},
+        "L": {"value": "Размер"}
+    }
+    ws2, ws2_row = insert_cells(ws2, ws2_row, cells)
+
+    for index, row in enumerate(project_bill_of_materials(project_id).iterator(), start=1):
+        cells = {
+            "A": {"value": index, "alignment": Alignment(horizontal="right")},
+            "B": {"value": row["name"]},
+            "C": {"value": row["original_title"]},
+            "D": {"value": row["quantity"], "alignment": Alignment(horizontal="right")},
+            "E": {"value": row["measure"]},
+            "F": {"value": row["converted_quantity"]},
+            "G": {"value": row["second_measure"]},
+            "H": {"value": row["total_cost"] / row["quantity"] if row["quantity"] else 0},
+            "I": {"value": f"=D{ws2_row}*H{ws2_row}"},
+            "J": {"value": row["total_weight"]},
+            "K": {"value": row["total_volume"]},
+            "L": {"value": row["dimension"]}
+        }
+        ws2, ws2_row = insert_cells(ws2, ws2_row, cells)
+
+    return wb
+
+
+def procurement(rows):
+    """Materials of several projects, summed by `api.bom.projects_bill_of_materials`"""
+    wb = openpyxl.Workbook(write_only=True)
+    ws1 = wb.create_sheet("Закупка по проектам")
+    ws1.append([None, *(title for _, title in COLUMNS)])
+    for index, row in enumerate(rows, start=1):
+        ws1.append([index, *(row[key] for key, _ in COLUMNS)])
     return wb
 
 
-def estimate(project):
+def estimate(project_id: int):
     def sum_total_price(ws, ws_row, ws_price_cells, word: str):
-        ws.merge_cells(f"A{ws_row}:F{ws_row}")
-        ws[f"A{ws_row}"] = word
-        ws[f"H{ws_row}"] = f"=SUM({';'.join(ws_price_cells)})"
+        cells = {
+            "A": {"value": word},
+            "H": {"value": f"=SUM({';'.join(ws_price_cells)})"}
+        }
+        ws, _ = insert_merged_cells(ws, ws_row, "A", "F", cells)
 
         return ws, ws_row
 
-    stages = project["stages"]
+    stages = report_tree(project_id)
     ws1_row = 1
     ws2_row = 1
 
     ws1_index = 1
 
-    wb = openpyxl.Workbook()
-    ws1 = wb.active
-    ws1.title = "Смета"
+    wb = openpyxl.Workbook(write_only=True)
+    ws1 = wb.create_sheet("Смета")
     ws2 = wb.create_sheet("Смета(сокр)")
 
     ws1_stage_price_cells = []
     ws2_stage_price_cells = []
 
     for stage in stages:
-        ws1.merge_cells(f"A{ws1_row}:H{ws1_row}")
-        ws2.merge_cells(f"A{ws2_row}:H{ws2_row}")
-        ws1[f"A{ws1_row}"] = ws2[f"A{ws2_row}"] = f"Этап {stage['order']}. {stage['title']}"
-        ws1[f"A{ws1_row}"].alignment = Alignment(horizontal="center")
-        ws2[f"A{ws2_row}"].alignment = Alignment(horizontal="center")
-        ws1_row += 1
-        ws2_row += 1
+        cells = {
+            "A": {
+                "value": f"Этап {stage['order']}. {stage['title']}",
+                "alignment": Alignment(horizontal="center")
+            }
+        }
+        ws1, ws1_row = insert_merged_cells(ws1, ws1_row, "A", "H", cells)
+        ws2, ws2_row = insert_merged_cells(ws2, ws2_row, "A", "H", cells)
 
         cells = {
             "B": {"value": "Наименование"},
@@ -282,31 +370,30 @@ def estimate(project):
 
         constructions = stage["constructions"]
         for count_construction, construction in enumerate(constructions, start=1):
+            elements = construction["elements"]
+            elements_price = sum(element["total_cost"] for element in elements)
+
             cells = {
                 "A": {"value": f"{count_construction}. Конструкция"},
                 "B": {"value": construction["title"]},
                 "C": {"value": construction["count"]},
                 "D": {"value": construction["measure"]},
-                "F": {"value": None}
+                "F": {"value": elements_price}
             }
             cells_full = {**cells, 
                 "C": {"value": None},
                 "D": {"value": construction["count"]},
                 "E": {"value": construction["measure"]},
                 "F": {"value": None},
-                "G": {"value": f"=SUM(G{ws1_row + 1}:G{ws1_row + len(construction['elements'])})"}
+                "G": {"value": f"=SUM(G{ws1_row + 1}:G{ws1_row + len(elements)})"}
             }
 
             ws1, ws1_row = insert_cells(ws1, ws1_row, cells_full)
-            cells["F"]["value"] = f"=SUM(F{ws2_row + 1}:F{ws2_row + len(construction['elements'])})"
             ws2, ws2_row = insert_cells(ws2, ws2_row, cells)
 
             ws1_construction_price_cells.append(f"G{ws1_row-1}")
             ws2_construction_price_cells.append(f"F{ws2_row-1}")
 
-            elements_price = 0
-
-            elements = construction["elements"]
             for element in elements:
                 cells = {
                     "A": {
@@ -317,7 +404,7 @@ def estimate(project):
                         "value": element["title"]
                     },
                     "C": {
-                        "value": element["original_title"],
+                        "value": element.get("original_title"),
                     },
                     "D": {
                         "value": element["count"],
@@ -336,9 +423,6 @@ def estimate(project):
 
                 ws1_index += 1
 
-                elements_price += element['cost'] * element['count']
-
-            ws2[f"F{ws2_row - 1}"] = elements_price
             count_construction += 1
 
         ws1, ws1_row = sum_total_price(ws1, ws1_row, ws1_construction_price_cells, "Итого")
@@ -355,47 +439,52 @@ def estimate(project):
     return wb
 
 def export(elements: List[Element]):
-    wb = openpyxl.Workbook()
-    ws1 = wb.active
-    ws1_row = 4
+    wb = openpyxl.Workbook(write_only=True)
+    ws1 = wb.create_sheet()
+    ws1_row = 1
 
     current_category = None
 
-    ws1.merge_cells("D1:E1")
-    ws1["D1"] = "Коммерческие единицы"
-    ws1.merge_cells("F1:G1")
-    ws1["F1"] = "Строительные единицы"
-    ws1.merge_cells("H1:I1")
-    ws1["H1"] = "Себестоимость коммерческие единицы"
-    ws1.merge_cells("J1:K1")
-    ws1["J1"] = "Себестоимость строительные единицы"
-
-    ws1["C2"] = "Наименование"
-    ws1["D2"] = "Ст-ть"
-    ws1["E2"] = "ед"
-    ws1["F2"] = "Ст-ть"
-    ws1["G2"] = "ед"
-    ws1["H2"] = "Ст-ть"
-    ws1["I2"] = "ед"
-    ws1["J2"] = "Ст-ть"
-    ws1["K2"] = "ед"
+    cells = {
+        "D": {"value": "Коммерческие единицы"},
+        "F": {"value": "Строительные единицы"},
+        "H": {"value": "Себестоимость коммерческие единицы"},
+        "J": {"value": "Себестоимость строительные единицы"}
+    }
+    for start, end in (("D", "E"), ("F", "G"), ("H", "I"), ("J", "K")):
+        ws1.merged_cells.add(f"{start}{ws1_row}:{end}{ws1_row}")
+    ws1, ws1_row = insert_cells(ws1, ws1_row, cells)
+
+    cells = {
+        "C": {"value": "Наименование"},
+        "D": {"value": "Ст-ть"},
+        "E": {"value": "ед"},
+        "F": {"value": "Ст-ть"},
+        "G": {"value": "ед"},
+        "H": {"value": "Ст-ть"},
+        "I": {"value": "ед"},
+        "J": {"value": "Ст-ть"},
+        "K": {"value": "ед"}
+    }
+    ws1, ws1_row = insert_cells(ws1, ws1_row, cells)
 
     for element in elements:
-        if not hasattr(element, "subcategory"):
+        if not element.subcategory:
             continue
 
         if not current_category or current_category != element.subcategory.title:
-            if current_category:
-                # Add blank rows
-                ws1_row += 2
+            # Add blank row
+            ws1, ws1_row = insert_cells(ws1, ws1_row, {})
 
             current_category = element.subcategory.title
 
-            ws1.merge_cells(f"C{ws1_row}:K{ws1_row}")
-            ws1[f"C{ws1_row}"].fill = PatternFill(fgColor="FCE89C", fill_type = "solid")
-            ws1[f"C{ws1_row}"] = element.subcategory.title
-
-        ws1_row += 1
+            cells = {
+                "C": {
+                    "value": element.subcategory.title,
+                    "fill": PatternFill(fgColor="FCE89C", fill_type="solid")
+                }
+            }
+            ws1, ws1_row = insert_merged_cells(ws1, ws1_row, "C", "K", cells)
 
         cells = {
             "C": {"value": element.title},
@@ -408,13 +497,18 @@ def export(elements: List[Element]):
             "J": {"value": element.cost},
             "K": {"value": element.second_measure},
         }
-        ws1, _ = insert_cells(ws1, ws1_row, cells)
+        ws1, ws1_row = insert_cells(ws1, ws1_row, cells)
 
     return wb
 
-def q_import(wb: Workbook):
-    ws1 = wb.active
-    elements = []
+def q_import(file, batch_size: int = IMPORT_BATCH_SIZE) -> dict:
+    """Import elements from excel table `file`
+
+    Table is read row by row, valid rows are created by batches of
+    `batch_size` inside one transaction, which is rolled back if any row
+    is invalid. Returns report with errors by cells and throughput.
+    """
+    started = time.monotonic()
     column_map = {
         "A": "title",
         "B": "measure",
@@ -430,8 +524,10 @@ def q_import(wb: Workbook):
         "L": "category",
         "M": "subcategory"
     }
+    columns = [(key, Element._meta.get_field(name)) for key, name in column_map.items()]
 
     errors = []
+    errors_count = 0
     error_messages = {
         "not_exists": "Объекта с id %(value)s не существует!"
     }
@@ -442,41 +538,90 @@ def q_import(wb: Workbook):
         not isinstance(f, models.ForeignObjectRel)
     ]
 
-    row: List[Cell]
-    for row in ws1.iter_rows(min_row=2):
-        data = {}
+    # Ids of related objects, to check relations without query for every cell
+    related_ids = {
+        field.name: set(field.related_model.objects.values_list("id", flat=True))
+        for _, field in columns if field.is_relation
+    }
 
-        if all(v.value is None for v in row):
-            # Skip empty rows
-            continue
+    wb = openpyxl.load_workbook(file, read_only=True)
+    ws1 = wb.active
 
-        for cell in row:
-            field_name = column_map[cell.column_letter]
-            field = Element._meta.get_field(field_name)
+    rows_count = 0
+    created = 0
+    elements = []
 
-            if field.name not in required_fields and not cell.value:
+    with transaction.atomic():
+        for row_index, row in enumerate(
+            ws1.iter_rows(min_row=2, max_col=len(columns), values_only=True),
+            start=2
+        ):
+            if all(v is None for v in row):
+                # Skip empty rows
                 continue
 
-            try:
-                if field.is_relation and not field.related_model.objects.filter(id=cell.value).exists():
-                    # Check if related model exists with cell.value as id
-                    raise ValidationError(
-                        error_messages["not_exists"],
-                        code="invalid_related",
-                        params={"value": int(cell.value)}
-                    )
-
-                field.clean(cell.value, field.model)
-            except ValidationError as e:
-                error = f"{cell.coordinate} - {e.messages[0]}"
-                errors.append(error)
+            rows_count += 1
+            row = tuple(row) + (None,) * (len(columns) - len(row))
+            data = {}
+            row_is_valid = True
+
+            for (column_letter, field), value in zip(columns, row):
+                if field.name not in required_fields and not value:
+                    continue
+
+                try:
+                    if field.is_relation:
+                        value = field.to_python(value)
+                        if value not in related_ids[field.name]:
+                            # Check if related model exists with value as id
+                            raise ValidationError(
+                                error_messages["not_exists"],
+                                code="invalid_related",
+                                params={"value": value}
+                            )
+                    else:
+                        value = field.clean(value, None)
+                except ValidationError as e:
+                    row_is_valid = False
+                    errors_count += 1
+                    if len(errors) < IMPORT_MAX_ERRORS:
+                        errors.append({
+                            "row": row_index,
+                            "cell": f"{column_letter}{row_index}",
+                            "message": e.messages[0]
+                        })
+                    continue
+
+                data[field.attname] = value
+
+            if not row_is_valid or errors_count:
+                # Table will be rolled back, only collect errors
+                elements.clear()
                 continue
 
-            data[field.attname] = cell.value
-
-        elements.append(Element(**data))
-
-    if errors:
-        return None, errors
-
-    return elements, None
\ No newline at end of file
+            elements.append(Element(**data))
+            if len(elements) >= batch_size:
+                created += len(Element.objects.bulk_create(elements))
+                elements.clear()
+
+        if elements:
+            created += len(Element.objects.bulk_create(elements))
+
+        if errors_count:
+            transaction.set_rollback(True)
+            created = 0
+        elif created:
+            # Bulk inserts don't send signals, which version cached elements
+            Revision.bump(ELEMENTS)
+
+    wb.close()
+    elapsed = time.monotonic() - started
+
+    return {
+        "rows": rows_count,
+        "created": created,
+        "errors": errors,
+        "errors_count": errors_count,
+        "elapsed": round(elapsed, 3),
+        "rows_per_second": round(rows_count / elapsed) if elapsed else rows_count,
+    }
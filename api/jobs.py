@@ -0,0 +1,127 @@
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+
+from .models import ExportJob
+from .workers import init_worker
+
+logger = logging.getLogger(__name__)
+
+# Builders of reports from `api.excel`, which is imported on first export
+REPORTS = {
+    ExportJob.Report.FOREMAN: "foreman",
+    ExportJob.Report.PURCHASER: "purchaser",
+    ExportJob.Report.ESTIMATE: "estimate",
+}
+
+_executor = None
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """Pool of export processes, created on first use in each web worker
+
+    Processes are spawned instead of forked, so they don't share database
+    connections with the web worker.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.EXPORT_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(connection.settings_dict["NAME"], settings.MEDIA_ROOT),
+        )
+    return _executor
+
+
+def _discard_executor(executor: ProcessPoolExecutor):
+    global _executor
+    if _executor is executor:
+        _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def submit(job: ExportJob):
+    """Run export `job` in the pool, after the transaction which created it is committed"""
+    transaction.on_commit(lambda: _submit(job.id))
+
+
+def _submit(job_id: int):
+    """Submit job to the pool, broken pool is recreated once
+
+    Pool is broken for good, when any of its processes dies, e.g. killed
+    by OOM killer. If new pool fails too, job is marked as failed instead
+    of raising from `on_commit` after the job is saved.
+    """
+    for _ in range(2):
+        executor = get_executor()
+        try:
+            executor.submit(_run_in_worker, job_id)
+            return
+        except (BrokenProcessPool, RuntimeError) as e:
+            logger.warning("Export pool is broken, it is recreated: %s", e)
+            _discard_executor(executor)
+            error = e
+
+    ExportJob.objects.filter(id=job_id, status=ExportJob.Status.PENDING).update(
+        status=ExportJob.Status.FAILED, error=str(error), finished_at=timezone.now()
+    )
+
+
+def _run_in_worker(job_id: int):
+    close_old_connections()
+    try:
+        run_export(job_id)
+    finally:
+        close_old_connections()
+
+
+def run_export(job_id: int):
+    """Render report of export job with `job_id` and store it under `MEDIA_ROOT`"""
+    from . import excel
+
+    started = ExportJob.objects.filter(
+        id=job_id, status=ExportJob.Status.PENDING
+    ).update(status=ExportJob.Status.RUNNING, started_at=timezone.now())
+    if not started:
+        return
+
+    job = ExportJob.objects.get(id=job_id)
+    try:
+        wb = getattr(excel, REPORTS[job.report])(job.project_id)
+
+        with excel.save_workbook(wb) as file:
+            job.file.save(f"{job.report}-{job.project_id}-{job.id}.xlsx", File(file), save=False)
+        job.status = ExportJob.Status.DONE
+    except Exception as e:
+        logger.exception("Export job %s failed", job_id)
+        job.status = ExportJob.Status.FAILED
+        job.error = str(e)
+
+    job.finished_at = timezone.now()
+    job.save(update_fields=("file", "status", "error", "finished_at"))
+
+
+def fail_stale(jobs: QuerySet = None) -> int:
+    """Mark `jobs`, which are pending or running longer than `EXPORT_TIMEOUT`, as failed
+
+    Queue of the pool is in memory of web worker, so jobs are lost, when
+    worker is restarted. Returns count of failed jobs.
+    """
+    if jobs is None:
+        jobs = ExportJob.objects.all()
+
+    now = timezone.now()
+    deadline = now - timedelta(seconds=settings.EXPORT_TIMEOUT)
+    return jobs.filter(
+        Q(status=ExportJob.Status.PENDING, created_at__lt=deadline)
+        | Q(status=ExportJob.Status.RUNNING, started_at__lt=deadline)
+    ).update(status=ExportJob.Status.FAILED, error="Превышено время выполнения", finished_at=now)
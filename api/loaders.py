@@ -0,0 +1,116 @@
+from itertools import groupby
+from operator import itemgetter
+from typing import Iterable, Iterator
+
+from django.conf import settings
+from django.db.models import F, Prefetch, QuerySet
+
+from .models import (
+    Project, ProjectStage, ProjectConstruction, ProjectElement,
+    Template, TemplateStage, TemplateConstruction, TemplateElement,
+)
+from .pricing import EXPRESSIONS
+
+
+def stage_tree(queryset: QuerySet = None) -> QuerySet:
+    """Project stages with constructions and elements, one query for each level"""
+    if queryset is None:
+        queryset = ProjectStage.objects.all()
+
+    elements = ProjectElement.objects.select_related("element").order_by("id")
+    constructions = ProjectConstruction.objects.order_by("id").prefetch_related(
+        Prefetch("elements", queryset=elements)
+    )
+    return queryset.order_by("order", "id").prefetch_related(
+        Prefetch("constructions", queryset=constructions)
+    )
+
+
+def project_tree(queryset: QuerySet = None) -> QuerySet:
+    """Projects with the whole nested tree used by `ProjectDetailSerializer`
+
+    Every level is fetched with one query, so the number of queries
+    doesn't depend on the count of stages, constructions or elements:
+    project with client, documents, stages, constructions and elements
+    with their catalog element.
+    """
+    if queryset is None:
+        queryset = Project.objects.all()
+
+    return queryset.select_related("client").prefetch_related(
+        "documents",
+        Prefetch("stages", queryset=stage_tree()),
+    )
+
+
+
+class _OrderedGroups:
+    """Rows of iterator ordered by parent, taken group by group in the same order
+
+    Parents without rows get empty groups, every group must be consumed
+    before the next one is taken.
+    """
+
+    def __init__(self, rows: Iterable[dict], key: str):
+        self._groups = groupby(rows, itemgetter(key))
+        self._next = next(self._groups, None)
+
+    def take(self, key) -> Iterator[dict]:
+        if self._next is not None and self._next[0] == key:
+            yield from self._next[1]
+            self._next = next(self._groups, None)
+
+
+def report_tree(project_id: int) -> Iterator[dict]:
+    """Stages of project for excel reports, streamed instead of loaded as a whole
+
+    Stages have iterator of `constructions`, constructions have list of
+    their `elements`, so only elements of one construction are kept in
+    memory. Constructions and elements are read from cursors by chunks of
+    `REPORT_CHUNK_SIZE`, takes three queries.
+    """
+    constructions = ProjectConstruction.objects.filter(stage__project_id=project_id).order_by(
+        "stage__order", "stage_id", "id"
+    ).values("id", "stage_id", "title", "count", "measure")
+    elements = ProjectElement.objects.filter(construction__stage__project_id=project_id).order_by(
+        "construction__stage__order", "construction__stage_id", "construction_id", "id"
+    ).values(
+        "id", "construction_id", "title", "count", "measure", "second_measure", "cost", "type",
+        "weight", "volume", "dimension",
+        original_title=F("element__title"),
+        converted_count=EXPRESSIONS["converted_count"],
+        total_cost=EXPRESSIONS["cost"],
+    )
+    stages = ProjectStage.objects.filter(project_id=project_id).order_by("order", "id").values("id", "order", "title")
+
+    construction_groups = _OrderedGroups(constructions.iterator(settings.REPORT_CHUNK_SIZE), "stage_id")
+    element_groups = _OrderedGroups(elements.iterator(settings.REPORT_CHUNK_SIZE), "construction_id")
+
+    def stage_constructions(stage_id: int) -> Iterator[dict]:
+        for construction in construction_groups.take(stage_id):
+            yield {**construction, "elements": list(element_groups.take(construction["id"]))}
+
+    for stage in stages:
+        yield {**stage, "constructions": stage_constructions(stage["id"])}
+
+
+def template_stage_tree(queryset: QuerySet = None) -> QuerySet:
+    """Template stages with constructions and elements, one query for each level"""
+    if queryset is None:
+        queryset = TemplateStage.objects.all()
+
+    elements = TemplateElement.objects.select_related("element").order_by("id")
+    constructions = TemplateConstruction.objects.order_by("id").prefetch_related(
+        Prefetch("elements", queryset=elements)
+    )
+    return queryset.order_by("order", "id").prefetch_related(
+        Prefetch("constructions", queryset=constructions)
+    )
+
+
+def template_tree(queryset: QuerySet = None) -> QuerySet:
+    """Templates with the whole nested tree used by `TemplateDetailSerilaizer`"""
+    if queryset is None:
+        queryset = Template.objects.all()
+
+    return queryset.prefetch_related(Prefetch("stages", queryset=template_stage_tree()))
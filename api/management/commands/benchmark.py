@@ -0,0 +1,56 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import benchmark
+from api.models import Project
+
+
+class Command(BaseCommand):
+    help = "Measure latency, queries and memory of hot endpoints on current database"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scenario", nargs="*", choices=[s.name for s in benchmark.SCENARIOS], help="All by default"
+        )
+        parser.add_argument("--repeat", type=int, default=20, help="Measured runs of every scenario")
+        parser.add_argument("--project", type=int, help="Id of project, the largest one by default")
+        parser.add_argument("--import-rows", type=int, default=500, help="Rows of imported table")
+        parser.add_argument("--output", help="Save results to JSON file")
+        parser.add_argument("--compare", help="JSON file with results of other run")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options["compare"]:
+            with open(options["compare"]) as f:
+                baseline = json.load(f)
+
+        try:
+            results = benchmark.run(
+                options["scenario"],
+                repeat=options["repeat"],
+                project_id=options["project"],
+                import_rows=options["import_rows"],
+            )
+        except Project.DoesNotExist as e:
+            raise CommandError(e)
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=2)
+
+        changes = benchmark.compare(baseline, results) if baseline else {}
+        self.stdout.write(f"{'scenario':<24}{'status':>8}{'p50 ms':>10}{'p95 ms':>10}{'queries':>9}{'peak KB':>10}")
+        for name, result in results["results"].items():
+            self.stdout.write(
+                f"{name:<24}{result['status']:>8}{result['p50_ms']:>10}{result['p95_ms']:>10}"
+                f"{result['queries']:>9}{result['peak_kb']:>10}"
+            )
+            if name in changes:
+                change = changes[name]
+                line = (
+                    f"{'':<32}{change['p50_ms']:>+9}%{change['p95_ms']:>+9}%"
+                    f"{change['queries']:>+8}%{change['peak_kb']:>+9}%"
+                )
+                worse = any(value > 10 for value in change.values())
+                self.stdout.write(self.style.WARNING(line) if worse else line)
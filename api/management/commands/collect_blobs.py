@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api.blobs import GC_BATCH_SIZE, collect_garbage
+
+
+class Command(BaseCommand):
+    help = "Delete document files which aren't referenced by any document"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=GC_BATCH_SIZE, help="Blobs deleted in one transaction")
+
+    def handle(self, *args, **options):
+        deleted = collect_garbage(options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} files"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.jobs import fail_stale
+
+
+class Command(BaseCommand):
+    help = "Mark export jobs, which weren't finished in EXPORT_TIMEOUT, as failed"
+
+    def handle(self, *args, **options):
+        failed = fail_stale()
+        self.stdout.write(self.style.SUCCESS(f"Failed {failed} export jobs"))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from api.models import ProjectStage
+from api.rollups import refresh_totals
+
+
+class Command(BaseCommand):
+    help = "Recompute totals of all projects, their stages and constructions"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--project", type=int, nargs="*", help="Ids of projects, all by default")
+
+    def handle(self, *args, **options):
+        stages = ProjectStage.objects.all()
+        if options["project"]:
+            stages = stages.filter(project_id__in=options["project"])
+
+        refresh_totals(stages.values("id"))
+        self.stdout.write(self.style.SUCCESS("Totals are recomputed"))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from api.seed import seed
+
+
+class Command(BaseCommand):
+    help = "Create synthetic catalog and projects of given size"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--elements", type=int, default=1000, help="Elements of catalog")
+        parser.add_argument("--constructions", type=int, default=50, help="Constructions of catalog")
+        parser.add_argument("--projects", type=int, default=10)
+        parser.add_argument("--stages", type=int, default=5, help="Stages of every project")
+        parser.add_argument(
+            "--project-constructions", type=int, default=10, help="Constructions of every stage"
+        )
+        parser.add_argument("--project-elements", type=int, default=10, help="Elements of every construction")
+        parser.add_argument("--seed", type=int, default=0, help="Seed of random generator")
+
+    def handle(self, *args, **options):
+        counts = seed(
+            elements=options["elements"],
+            constructions=options["constructions"],
+            projects=options["projects"],
+            stages=options["stages"],
+            project_constructions=options["project_constructions"],
+            project_elements=options["project_elements"],
+            random_seed=options["seed"],
+        )
+        created = ", ".join(f"{count} {name}" for name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f"Created {created}"))
@@ -0,0 +1,38 @@
+import time
+
+from django.conf import settings
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+SALT = "api.media.signed_url"
+
+
+def url_window() -> int:
+    """Current window of signed urls, urls don't change inside window
+
+    Responses with signed urls must be revalidated, when window is changed.
+    """
+    return int(time.time()) // settings.MEDIA_URL_TTL
+
+
+def signature(name: str, expires: int) -> str:
+    return salted_hmac(SALT, f"{name}:{expires}", algorithm="sha256").hexdigest()
+
+
+def signed_url(name: str) -> str:
+    """Url of media file `name`, which is valid from `MEDIA_URL_TTL` to twice of it
+
+    Expiration is rounded to window, so url of the same file is the same
+    for every request inside the window.
+    """
+    expires = (url_window() + 2) * settings.MEDIA_URL_TTL
+    return reverse("signed_media", kwargs={
+        "expires": expires,
+        "signature": signature(name, expires),
+        "file": name,
+    })
+
+
+def verify(name: str, expires: int, value: str) -> bool:
+    """Check signature `value` of url of file `name` and its expiration"""
+    return expires >= time.time() and constant_time_compare(signature(name, expires), value)
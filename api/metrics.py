@@ -0,0 +1,247 @@
+"""Timing of requests by phases: SQL, serialization and rendering
+
+`MetricsMiddleware` sums time and count of queries of request by execute
+wrapper of connections and splits the rest of time to phases:
+
+- `db`: SQL queries of request
+- `serialize`: view without SQL and spans, views of API are serializers
+  over querysets, so it's mostly serialization
+- `render`: rendering of response after view, like JSON of DRF
+- spans, which code marks by `span(name)`, like `xlsx` for openpyxl
+
+Phases are sent in `Server-Timing` header and observed by histograms of
+process, which `/metrics` serves in Prometheus text format. Every worker
+has his own histograms, like token cache stats.
+"""
+import asyncio
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class Timings:
+    """Phases of one request, in seconds"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db = 0.0
+        self.queries = 0
+        self.view_started = None
+        self.view_finished = None
+        # Time of queries, when view was started and finished
+        self.view_started_db = 0.0
+        self.view_finished_db = None
+        self.spans = defaultdict(float)
+
+    def phases(self, finished: float) -> Dict[str, float]:
+        view_started = self.view_started or self.started
+        view_finished = self.view_finished or finished
+        view_db = (self.db if self.view_finished_db is None else self.view_finished_db) - self.view_started_db
+
+        view = view_finished - view_started - view_db - sum(self.spans.values())
+        return {
+            "db": self.db,
+            "serialize": max(view, 0.0),
+            "render": finished - view_finished,
+            **self.spans,
+            "total": finished - self.started,
+        }
+
+
+_current: ContextVar[Optional[Timings]] = ContextVar("timings", default=None)
+
+
+@contextmanager
+def span(name: str):
+    """Count time of block to phase `name` instead of `serialize`, without its SQL"""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+
+    started, db = time.perf_counter(), timings.db
+    try:
+        yield
+    finally:
+        timings.spans[name] += time.perf_counter() - started - (timings.db - db)
+
+
+def _execute(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db += time.perf_counter() - started
+        timings.queries += 1
+
+
+def instrument(connection, **kwargs):
+    if _execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute)
+
+
+# Connections of threads, which run async views, are instrumented when opened
+connection_created.connect(instrument)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...], buckets: tuple):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def samples(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+
+        for labels, counts, total in sorted(series):
+            label = ",".join(f'{name}="{value}"' for name, value in zip(self.labels, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}'
+            yield f"{self.name}_sum{{{label}}} {total}"
+            yield f"{self.name}_count{{{label}}} {cumulative}"
+
+
+request_duration = Histogram(
+    "api_request_duration_seconds", "Duration of requests", ("view", "method", "status"), DURATION_BUCKETS
+)
+phase_duration = Histogram(
+    "api_request_phase_duration_seconds", "Duration of phases of requests", ("view", "phase"), DURATION_BUCKETS
+)
+request_queries = Histogram("api_request_queries", "SQL queries of requests", ("view",), QUERIES_BUCKETS)
+
+HISTOGRAMS = (request_duration, phase_duration, request_queries)
+
+
+def _gauges(name: str, help: str, values: dict, labels: str = ""):
+    for key, value in values.items():
+        if isinstance(value, (int, float)):
+            yield f"# HELP {name}_{key} {help}"
+            yield f"# TYPE {name}_{key} gauge"
+            yield f"{name}_{key}{{{labels}}} {value}" if labels else f"{name}_{key} {value}"
+
+
+def render() -> str:
+    """Histograms of requests, stats of token cache and database pools in Prometheus text format"""
+    from main.postgresql_pool.pool import stats as pool_stats
+
+    from .authentication import token_cache
+
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.samples())
+    lines.extend(_gauges("api_token_cache", "Token cache of process", token_cache.stats()))
+    for pool, stats in pool_stats().items():
+        lines.extend(_gauges("api_db_pool", "Database pool of process", stats, f'pool="{pool}"'))
+    return "\n".join(lines) + "\n"
+
+
+def server_timing(phases: Dict[str, float], queries: int) -> str:
+    values = []
+    for name, duration in phases.items():
+        value = f"{name};dur={duration * 1000:.1f}"
+        if name == "db":
+            value += f';desc="{queries} queries"'
+        values.append(value)
+    return ", ".join(values)
+
+
+class MetricsMiddleware:
+    """Measure phases of requests, enabled by `METRICS_ENABLED` setting"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        token = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            timings = _current.get()
+            _current.reset(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        token = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            timings = _current.get()
+            _current.reset(token)
+        return self.finish(request, response, timings)
+
+    def start(self):
+        for connection in connections.all():
+            instrument(connection)
+        return _current.set(Timings())
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timings = _current.get()
+        if timings is not None:
+            timings.view_started = time.perf_counter()
+            timings.view_started_db = timings.db
+
+    def process_template_response(self, request, response):
+        timings = _current.get()
+        if timings is not None:
+            timings.view_finished = time.perf_counter()
+            timings.view_finished_db = timings.db
+        return response
+
+    def finish(self, request, response, timings: Timings):
+        phases = timings.phases(time.perf_counter())
+        response["Server-Timing"] = server_timing(phases, timings.queries)
+
+        match = request.resolver_match
+        view = match.view_name if match else "unmatched"
+        request_duration.observe((view, request.method, str(response.status_code)), phases["total"])
+        request_queries.observe((view,), timings.queries)
+        for phase, duration in phases.items():
+            if phase != "total":
+                phase_duration.observe((view, phase), duration)
+        return response
@@ -1,4 +1,8 @@
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
+from django.db.models.functions import Now
+
+from .media import signed_url
 
 
 # Create your models here.
@@ -72,6 +76,32 @@ class SubCategory(models.Model):
         return self.title
 
 
+class Versioned(models.Model):
+    """Revision of row, used to answer conditional requests"""
+    revision = models.PositiveBigIntegerField(verbose_name="Версия", default=0, editable=False)
+    updated_at = models.DateTimeField(verbose_name="Дата изменения", auto_now=True)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        self.revision += 1
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, "revision", "updated_at"}
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def touch_kwargs(cls) -> dict:
+        """`update()` kwargs, which bump revision of updated rows"""
+        return {"revision": models.F("revision") + 1, "updated_at": Now()}
+
+    @classmethod
+    def touch(cls, ids):
+        """Bump revision of rows with `ids`, e.g. after changes of their children"""
+        cls.objects.filter(pk__in=ids).update(**cls.touch_kwargs())
+
+
 class BaseElement(models.Model):
     class Type(models.TextChoices):
         MATERIAL = "MATERIAL", "Материал"
@@ -92,7 +122,7 @@ class BaseElement(models.Model):
         abstract = True
 
 
-class Element(BaseElement):
+class Element(BaseElement, Versioned):
     parent_category = models.ForeignKey(
         ParentCategory,
         verbose_name="Родительская категория",
@@ -120,13 +150,40 @@ class Element(BaseElement):
     class Meta:
         verbose_name = "Элемент"
         verbose_name_plural = "Элементы"
+        indexes = [
+            GinIndex(fields=["title"], name="element_title_trgm", opclasses=["gin_trgm_ops"]),
+        ]
 
     def __str__(self):
         return self.title
 
 
+class Blob(models.Model):
+    """
+    Файл документа, общий для всех документов с одинаковым содержимым
+    """
+    hash = models.CharField(verbose_name="SHA-256", max_length=64, unique=True)
+    file = models.FileField(verbose_name="Файл", upload_to="blobs/", max_length=255)
+    size = models.PositiveBigIntegerField(verbose_name="Размер")
+    created_at = models.DateTimeField(verbose_name="Дата создания", auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Файл"
+        verbose_name_plural = "Файлы"
+
+    def __str__(self):
+        return self.file.name
+
+
 class ElementDocument(models.Model):
-    file = models.FileField(verbose_name="Файл")
+    file = models.FileField(verbose_name="Файл", max_length=255)
+    blob = models.ForeignKey(
+        Blob,
+        verbose_name="Общий файл",
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+    )
     element = models.ForeignKey(
         Element,
         verbose_name="Конструкция",
@@ -143,7 +200,7 @@ class ElementDocument(models.Model):
 
     @property
     def file_url(self):
-        return self.file.url
+        return signed_url(self.file.name)
 
 
 class BaseConstruction(models.Model):
@@ -157,7 +214,7 @@ class BaseConstruction(models.Model):
         abstract = True
 
 
-class Construction(BaseConstruction):
+class Construction(BaseConstruction, Versioned):
     parent_category = models.ForeignKey(
         ParentCategory,
         verbose_name="Родительская категория",
@@ -185,13 +242,23 @@ class Construction(BaseConstruction):
     class Meta:
         verbose_name = "Конструкция"
         verbose_name_plural = "Конструкции"
+        indexes = [
+            GinIndex(fields=["title"], name="construction_title_trgm", opclasses=["gin_trgm_ops"]),
+        ]
 
     def __str__(self):
         return self.title
 
 
 class ConstructionDocument(models.Model):
-    file = models.FileField(verbose_name="Файл")
+    file = models.FileField(verbose_name="Файл", max_length=255)
+    blob = models.ForeignKey(
+        Blob,
+        verbose_name="Общий файл",
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+    )
     construction = models.ForeignKey(
         Construction,
         verbose_name="Конструкция",
@@ -208,7 +275,7 @@ class ConstructionDocument(models.Model):
 
     @property
     def file_url(self):
-        return self.file.url
+        return signed_url(self.file.name)
 
 
 class ConstructionElement(models.Model):
@@ -234,6 +301,20 @@ class ConstructionElement(models.Model):
         return self.title
 
 
+class Totals(models.Model):
+    """Totals of project elements, maintained by `api.rollups`"""
+    total_cost = models.FloatField(verbose_name="Себестоимость итого", default=0)
+    total_price = models.FloatField(verbose_name="Цена итого", default=0)
+    total_margin = models.FloatField(verbose_name="Наценка итого", default=0)
+    total_weight = models.FloatField(verbose_name="Вес итого", default=0)
+    total_volume = models.FloatField(verbose_name="Объём итого", default=0)
+
+    FIELDS = ("total_cost", "total_price", "total_margin", "total_weight", "total_volume")
+
+    class Meta:
+        abstract = True
+
+
 class Client(models.Model):
     name = models.CharField(verbose_name="Имя", max_length=60)
     url = models.TextField(verbose_name="Ссылка")
@@ -241,12 +322,15 @@ class Client(models.Model):
     class Meta:
         verbose_name = "Клиент"
         verbose_name_plural = "Клиенты"
+        indexes = [
+            GinIndex(fields=["name"], name="client_name_trgm", opclasses=["gin_trgm_ops"]),
+        ]
 
     def __str__(self):
         return self.name
 
 
-class Project(models.Model):
+class Project(Totals, Versioned):
     class Type(models.TextChoices):
         FINISH = "FINISH", "Закончен"
         WORK = "WORK", "В работе"
@@ -274,7 +358,14 @@ class Project(models.Model):
 
 
 class ProjectDocument(models.Model):
-    file = models.FileField(verbose_name="Файл")
+    file = models.FileField(verbose_name="Файл", max_length=255)
+    blob = models.ForeignKey(
+        Blob,
+        verbose_name="Общий файл",
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+    )
     project = models.ForeignKey(
         Project,
         verbose_name="Проект",
@@ -291,10 +382,10 @@ class ProjectDocument(models.Model):
 
     @property
     def file_url(self):
-        return self.file.url
+        return signed_url(self.file.name)
 
 
-class ProjectStage(models.Model):
+class ProjectStage(Totals):
     project = models.ForeignKey(
         Project,
         verbose_name="Проект",
@@ -314,7 +405,7 @@ class ProjectStage(models.Model):
         return self.title
 
 
-class ProjectConstruction(BaseConstruction):
+class ProjectConstruction(BaseConstruction, Totals):
     construction = models.ForeignKey(
         Construction,
         verbose_name="Конструкция",
@@ -338,7 +429,14 @@ class ProjectConstruction(BaseConstruction):
 
 
 class ProjectConstructionDocument(models.Model):
-    file = models.FileField(verbose_name="Файл")
+    file = models.FileField(verbose_name="Файл", max_length=255)
+    blob = models.ForeignKey(
+        Blob,
+        verbose_name="Общий файл",
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+    )
     construction = models.ForeignKey(
         ProjectConstruction,
         verbose_name="Конструкция",
@@ -355,7 +453,7 @@ class ProjectConstructionDocument(models.Model):
 
     @property
     def file_url(self):
-        return self.file.url
+        return signed_url(self.file.name)
 
 
 class ProjectElement(BaseElement):
@@ -381,14 +479,16 @@ class ProjectElement(BaseElement):
     def __str__(self):
         return self.title
 
-    def update_price(self):
-        self.price = self.element.price
-        self.cost = self.element.cost
-        self.save()
-
 
 class ProjectElementDocument(models.Model):
-    file = models.FileField(verbose_name="Файл")
+    file = models.FileField(verbose_name="Файл", max_length=255)
+    blob = models.ForeignKey(
+        Blob,
+        verbose_name="Общий файл",
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+    )
     element = models.ForeignKey(
         ProjectElement,
         verbose_name="Элемент",
@@ -405,7 +505,7 @@ class ProjectElementDocument(models.Model):
 
     @property
     def file_url(self):
-        return self.file.url
+        return signed_url(self.file.name)
 
 
 class Template(models.Model):
@@ -417,6 +517,9 @@ class Template(models.Model):
     class Meta:
         verbose_name = "Шаблон"
         verbose_name_plural = "Шаблоны"
+        indexes = [
+            GinIndex(fields=["title"], name="template_title_trgm", opclasses=["gin_trgm_ops"]),
+        ]
 
     def __str__(self):
         return self.title
@@ -485,3 +588,70 @@ class TemplateElement(BaseElement):
 
     def __str__(self):
         return self.title
+
+
+class ExportJob(models.Model):
+    class Status(models.TextChoices):
+        PENDING = "PENDING", "В очереди"
+        RUNNING = "RUNNING", "Выполняется"
+        DONE = "DONE", "Готово"
+        FAILED = "FAILED", "Ошибка"
+
+    class Report(models.TextChoices):
+        FOREMAN = "foreman", "Бригадир"
+        PURCHASER = "purchaser", "Закупщик"
+        ESTIMATE = "estimate", "Смета"
+
+    project = models.ForeignKey(
+        Project,
+        verbose_name="Проект",
+        on_delete=models.CASCADE,
+        related_name="export_jobs",
+    )
+    report = models.CharField(verbose_name="Отчёт", max_length=30, choices=Report.choices)
+    status = models.CharField(
+        verbose_name="Статус",
+        max_length=30,
+        choices=Status.choices,
+        default=Status.PENDING
+    )
+    file = models.FileField(verbose_name="Файл", upload_to="exports/", blank=True)
+    error = models.TextField(verbose_name="Ошибка", blank=True)
+    created_at = models.DateTimeField(verbose_name="Дата создания", auto_now_add=True)
+    started_at = models.DateTimeField(verbose_name="Дата запуска", null=True, blank=True)
+    finished_at = models.DateTimeField(verbose_name="Дата завершения", null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Экспорт"
+        verbose_name_plural = "Экспорты"
+
+    def __str__(self):
+        return f"{self.project} - {self.report}"
+
+
+class Revision(models.Model):
+    """Counter of changes of group of models, used as version of caches"""
+    name = models.CharField(verbose_name="Название", max_length=60, unique=True)
+    value = models.PositiveBigIntegerField(verbose_name="Версия", default=0)
+
+    class Meta:
+        verbose_name = "Версия"
+        verbose_name_plural = "Версии"
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+    @classmethod
+    def get(cls, name: str) -> int:
+        return cls.objects.filter(name=name).values_list("value", flat=True).first() or 0
+
+    @classmethod
+    def subquery(cls, name: str) -> models.Subquery:
+        return models.Subquery(cls.objects.filter(name=name).values("value")[:1])
+
+    @classmethod
+    def bump(cls, name: str):
+        if not cls.objects.filter(name=name).update(value=models.F("value") + 1):
+            revision, created = cls.objects.get_or_create(name=name, defaults={"value": 1})
+            if not created:
+                cls.objects.filter(name=name).update(value=models.F("value") + 1)
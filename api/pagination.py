@@ -0,0 +1,50 @@
+from django.conf import settings
+
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+from rest_framework import status
+
+
+class IdCursorPagination(CursorPagination):
+    """Keyset pagination by primary key, newest objects first
+
+    Ordering by primary key is stable and backed by its index, so pages
+    cost the same however deep the cursor is.
+    """
+    ordering = "-id"
+    page_size = settings.PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = 500
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if queryset.query.is_sliced:
+            # Search results are already limited
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
+class PaginationMixin:
+    """Cursor pagination of lists and nested collections of viewset"""
+    pagination_class = IdCursorPagination
+
+    def list_response(self, queryset, serializer_class) -> Response:
+        """Response with page of `queryset`, or with the whole sliced `queryset`"""
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            serializer = serializer_class(queryset, many=True)
+            return Response(serializer.data, status=status.HTTP_200_OK)
+
+        serializer = serializer_class(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    def nested_page(self, name: str, queryset, serializer_class) -> dict:
+        """Page of nested collection `name`, with own cursor query param `<name>_cursor`"""
+        paginator = self.pagination_class()
+        paginator.cursor_query_param = f"{name}_cursor"
+        page = paginator.paginate_queryset(queryset, self.request, view=self)
+
+        return {
+            name: serializer_class(page, many=True).data,
+            f"{name}_next": paginator.get_next_link(),
+            f"{name}_previous": paginator.get_previous_link(),
+        }
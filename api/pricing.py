@@ -0,0 +1,87 @@
+"""Cost and price math of project elements
+
+Formulas of element totals are defined here once: they build NumPy arrays
+and SQL expressions, which are used by stored totals of `api.rollups`,
+bills of materials and reports. Elements of project are loaded into arrays
+once, totals of every element, construction, stage and project are
+computed by vectorized operations instead of loops over dicts.
+"""
+from typing import Dict, Iterable
+
+import numpy as np
+
+from django.db.models import F, QuerySet
+
+# Columns of elements, which totals are computed from
+COLUMNS = ("cost", "price", "count", "conversion_rate", "weight", "volume")
+
+# Totals of element by its columns, which are NumPy arrays or `F()` of fields
+FORMULAS = {
+    "cost": lambda c: c["cost"] * c["count"],
+    "price": lambda c: c["price"] * c["count"],
+    "margin": lambda c: (c["price"] - c["cost"]) * c["count"],
+    "converted_count": lambda c: c["conversion_rate"] * c["count"],
+    "weight": lambda c: c["weight"] * c["count"],
+    "volume": lambda c: c["volume"] * c["count"],
+}
+
+TOTALS = tuple(FORMULAS)
+
+# Totals of `ProjectElement` row as expressions of queries
+EXPRESSIONS = {name: formula({column: F(column) for column in COLUMNS}) for name, formula in FORMULAS.items()}
+
+
+class Pricing:
+    def __init__(self, ids: np.ndarray, construction_ids: np.ndarray, stage_ids: np.ndarray, columns: np.ndarray):
+        """`columns` is matrix of elements by `COLUMNS`"""
+        self.ids = ids
+        self.construction_ids = construction_ids
+        self.stage_ids = stage_ids
+
+        columns = dict(zip(COLUMNS, columns.T))
+        self.totals = {name: formula(columns) for name, formula in FORMULAS.items()}
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[tuple]) -> "Pricing":
+        """Rows are `(id, construction_id, stage_id, *COLUMNS)`"""
+        data = np.array(list(rows), dtype=np.float64).reshape(-1, 3 + len(COLUMNS))
+        ids = data[:, :3].astype(np.int64)
+        return cls(ids[:, 0], ids[:, 1], ids[:, 2], data[:, 3:])
+
+    @classmethod
+    def from_elements(cls, elements: QuerySet) -> "Pricing":
+        """Load `ProjectElement` queryset by one query"""
+        return cls.from_rows(elements.values_list("id", "construction_id", "construction__stage_id", *COLUMNS))
+
+    @classmethod
+    def from_project(cls, project: dict) -> "Pricing":
+        """Load elements of serialized project with stages, like `ProjectDetailSerializer` data"""
+        return cls.from_rows(
+            (element["id"], construction["id"], stage["id"], *(element[name] for name in COLUMNS))
+            for stage in project["stages"]
+            for construction in stage["constructions"]
+            for element in construction["elements"]
+        )
+
+    def elements(self, name: str) -> Dict[int, float]:
+        """Total `name` of every element by id"""
+        return dict(zip(self.ids.tolist(), self.totals[name].tolist()))
+
+    def _group(self, keys: np.ndarray) -> Dict[int, dict]:
+        ids, index = np.unique(keys, return_inverse=True)
+        sums = {
+            name: np.bincount(index, weights=values, minlength=len(ids)).tolist()
+            for name, values in self.totals.items()
+        }
+        return {id: {name: sums[name][i] for name in TOTALS} for i, id in enumerate(ids.tolist())}
+
+    def constructions(self) -> Dict[int, dict]:
+        """Totals of every construction, which has elements, by id"""
+        return self._group(self.construction_ids)
+
+    def stages(self) -> Dict[int, dict]:
+        """Totals of every stage, which has elements, by id"""
+        return self._group(self.stage_ids)
+
+    def total(self) -> Dict[str, float]:
+        return {name: float(self.totals[name].sum()) for name in TOTALS}
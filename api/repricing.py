@@ -0,0 +1,83 @@
+from typing import Iterable, List, Optional
+
+from django.db import connection, transaction
+
+from .models import Element, ProjectStage, ProjectConstruction, ProjectElement
+from .rollups import refresh_totals
+
+
+def _changed_elements_sql(project_ids: Optional[Iterable[int]], element_ids: Optional[Iterable[int]]):
+    """Select project elements which price or cost differs from their catalog element"""
+    qn = connection.ops.quote_name
+    where = []
+    params = []
+
+    if project_ids is not None:
+        where.append(f"ps.{qn('project_id')} = ANY(%s)")
+        params.append(list(project_ids))
+    if element_ids is not None:
+        where.append(f"pe.{qn('element_id')} = ANY(%s)")
+        params.append(list(element_ids))
+
+    sql = f"""
+        SELECT
+            pe.id,
+            ps.{qn("project_id")} AS project,
+            pe.{qn("element_id")} AS element,
+            pe.price AS old_price,
+            e.price,
+            pe.cost AS old_cost,
+            e.cost
+        FROM {qn(ProjectElement._meta.db_table)} AS pe
+        JOIN {qn(Element._meta.db_table)} AS e ON e.id = pe.{qn("element_id")}
+        JOIN {qn(ProjectConstruction._meta.db_table)} AS pc ON pc.id = pe.{qn("construction_id")}
+        JOIN {qn(ProjectStage._meta.db_table)} AS ps ON ps.id = pc.{qn("stage_id")}
+        WHERE (pe.price <> e.price OR pe.cost <> e.cost) AND {" AND ".join(where)}
+    """
+    return sql, params
+
+
+def reprice(
+    project_ids: Optional[Iterable[int]] = None,
+    element_ids: Optional[Iterable[int]] = None,
+    dry_run: bool = False
+) -> List[dict]:
+    """Copy price and cost from catalog elements to project elements
+
+    Project elements are limited by projects with `project_ids` and/or
+    catalog elements with `element_ids`. All rows are updated with one
+    `UPDATE ... FROM` statement.
+
+    Returns list of changed rows with old and new price and cost, with
+    `dry_run` rows are only selected. Totals of changed projects are
+    recomputed.
+    """
+    if project_ids is None and element_ids is None:
+        raise ValueError("Provide `project_ids` or `element_ids` to reprice")
+
+    select, params = _changed_elements_sql(project_ids, element_ids)
+
+    if dry_run:
+        sql = select
+    else:
+        qn = connection.ops.quote_name
+        sql = f"""
+            WITH changed AS ({select} FOR UPDATE OF pe)
+            UPDATE {qn(ProjectElement._meta.db_table)} AS pe
+            SET price = changed.price, cost = changed.cost
+            FROM changed
+            WHERE pe.id = changed.id
+            RETURNING changed.*
+        """
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            columns = [column[0] for column in cursor.description]
+            changes = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+        if changes and not dry_run:
+            projects = {change["project"] for change in changes}
+            refresh_totals(ProjectStage.objects.filter(project_id__in=projects).values("id"))
+
+    return changes
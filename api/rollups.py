@@ -0,0 +1,55 @@
+from typing import Iterable
+
+from django.db.models import F, FloatField, IntegerField, OuterRef, QuerySet, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce, Round
+
+from .models import Totals, Project, ProjectStage, ProjectConstruction, ProjectElement
+from .pricing import EXPRESSIONS
+
+ELEMENT_TOTALS = {field: EXPRESSIONS[field.removeprefix("total_")] for field in Totals.FIELDS}
+
+CHILD_TOTALS = {name: F(name) for name in Totals.FIELDS}
+
+
+def _totals(children: QuerySet, parent_field: str, expressions: dict) -> dict:
+    """Update kwargs, which sum `expressions` of `children` of every updated row"""
+    children = children.filter(**{parent_field: OuterRef("pk")}).order_by().values(parent_field)
+    return {
+        name: Coalesce(
+            Subquery(children.annotate(total=Sum(expression)).values("total")),
+            Value(0.0),
+            output_field=FloatField()
+        )
+        for name, expression in expressions.items()
+    }
+
+
+def refresh_project_totals(project_ids: Iterable[int]):
+    """Sum totals of stages to projects with `project_ids`
+
+    Revision of projects is bumped too, as totals follow changes of their
+    stages, constructions or elements.
+    """
+    totals = _totals(ProjectStage.objects.all(), "project", CHILD_TOTALS)
+    Project.objects.filter(id__in=project_ids).update(
+        **totals,
+        **Project.touch_kwargs(),
+        price=Cast(Round(totals["total_price"]), IntegerField())
+    )
+
+
+def refresh_totals(stage_ids: Iterable[int]):
+    """Recompute totals of stages with `stage_ids`, their constructions and projects
+
+    Only changed stages are summed from their elements, projects are summed
+    from totals of stages. Takes three `UPDATE` statements.
+    """
+    ProjectConstruction.objects.filter(stage_id__in=stage_ids).update(
+        **_totals(ProjectElement.objects.all(), "construction", ELEMENT_TOTALS)
+    )
+    ProjectStage.objects.filter(id__in=stage_ids).update(
+        **_totals(ProjectConstruction.objects.all(), "stage", CHILD_TOTALS)
+    )
+    refresh_project_totals(
+        ProjectStage.objects.filter(id__in=stage_ids).values("project_id")
+    )
@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.contrib.postgres.search import TrigramSimilarity
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import CharField, Q, QuerySet
+from django.db.models.lookups import Contains
+
+# Query params, which filter searched objects by related fields
+FILTERS = ("parent_category", "category", "subcategory", "type")
+
+
+@CharField.register_lookup
+class TrigramContains(Contains):
+    """Case-insensitive substring as `"field" ILIKE %s`
+
+    `icontains` compiles to `UPPER("field"::text) LIKE UPPER(%s)`, which
+    trigram index of bare column can't serve, `ILIKE` uses it.
+    """
+    lookup_name = "trigram_contains"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} ILIKE {rhs}", (*lhs_params, *rhs_params)
+
+
+def parse_filters(model, params) -> dict:
+    """Values of `FILTERS` from `params` parsed by fields of `model`
+
+    Filters, which `model` doesn't have, and invalid values, like not
+    numeric ids, are ignored, as invalid `limit` and `offset`.
+    """
+    values = {}
+    for name in FILTERS:
+        value = params.get(name)
+        if not value:
+            continue
+        try:
+            values[name] = model._meta.get_field(name).to_python(value)
+        except (FieldDoesNotExist, ValidationError):
+            continue
+    return values
+
+
+def search(queryset: QuerySet, field: str, query: str, params) -> QuerySet:
+    """Filter `queryset` by substring or trigram similarity of `field` to `query`
+
+    Both lookups use trigram GIN index of `field`. Objects are ranked by
+    similarity and can be filtered by `FILTERS` from `params`, if model
+    has such fields.
+    """
+    return queryset.filter(**parse_filters(queryset.model, params)).filter(
+        Q(**{f"{field}__trigram_contains": query}) | Q(**{f"{field}__trigram_similar": query})
+    ).annotate(
+        similarity=TrigramSimilarity(field, query)
+    ).order_by("-similarity", "pk")
+
+
+def paginate(queryset: QuerySet, params) -> QuerySet:
+    """Slice search results by `limit` and `offset` from `params`"""
+    try:
+        limit = min(int(params.get("limit", settings.SEARCH_LIMIT)), settings.SEARCH_MAX_LIMIT)
+        offset = max(int(params.get("offset", 0)), 0)
+    except ValueError:
+        limit, offset = settings.SEARCH_LIMIT, 0
+
+    return queryset[offset:offset + max(limit, 0)]
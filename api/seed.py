@@ -0,0 +1,186 @@
+"""Synthetic catalog and projects for benchmarks and local development"""
+import random
+from typing import Dict, List
+
+from django.db import transaction
+
+from .catalog import CATEGORIES, ELEMENTS
+from .models import (
+    ParentCategory, Category, SubCategory, Element, Construction, ConstructionElement,
+    Client, Project, ProjectStage, ProjectConstruction, ProjectElement, Revision
+)
+from .rollups import refresh_totals
+
+BATCH_SIZE = 2000
+
+MATERIALS = (
+    "Гвоздь", "Саморез", "Доска", "Брус", "Фанера", "Гипсокартон", "Кирпич", "Цемент",
+    "Песок", "Утеплитель", "Профиль", "Арматура", "Плитка", "Краска", "Грунтовка", "Клей",
+)
+JOBS = (
+    "Монтаж", "Демонтаж", "Покраска", "Штукатурка", "Кладка", "Заливка", "Шлифовка", "Укладка",
+)
+ADJECTIVES = (
+    "строительный", "оцинкованный", "сухой", "влагостойкий", "обрезной", "усиленный",
+    "фасадный", "кровельный", "финишный", "черновой",
+)
+CONSTRUCTIONS = (
+    "Стена", "Перегородка", "Перекрытие", "Фундамент", "Кровля", "Пол", "Потолок", "Лестница",
+)
+MEASURES = (("шт", "кг"), ("м2", "м2"), ("м3", "т"), ("м", "шт"))
+
+
+def _title(rng: random.Random, words, index: int) -> str:
+    return f"{rng.choice(words)} {rng.choice(ADJECTIVES)} {index}"
+
+
+def _catalog(rng: random.Random, elements: int, constructions: int, construction_elements: int) -> List[Element]:
+    parent_categories = ParentCategory.objects.bulk_create([
+        ParentCategory(title="Материалы", description="Материалы", type=ParentCategory.Type.ELEMENT),
+        ParentCategory(title="Конструкции", description="Конструкции", type=ParentCategory.Type.CONSTRUCTION),
+    ])
+    categories = Category.objects.bulk_create([
+        Category(title=f"Категория {i}", description="", parent_category=parent_categories[i % 2])
+        for i in range(10)
+    ])
+    subcategories = SubCategory.objects.bulk_create([
+        SubCategory(title=f"Подкатегория {i}", description="", category=categories[i % 10])
+        for i in range(50)
+    ])
+    element_subcategories = [s for s in subcategories if s.category.parent_category == parent_categories[0]]
+    construction_subcategories = [s for s in subcategories if s not in element_subcategories]
+
+    rows = []
+    for i in range(elements):
+        subcategory = rng.choice(element_subcategories)
+        element_type = rng.choice((Element.Type.MATERIAL, Element.Type.MATERIAL, Element.Type.JOB))
+        measure, second_measure = rng.choice(MEASURES)
+        cost = round(rng.uniform(1, 5000), 2)
+        rows.append(Element(
+            title=_title(rng, MATERIALS if element_type == Element.Type.MATERIAL else JOBS, i),
+            measure=measure,
+            second_measure=second_measure,
+            cost=cost,
+            price=round(cost * rng.uniform(1.1, 1.6), 2),
+            type=element_type,
+            conversion_rate=round(rng.uniform(0.01, 10), 3),
+            weight=round(rng.uniform(0.01, 50), 3),
+            volume=round(rng.uniform(0.001, 1), 4),
+            parent_category=parent_categories[0],
+            category=subcategory.category,
+            subcategory=subcategory,
+        ))
+    catalog = Element.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+
+    catalog_constructions = Construction.objects.bulk_create([
+        Construction(
+            title=_title(rng, CONSTRUCTIONS, i),
+            measure="м2",
+            parent_category=parent_categories[1],
+            category=subcategory.category,
+            subcategory=subcategory,
+        )
+        for i, subcategory in enumerate(rng.choice(construction_subcategories) for _ in range(constructions))
+    ], batch_size=BATCH_SIZE)
+    ConstructionElement.objects.bulk_create([
+        ConstructionElement(
+            title=element.title,
+            consumption=round(rng.uniform(0.1, 10), 2),
+            element=element,
+            construction=construction,
+        )
+        for construction in catalog_constructions
+        for element in rng.sample(catalog, min(construction_elements, len(catalog)))
+    ], batch_size=BATCH_SIZE)
+    return catalog
+
+
+def _projects(rng: random.Random, catalog: List[Element], projects: int, stages: int, constructions: int,
+              elements: int) -> List[int]:
+    clients = Client.objects.bulk_create([
+        Client(name=f"Клиент {i}", url=f"https://example.com/{i}") for i in range(max(projects // 5, 1))
+    ])
+    project_rows = Project.objects.bulk_create([
+        Project(
+            title=f"Проект {i}",
+            description="Сгенерированный проект",
+            author="seed",
+            status=rng.choice(Project.Type.values),
+            client=rng.choice(clients),
+        )
+        for i in range(projects)
+    ])
+    stage_rows = ProjectStage.objects.bulk_create([
+        ProjectStage(project=project, title=f"Этап {order + 1}", order=order)
+        for project in project_rows
+        for order in range(stages)
+    ], batch_size=BATCH_SIZE)
+    construction_rows = ProjectConstruction.objects.bulk_create([
+        ProjectConstruction(
+            stage=stage,
+            title=_title(rng, CONSTRUCTIONS, i),
+            measure="м2",
+            count=rng.randint(1, 100),
+        )
+        for stage in stage_rows
+        for i in range(constructions)
+    ], batch_size=BATCH_SIZE)
+
+    element_rows = []
+    for construction in construction_rows:
+        for element in rng.sample(catalog, min(elements, len(catalog))):
+            consumption = round(rng.uniform(0.1, 10), 2)
+            element_rows.append(ProjectElement(
+                element=element,
+                construction=construction,
+                title=element.title,
+                measure=element.measure,
+                second_measure=element.second_measure,
+                cost=element.cost,
+                price=element.price,
+                type=element.type,
+                conversion_rate=element.conversion_rate,
+                weight=element.weight,
+                volume=element.volume,
+                consumption=consumption,
+                count=round(consumption * construction.count, 2),
+            ))
+        if len(element_rows) >= BATCH_SIZE:
+            ProjectElement.objects.bulk_create(element_rows, batch_size=BATCH_SIZE)
+            element_rows = []
+    ProjectElement.objects.bulk_create(element_rows, batch_size=BATCH_SIZE)
+
+    return [stage.id for stage in stage_rows]
+
+
+def seed(
+    elements: int = 1000,
+    constructions: int = 50,
+    projects: int = 10,
+    stages: int = 5,
+    project_constructions: int = 10,
+    project_elements: int = 10,
+    random_seed: int = 0,
+) -> Dict[str, int]:
+    """Create catalog of `elements` and `projects` of `stages` × `project_constructions` × `project_elements`
+
+    Rows are created by batches in one transaction, totals of projects are
+    computed at the end. The same `random_seed` gives the same dataset.
+    """
+    rng = random.Random(random_seed)
+    with transaction.atomic():
+        catalog = _catalog(rng, elements, constructions, project_elements)
+        stage_ids = _projects(rng, catalog, projects, stages, project_constructions, project_elements)
+        refresh_totals(stage_ids)
+        # `bulk_create` doesn't send signals, which bump revisions of caches
+        Revision.bump(CATEGORIES)
+        Revision.bump(ELEMENTS)
+
+    return {
+        "elements": len(catalog),
+        "constructions": constructions,
+        "projects": projects,
+        "stages": len(stage_ids),
+        "project_constructions": len(stage_ids) * project_constructions,
+        "project_elements": len(stage_ids) * project_constructions * min(project_elements, len(catalog)),
+    }
@@ -1,13 +1,19 @@
+from django.db import transaction
+
 from rest_framework import serializers
 
 from .models import (
     ParentCategory, Category, SubCategory,
     Element, Construction, ConstructionElement,
     Project, ProjectStage, ProjectConstruction,
-    ProjectConstructionDocument, ProjectElement,
-    ProjectElementDocument, Template, TemplateStage,
-    TemplateConstruction, TemplateElement, Client
+    ProjectElement, Template, TemplateStage,
+    TemplateConstruction, TemplateElement, Client,
+    ExportJob, Totals
 )
+from .cloning import copy_template
+from .loaders import stage_tree, template_stage_tree
+from .rollups import refresh_totals
+from .upsert import ProjectStageUpsert, TemplateStageUpsert
 
 
 class SubCategorySerializer(serializers.ModelSerializer):
@@ -90,27 +96,13 @@ class ConstructionDetailSerializer(serializers.ModelSerializer):
         return instance
 
 
-class ParentCategoryDetailSerializer(ParentCategorySerializer):
-    elements = ElementSerializer(many=True)
-    constructions = ConstructionSerializer(many=True)
-
-
-class CategoryDetailSerializer(CategorySerializer):
-    elements = ElementSerializer(many=True)
-    constructions = ConstructionSerializer(many=True)
-
-
-class SubCategoryDetailSerializer(SubCategorySerializer):
-    elements = ElementSerializer(many=True)
-    constructions = ConstructionSerializer(many=True)
-
-
 class ProjectSerializer(serializers.ModelSerializer):
     client = serializers.SlugRelatedField(slug_field="name", read_only=True)
 
     class Meta:
         model = Project
         fields = "__all__"
+        read_only_fields = Totals.FIELDS
 
 
 class ProjectCreateSerializer(serializers.ModelSerializer):
@@ -123,51 +115,22 @@ class ProjectCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Project
         fields = "__all__"
+        read_only_fields = Totals.FIELDS
 
     def create(self, validated_data):
         template = validated_data.pop("template", None)
-        project = super().create(validated_data)
-
-        bulk_insert_stages = []
-        bulk_insert_constructions = []
-        bulk_insert_elements = []
-
-        if template:
-            data = TemplateDetailSerilaizer(template).data
-            stages = data.pop("stages", [])
-            for stage in stages:
-                del stage["id"]
-                contstructions = stage.pop("constructions", [])
-                stage = ProjectStage(**stage, project=project)
-                bulk_insert_stages.append(stage)
-
-                for construction in contstructions:
-                    template_construction_id = construction.pop("construction")
-                    elements = construction.pop("elements", [])
-                    construction = ProjectConstruction(
-                        **construction,
-                        construction_id=template_construction_id,
-                        stage=stage
-                    )
-                    bulk_insert_constructions.append(construction)
-
-                    for element in elements:
-                        element.pop("original_title")
-                        template_element_id = element.pop("element")
-                        bulk_insert_elements.append(ProjectElement(
-                            **element,
-                            construction=construction,
-                            element_id=template_element_id
-                        ))
-
-            ProjectStage.objects.bulk_create(bulk_insert_stages)
-            ProjectConstruction.objects.bulk_create(bulk_insert_constructions)
-            ProjectElement.objects.bulk_create(bulk_insert_elements)
+
+        with transaction.atomic():
+            project = super().create(validated_data)
+            if template:
+                copy_template(template, project)
+                project.refresh_from_db(fields=(*Totals.FIELDS, "price", "updated_at"))
 
         return project
 
 
 class ProjectElementSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(required=False)
     original_title = serializers.CharField(source="element.title", read_only=True)
 
     class Meta:
@@ -177,11 +140,13 @@ class ProjectElementSerializer(serializers.ModelSerializer):
 
 
 class ProjectConstructionSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(required=False)
     elements = ProjectElementSerializer(many=True, read_only=False)
 
     class Meta:
         model = ProjectConstruction
-        fields = ("id", "title", "count", "measure", "elements", "construction")
+        fields = ("id", "title", "count", "measure", "elements", "construction", *Totals.FIELDS)
+        read_only_fields = Totals.FIELDS
         extra_kwargs = {"stage": {"required": False}}
 
 
@@ -190,77 +155,31 @@ class ProjectStageSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = ProjectStage
-        fields = ("id", "title", "project", "order", "constructions")
+        fields = ("id", "title", "project", "order", "constructions", *Totals.FIELDS)
+        read_only_fields = Totals.FIELDS
         extra_kwargs = {"project": {"required": False}}
 
     def update(self, instance, validated_data):
+        """Update stage, apply `constructions` by difference with existing rows
+
+        Returns data of stage with counts of inserted, updated and deleted
+        constructions and elements in `changes`.
+        """
         constructions = validated_data.pop("constructions", [])
-        stage = super().update(instance, validated_data)
-
-        if constructions:
-            stage.constructions.all().delete()
-
-        bulk_insert_constructions = []
-        bulk_insert_constructions_docs = []
-
-        bulk_insert_elements = []
-        bulk_insert_elements_docs = []
-
-        for construction in constructions:
-            elements = construction.pop("elements", [])
-
-            template_construction = construction.pop("construction", None)
-            construction = ProjectConstruction(
-                **construction,
-                stage=instance,
-                construction=template_construction
-            )
-
-            # Reassign construction documents to project construction
-            if template_construction:
-                for document in template_construction.documents.all():
-                    bulk_insert_constructions_docs.append(
-                        ProjectConstructionDocument(construction=construction, file=document.file)
-                    )
-
-            bulk_insert_constructions.append(construction)
-            for element in elements:
-                template_element = element.pop("element", None)
-                element = ProjectElement(
-                    **element,
-                    construction=construction,
-                )
-
-                if template_element:
-                    element.element = template_element
-
-                    # Add price and cost to element from already used element
-                    if stage.used_elements.get(str(template_element.id)):
-                        element.price = stage.used_elements[str(template_element.id)]["price"]
-                        element.cost = stage.used_elements[str(template_element.id)]["cost"]
-                    else:
-                        stage.used_elements[str(template_element.id)] = {
-                            "price": element.price,
-                            "cost": element.cost,
-                        }
-
-                    # Reassign element documents to project element
-                    for document in template_element.documents.all():
-                        bulk_insert_elements_docs.append(
-                            ProjectElementDocument(element=element, file=document.file)
-                        )
-
-                bulk_insert_elements.append(element)
-
-        ProjectConstruction.objects.bulk_create(bulk_insert_constructions)
-        ProjectConstructionDocument.objects.bulk_create(bulk_insert_constructions_docs)
-
-        ProjectElement.objects.bulk_create(bulk_insert_elements)
-        ProjectElementDocument.objects.bulk_create(bulk_insert_elements_docs)
-
-        stage.save()
-        serializer = ProjectStageSerializer(stage)
-        return serializer.data
+        # Stage isn't changed, if its constructions can't be applied
+        with transaction.atomic():
+            stage = super().update(instance, validated_data)
+
+            changes = {}
+            if constructions:
+                changes = ProjectStageUpsert(stage).run(constructions)
+                stage.save(update_fields=["used_elements"])
+                refresh_totals([stage.id])
+
+        stage = stage_tree().get(pk=stage.pk)
+        data = ProjectStageSerializer(stage).data
+        data["changes"] = changes
+        return data
 
 
 class ProjectDetailSerializer(ProjectSerializer):
@@ -275,20 +194,22 @@ class TemplateSerializer(serializers.ModelSerializer):
 
 
 class TemplateElementSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(required=False)
     original_title = serializers.CharField(source="element.title", read_only=True)
 
     class Meta:
-        model = ProjectElement
-        exclude = ("id", "construction")
+        model = TemplateElement
+        exclude = ("construction",)
         extra_kwargs = {"construction": {"required": False}}
 
 
 class TemplateConstructionSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(required=False)
     elements = TemplateElementSerializer(many=True, read_only=False)
 
     class Meta:
         model = TemplateConstruction
-        exclude = ("id", "stage")
+        exclude = ("stage",)
         extra_kwargs = {"stage": {"required": False}}
 
 
@@ -301,31 +222,19 @@ class TemplateStageSerializer(serializers.ModelSerializer):
         extra_kwargs = {"template": {"required": False}}
 
     def update(self, instance, validated_data):
+        """Update stage, apply `constructions` by difference with existing rows"""
         constructions = validated_data.pop("constructions", [])
-        stage = super().update(instance, validated_data)
+        with transaction.atomic():
+            stage = super().update(instance, validated_data)
 
-        if constructions:
-            stage.constructions.all().delete()
+            changes = {}
+            if constructions:
+                changes = TemplateStageUpsert(stage).run(constructions)
 
-        bulk_insert_constructions = []
-        bulk_insert_elements = []
-
-        for construction in constructions:
-            elements = construction.pop("elements", [])
-            construction = TemplateConstruction(**construction, stage=instance)
-            bulk_insert_constructions.append(construction)
-            for element in elements:
-                bulk_insert_elements.append(
-                    TemplateElement(
-                        **element, construction=construction
-                    )
-                )
-
-        TemplateConstruction.objects.bulk_create(bulk_insert_constructions)
-        TemplateElement.objects.bulk_create(bulk_insert_elements)
-
-        stage = TemplateStage.objects.get(id=instance.id)
-        return TemplateStageSerializer(instance=stage).data
+        stage = template_stage_tree().get(pk=stage.pk)
+        data = TemplateStageSerializer(stage).data
+        data["changes"] = changes
+        return data
 
 
 class TemplateDetailSerilaizer(TemplateSerializer):
@@ -338,5 +247,26 @@ class ClientSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
-class ClientDetailSerializer(ClientSerializer):
-    projects = ProjectSerializer(many=True)
+class ExportJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ExportJob
+        exclude = ("file",)
+        read_only_fields = ("project", "status", "error", "created_at", "started_at", "finished_at")
+
+
+class BillOfMaterialsSerializer(serializers.Serializer):
+    """Row of `api.bom.bill_of_materials`"""
+    element = serializers.IntegerField(allow_null=True)
+    title = serializers.CharField(source="name")
+    original_title = serializers.CharField(allow_null=True)
+    type = serializers.CharField()
+    measure = serializers.CharField()
+    second_measure = serializers.CharField()
+    dimension = serializers.CharField()
+    count = serializers.FloatField(source="quantity")
+    converted_count = serializers.FloatField(source="converted_quantity")
+    total_cost = serializers.FloatField()
+    total_price = serializers.FloatField()
+    total_weight = serializers.FloatField()
+    total_volume = serializers.FloatField()
+    occurrences = serializers.IntegerField()
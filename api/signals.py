@@ -0,0 +1,52 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from rest_framework.authtoken.models import Token
+
+from .authentication import token_cache
+
+from .catalog import CATEGORIES, ELEMENTS
+from .models import (
+    ParentCategory, Category, SubCategory, Element, Revision,
+    Client, Project, ProjectStage, ProjectDocument,
+)
+
+
+@receiver([post_save, post_delete], sender=ParentCategory)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=SubCategory)
+def bump_categories_revision(sender, **kwargs):
+    Revision.bump(CATEGORIES)
+
+
+# Deletion of categories sets fields of elements by `UPDATE` without signals of elements
+@receiver([post_save, post_delete], sender=Element)
+@receiver([post_save, post_delete], sender=SubCategory)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=ParentCategory)
+def bump_elements_revision(sender, **kwargs):
+    Revision.bump(ELEMENTS)
+
+
+@receiver([post_save, post_delete], sender=ProjectStage)
+@receiver([post_save, post_delete], sender=ProjectDocument)
+def touch_project(sender, instance, **kwargs):
+    Project.touch([instance.project_id])
+
+
+# Name of client is rendered in projects, so it's a part of their revision
+@receiver(post_save, sender=Client)
+def touch_client_projects(sender, instance, created, **kwargs):
+    if not created:
+        Project.touch(instance.projects.values("id"))
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance, **kwargs):
+    token_cache.invalidate(instance.key)
+
+
+@receiver([post_save, post_delete], sender=get_user_model())
+def invalidate_user_tokens(sender, instance, **kwargs):
+    token_cache.invalidate_user(instance.pk)
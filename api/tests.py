@@ -1,3 +1,1049 @@
-from django.test import TestCase
+import io
+import os
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import openpyxl
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from main.postgresql_pool.base import reset
+from main.postgresql_pool.pool import ConnectionPool, PoolTimeout
+
+from .models import (
+    ParentCategory, Category, SubCategory, Element, Client, Project, ProjectStage,
+    ProjectConstruction, ProjectElement, ProjectDocument, ExportJob, Blob, Revision, Totals,
+    ElementDocument, ProjectElementDocument, Template, TemplateStage, TemplateConstruction, TemplateElement
+)
+from . import benchmark, jobs, media, metrics
+from .authentication import token_cache
+from .jobs import run_export
+from .loaders import project_tree
+from .pricing import Pricing
+from .rollups import refresh_totals
+from .search import search
+from .seed import seed
+from .serializers import ProjectDetailSerializer
+
+
+def create_project_tree(stages: int, constructions: int, elements: int) -> Project:
+    client = Client.objects.create(name="Клиент", url="https://example.com")
+    project = Project.objects.create(
+        title="Проект",
+        description="Описание",
+        author="Автор",
+        status=Project.Type.WORK,
+        client=client
+    )
+    element = Element.objects.create(
+        title="Гвоздь",
+        measure="шт",
+        second_measure="кг",
+        cost=1,
+        price=2,
+        type=Element.Type.MATERIAL,
+        conversion_rate=0.01,
+        weight=0.01,
+        volume=0.001
+    )
+
+    for stage_order in range(stages):
+        stage = ProjectStage.objects.create(project=project, title="Этап", order=stage_order)
+        for _ in range(constructions):
+            construction = ProjectConstruction.objects.create(
+                stage=stage,
+                title="Конструкция",
+                measure="шт",
+                count=1
+            )
+            ProjectElement.objects.bulk_create([
+                ProjectElement(
+                    element=element,
+                    construction=construction,
+                    title="Гвоздь",
+                    measure="шт",
+                    second_measure="кг",
+                    cost=1,
+                    price=2,
+                    type=Element.Type.MATERIAL,
+                    conversion_rate=0.01,
+                    weight=0.01,
+                    volume=0.001,
+                    count=10
+                )
+                for _ in range(elements)
+            ])
+
+    return project
+
+
+class ProjectTreeQueriesTest(TestCase):
+    # project with client, documents, stages, constructions, elements
+    tree_queries = 5
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("user"))
+
+    def assertConstantQueries(self, url_name, queries):
+        for size in (1, 5):
+            project = create_project_tree(stages=size, constructions=size, elements=size)
+            url = reverse(f"api:projects-{url_name}", args=(project.pk,))
+            with self.assertNumQueries(queries):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+    def test_retrieve(self):
+        # and revision of project for conditional request
+        self.assertConstantQueries("detail", self.tree_queries + 1)
+
+    def test_retrieve_data(self):
+        project = create_project_tree(stages=2, constructions=2, elements=2)
+        response = self.client.get(reverse("api:projects-detail", args=(project.pk,)))
+
+        stages = response.data["stages"]
+        self.assertEqual([stage["order"] for stage in stages], [0, 1])
+        element = stages[0]["constructions"][0]["elements"][0]
+        self.assertEqual(element["original_title"], "Гвоздь")
+
+    # project, stages, constructions and elements of reports, read by chunks
+    report_queries = 4
+
+    def test_excel_foreman(self):
+        self.assertConstantQueries("excel/foreman", self.report_queries)
+
+    def test_excel_purchaser(self):
+        # and bill of materials
+        self.assertConstantQueries("excel/purchaser", self.report_queries + 1)
+
+    def test_excel_estimate(self):
+        self.assertConstantQueries("excel/estimate", self.report_queries)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ExportJobTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("user"))
+
+    def test_export(self):
+        project = create_project_tree(stages=2, constructions=2, elements=2)
+        response = self.client.post(
+            reverse("api:projects-exports", args=(project.pk,)),
+            {"report": ExportJob.Report.ESTIMATE}
+        )
+        self.assertEqual(response.status_code, 202)
+        job_id = response.data["id"]
+
+        response = self.client.get(reverse("api:exports-download", args=(job_id,)))
+        self.assertEqual(response.status_code, 409)
+
+        run_export(job_id)
+
+        response = self.client.get(reverse("api:exports-detail", args=(job_id,)))
+        self.assertEqual(response.data["status"], ExportJob.Status.DONE)
+
+        response = self.client.get(reverse("api:exports-download", args=(job_id,)))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["X-Accel-Redirect"].startswith("/internal/exports/"))
+
+    def test_stale(self):
+        project = create_project_tree(stages=1, constructions=1, elements=1)
+        hour_ago = timezone.now() - timedelta(hours=1)
+        # Jobs lost by restart of worker before and after start
+        pending = ExportJob.objects.create(project=project, report=ExportJob.Report.ESTIMATE)
+        running = ExportJob.objects.create(
+            project=project, report=ExportJob.Report.ESTIMATE, status=ExportJob.Status.RUNNING, started_at=hour_ago
+        )
+        ExportJob.objects.filter(pk=pending.pk).update(created_at=hour_ago)
+        fresh = ExportJob.objects.create(project=project, report=ExportJob.Report.ESTIMATE)
+
+        response = self.client.get(reverse("api:exports-detail", args=(running.pk,)))
+        self.assertEqual(response.data["status"], ExportJob.Status.FAILED)
+
+        call_command("fail_stale_exports", stdout=io.StringIO())
+        statuses = dict(ExportJob.objects.values_list("pk", "status"))
+        self.assertEqual(statuses[pending.pk], ExportJob.Status.FAILED)
+        self.assertEqual(statuses[fresh.pk], ExportJob.Status.PENDING)
+
+        run_export(pending.pk)
+        self.assertEqual(ExportJob.objects.get(pk=pending.pk).status, ExportJob.Status.FAILED)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ExportPoolTest(TransactionTestCase):
+    def tearDown(self):
+        jobs._discard_executor(jobs.get_executor())
+
+    def wait(self, condition, timeout=60):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.1)
+
+    def test_broken_pool(self):
+        project = create_project_tree(stages=1, constructions=1, elements=1)
+        executor = jobs.get_executor()
+        executor.submit(os.getpid).result(timeout=60)
+
+        # Process of pool is killed, e.g. by OOM killer, so pool is broken
+        for process in list(executor._processes.values()):
+            process.kill()
+        self.wait(lambda: executor._broken)
+
+        job = ExportJob.objects.create(project=project, report=ExportJob.Report.ESTIMATE)
+        jobs.submit(job)
+        self.assertIsNot(jobs.get_executor(), executor)
+        self.wait(lambda: ExportJob.objects.get(pk=job.pk).status == ExportJob.Status.DONE)
+
+
+class UpdatePriceTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("user"))
+
+    def test_update_price(self):
+        project = create_project_tree(stages=2, constructions=2, elements=2)
+        Element.objects.update(price=5, cost=3)
+        url = reverse("api:projects-update-price", args=(project.pk,))
+
+        response = self.client.get(url, {"dry_run": 1})
+        self.assertEqual(len(response.data["changes"]), 8)
+        self.assertEqual(response.data["changes"][0]["old_price"], 2)
+        self.assertEqual(response.data["changes"][0]["price"], 5)
+        self.assertFalse(ProjectElement.objects.filter(price=5).exists())
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(ProjectElement.objects.filter(price=5, cost=3).count(), 8)
+
+    def test_update_element_price(self):
+        create_project_tree(stages=1, constructions=1, elements=2)
+        second = create_project_tree(stages=1, constructions=1, elements=2)
+        element = ProjectElement.objects.filter(construction__stage__project=second).first().element
+        element.price = 5
+        element.save()
+
+        response = self.client.post(reverse("api:elements-update-price", args=(element.pk,)))
+        self.assertEqual(len(response.data["changes"]), 2)
+        self.assertEqual(ProjectElement.objects.filter(price=5).count(), 2)
+
+
+class ElementImportTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("user"))
+        self.parent_category = ParentCategory.objects.create(
+            title="Материалы",
+            description="Материалы",
+            type=ParentCategory.Type.ELEMENT
+        )
+
+    def post_table(self, rows):
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        ws.append(["Название"])
+        for row in rows:
+            ws.append(row)
+
+        file = io.BytesIO()
+        wb.save(file)
+        file.seek(0)
+        file.name = "elements.xlsx"
+        return self.client.post(reverse("api:elements-import"), {"file": file})
+
+    def row(self, title, parent_category):
+        return [title, "шт", "кг", 1, 2, "MATERIAL", "", 0.5, 1, 1, parent_category]
+
+    def test_import(self):
+        rows = [self.row(f"Элемент {i}", self.parent_category.id) for i in range(5)]
+        Revision.bump("elements")
+        # related ids, savepoint of transaction, batch of elements, revision
+        with self.assertNumQueries(7):
+            response = self.post_table(rows)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["rows"], 5)
+        self.assertEqual(response.data["created"], 5)
+        self.assertEqual(Element.objects.count(), 5)
+
+    def test_import_errors(self):
+        rows = [
+            self.row("Элемент", self.parent_category.id),
+            self.row("Элемент", self.parent_category.id + 1),
+        ]
+        response = self.post_table(rows)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["errors"][0]["cell"], "K3")
+        self.assertEqual(Element.objects.count(), 0)
+
+
+class CloneTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("user"))
+
+    def test_clone_project(self):
+        for size in (1, 5):
+            project = create_project_tree(stages=size, constructions=size, elements=size)
+            ProjectDocument.objects.create(project=project, file="plan.pdf")
+
+            # project, savepoint, copy of project with 6 levels of rows, client name
+            with self.assertNumQueries(1 + 2 + 7 + 1):
+                response = self.client.post(reverse("api:projects-clone", args=(project.pk,)))
+            self.assertEqual(response.status_code, 201)
+
+            clone = Project.objects.get(pk=response.data["id"])
+            self.assertEqual(clone.documents.count(), 1)
+            self.assertEqual(
+                ProjectElement.objects.filter(construction__stage__project=clone).count(),
+                size ** 3
+            )
+
+    def test_create_from_template(self):
+        element = Element.objects.create(
+            title="Гвоздь", measure="шт", second_measure="кг", cost=1, price=2,
+            type=Element.Type.MATERIAL, conversion_rate=1, weight=1, volume=1
+        )
+        ElementDocument.objects.create(element=element, file="nail.pdf")
+        client = Client.objects.create(name="Клиент", url="https://example.com")
+
+        for size in (1, 5):
+            template = Template.objects.create(title="Шаблон", description="Описание")
+            for order in range(size):
+                stage = TemplateStage.objects.create(template=template, title="Этап", order=order)
+                for _ in range(size):
+                    construction = TemplateConstruction.objects.create(
+                        stage=stage, title="Конструкция", measure="шт", count=2
+                    )
+                    TemplateElement.objects.bulk_create([
+                        TemplateElement(
+                            construction=construction, element=element, title="Гвоздь", measure="шт",
+                            second_measure="кг", cost=1, price=2, type=Element.Type.MATERIAL,
+                            conversion_rate=1, weight=1, volume=1, count=3
+                        )
+                        for _ in range(size)
+                    ])
+
+            # template, client, savepoint, project, savepoint, 3 levels of rows, 2 of documents,
+            # 3 of totals, totals of project, savepoint of uploaded documents
+            with self.assertNumQueries(1 + 1 + 2 + 1 + 2 + 3 + 2 + 3 + 1 + 2):
+                response = self.client.post(reverse("api:projects-list"), {
+                    "title": "Проект", "description": "Описание", "author": "Автор",
+                    "status": Project.Type.WORK, "template": template.pk, "client": client.pk,
+                })
+            self.assertEqual(response.status_code, 201)
+
+            elements = ProjectElement.objects.filter(construction__stage__project_id=response.data["id"])
+            self.assertEqual(elements.count(), size ** 3)
+            self.assertEqual(ProjectElementDocument.objects.filter(element__in=elements).count(), size ** 3)
+            self.assertEqual(response.data["total_price"], 2 * 3 * size ** 3)
+
+
+class ElementSearchTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("user"))
+        for title in ("Гвоздь строительный", "Строительный гвоздь", "Гвоздик", "Доска"):
+            Element.objects.create(
+                title=title, measure="шт", second_measure="кг",
+                type=Element.Type.MATERIAL, conversion_rate=1, weight=1, volume=1
+            )
+
+    def test_search(self):
+        response = self.client.get(reverse("api:elements-list"), {"title": "гвоздь"})
+        titles = [element["title"] for element in response.data]
+        self.assertIn("Строительный гвоздь", titles)
+        self.assertNotIn("Доска", titles)
+
+    def test_search_limit(self):
+        response = self.client.get(reverse("api:elements-list"), {"title": "гвоздь", "limit": 1})
+        self.assertEqual(len(response.data), 1)
+
+        response = self.client.get(reverse("api:elements-list"), {"title": "гвоздь", "type": "JOB"})
+        self.assertEqual(len(response.data), 0)
+
+    def test_index(self):
+        # Table of test is small, so planner is asked to prefer index as on large catalog
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        plan = search(Element.objects.all(), "title", "гвоздь", {}).explain()
+        self.assertIn("Bitmap Index Scan on element_title_trgm", plan)
+        self.assertNotIn("Seq Scan", plan)
+
+
+class CursorPaginationTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("user"))
+
+    def test_list(self):
+        for _ in range(3):
+            create_project_tree(stages=0, constructions=0, elements=0)
+
+        response = self.client.get(reverse("api:projects-list"), {"page_size": 2})
+        self.assertEqual(len(response.data["results"]), 2)
+
+        response = self.client.get(response.data["next"])
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertIsNone(response.data["next"])
+
+    def test_nested_projects(self):
+        project = create_project_tree(stages=0, constructions=0, elements=0)
+        for _ in range(2):
+            Project.objects.create(
+                title="Проект", description="", author="", status=Project.Type.WORK, client=project.client
+            )
+
+        url = reverse("api:clients-detail", args=(project.client.pk,))
+        response = self.client.get(url, {"page_size": 2})
+        self.assertEqual(len(response.data["projects"]), 2)
+
+        response = self.client.get(response.data["projects_next"])
+        self.assertEqual([p["id"] for p in response.data["projects"]], [project.pk])
+
+
+class TotalsTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("user"))
+
+    def element_data(self, **kwargs):
+        return {
+            "title": "Гвоздь",
+            "measure": "шт",
+            "second_measure": "кг",
+            "type": Element.Type.MATERIAL,
+            "conversion_rate": 0.01,
+            "weight": 0.5,
+            "volume": 0.1,
+            "cost": 1,
+            "price": 3,
+            "count": 10,
+            **kwargs
+        }
+
+    def test_stage_update(self):
+        project = create_project_tree(stages=2, constructions=1, elements=1)
+        call_command("refresh_totals", project=[project.pk], stdout=io.StringIO())
+        stage = project.stages.first()
+        url = reverse("api:projects-stages", args=(project.pk, stage.pk))
+
+        response = self.client.patch(url, {"constructions": [
+            {
+                "title": "Каркас",
+                "count": 1,
+                "measure": "шт",
+                "elements": [self.element_data(), self.element_data(count=20)]
+            }
+        ]}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["total_cost"], 30)
+        self.assertEqual(response.data["total_price"], 90)
+        self.assertEqual(response.data["total_margin"], 60)
+        self.assertEqual(response.data["constructions"][0]["total_weight"], 15)
+
+        # Other stage has one element for 2 * 10
+        project.refresh_from_db()
+        self.assertEqual(project.total_price, 110)
+        self.assertEqual(project.price, 110)
+
+        self.client.delete(url)
+        project.refresh_from_db()
+        self.assertEqual(project.total_price, 20)
+
+
+class StageUpsertTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("user"))
+
+    def test_stage_update(self):
+        project = create_project_tree(stages=1, constructions=2, elements=3)
+        stage = project.stages.get()
+        url = reverse("api:projects-stages", args=(project.pk, stage.pk))
+        constructions = self.client.get(
+            reverse("api:projects-detail", args=(project.pk,))
+        ).data["stages"][0]["constructions"]
+
+        first, second = constructions
+        kept = second["elements"][0]
+        first["elements"][0]["count"] = 5
+        del first["elements"][1]["id"]
+        del first["elements"][2]
+
+        response = self.client.patch(url, {"constructions": constructions}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["changes"], {
+            "constructions": {"inserted": 0, "updated": 0, "deleted": 0},
+            "elements": {"inserted": 1, "updated": 1, "deleted": 2},
+        })
+        self.assertEqual(ProjectElement.objects.get(pk=first["elements"][0]["id"]).count, 5)
+        self.assertTrue(ProjectElement.objects.filter(pk=kept["id"]).exists())
+        self.assertEqual(ProjectElement.objects.filter(construction__stage=stage).count(), 5)
+
+        # Stage without one of constructions deletes it with elements
+        response = self.client.patch(url, {"constructions": [second]}, format="json")
+        self.assertEqual(response.data["changes"], {
+            "constructions": {"inserted": 0, "updated": 0, "deleted": 1},
+            "elements": {"inserted": 0, "updated": 0, "deleted": 2},
+        })
+        self.assertEqual(len(response.data["constructions"]), 1)
+
+    def test_stage_update_atomic(self):
+        project = create_project_tree(stages=1, constructions=2, elements=3)
+        stage = project.stages.get()
+        url = reverse("api:projects-stages", args=(project.pk, stage.pk))
+        constructions = self.client.get(
+            reverse("api:projects-detail", args=(project.pk,))
+        ).data["stages"][0]["constructions"]
+        del constructions[1]
+
+        # Failure after rows are written rolls back them and fields of stage
+        with mock.patch("api.serializers.refresh_totals", side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.client.patch(url, {"title": "Новый", "constructions": constructions}, format="json")
+
+        stage.refresh_from_db()
+        self.assertEqual(stage.title, "Этап")
+        self.assertEqual(ProjectElement.objects.filter(construction__stage=stage).count(), 2 * 3)
+
+
+class ElementGroupsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("user"))
+        parent_category = ParentCategory.objects.create(
+            title="Материалы", description="", type=ParentCategory.Type.ELEMENT
+        )
+        category = Category.objects.create(title="Крепёж", description="", parent_category=parent_category)
+        self.bolts = SubCategory.objects.create(title="Болты", description="", category=category)
+        self.nails = SubCategory.objects.create(title="Гвозди", description="", category=category)
+
+        for title in ("В", "А", "Б"):
+            self.create_element(title, self.nails)
+        self.create_element("Болт", self.bolts)
+
+    def create_element(self, title, subcategory):
+        return Element.objects.create(
+            title=title,
+            measure="шт",
+            second_measure="кг",
+            type=Element.Type.MATERIAL,
+            conversion_rate=1,
+            weight=1,
+            volume=1,
+            subcategory=subcategory,
+        )
+
+    def test_groups(self):
+        url = reverse("api:elements-filter")
+        # revision, group counts, page of every group
+        with self.assertNumQueries(3):
+            response = self.client.get(url, {"limit": 2})
+
+        groups = response.data
+        self.assertEqual([group["title"] for group in groups], ["Болты", "Гвозди"])
+        self.assertEqual([group["count"] for group in groups], [1, 3])
+        self.assertEqual([element["title"] for element in groups[1]["elements"]], ["А", "Б"])
+
+        response = self.client.get(url, {"limit": 2, "offset": 2, "subcategory": self.nails.pk})
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual([element["title"] for element in response.data[0]["elements"]], ["В"])
+
+    def test_cache(self):
+        url = reverse("api:elements-filter")
+        self.client.get(url)
+        with self.assertNumQueries(1):
+            self.client.get(url)
+
+        self.create_element("Гайка", self.bolts)
+        response = self.client.get(url)
+        self.assertEqual(response.data[0]["count"], 2)
+
+    def test_cache_of_deleted_category(self):
+        url = reverse("api:elements-filter")
+        category = Category.objects.create(
+            title="Инструмент", description="", parent_category=self.nails.category.parent_category
+        )
+        element = self.create_element("Молоток", None)
+        Element.objects.filter(pk=element.pk).update(category=category)
+        params = {"category": category.pk}
+        self.assertEqual(len(self.client.get(url, params).data), 1)
+
+        # Category of element is set to null by `UPDATE` of cascade, without signals of elements
+        category.delete()
+        self.assertEqual(self.client.get(url, params).data, [])
+
+    def test_invalid_filters(self):
+        url = reverse("api:elements-filter")
+        response = self.client.get(url, {"subcategory": "x", "category": "", "limit": "y"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([group["count"] for group in response.data], [1, 3])
+
+        response = self.client.get(url, {"subcategory": self.nails.pk, "type": Element.Type.MATERIAL})
+        self.assertEqual([group["title"] for group in response.data], ["Гвозди"])
+
+
+class TokenCacheTest(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.user = User.objects.create_user("admin", is_staff=True)
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+    def test_cache(self):
+        url = reverse("api:auth-cache-stats")
+        with self.assertNumQueries(1):
+            self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.data["hits"], 1)
+        self.assertEqual(response.data["misses"], 1)
+
+        # Logout deletes token
+        self.token.delete()
+        self.assertEqual(self.client.get(url).status_code, 401)
+
+
+class SignedMediaTest(TestCase):
+    def test_signed_url(self):
+        project = create_project_tree(stages=0, constructions=0, elements=0)
+        document = ProjectDocument.objects.create(project=project, file="plans/plan 1.pdf")
+        url = document.file_url
+        self.assertTrue(url.startswith("/media/signed/"))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Accel-Redirect"], "/internal/plans/plan 1.pdf")
+
+        self.assertEqual(self.client.get(url.replace("plan%201", "plan%202")).status_code, 403)
+
+    def test_expired_url(self):
+        expires = int(time.time()) - 1
+        url = reverse("signed_media", kwargs={
+            "expires": expires, "signature": media.signature("plan.pdf", expires), "file": "plan.pdf"
+        })
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+
+class AsyncReadTest(TransactionTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("user"))
+
+    def test_project(self):
+        project = create_project_tree(stages=2, constructions=1, elements=1)
+        url = reverse("api:async-projects-detail", args=(project.pk,))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json(),
+            self.client.get(reverse("api:projects-detail", args=(project.pk,))).json()
+        )
+
+    def test_unauthorized(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(reverse("api:async-elements-list")).status_code, 401)
+
+
+class SeedBenchmarkTest(TestCase):
+    def test_seed(self):
+        counts = seed(elements=20, constructions=2, projects=2, stages=2, project_constructions=3, project_elements=4)
+        self.assertEqual(counts["project_elements"], 2 * 2 * 3 * 4)
+        self.assertEqual(ProjectElement.objects.count(), counts["project_elements"])
+        self.assertFalse(Project.objects.filter(total_price=0).exists())
+
+    def test_benchmark(self):
+        seed(elements=20, constructions=2, projects=1, stages=1, project_constructions=2, project_elements=2)
+        elements = ProjectElement.objects.count()
+
+        results = benchmark.run(["project_retrieve", "stage_patch"], repeat=2)
+        self.assertEqual(results["results"]["project_retrieve"]["status"], 200)
+        self.assertEqual(results["results"]["stage_patch"]["status"], 200)
+        self.assertGreater(results["results"]["project_retrieve"]["queries"], 0)
+        # Changes of scenarios are rolled back
+        self.assertEqual(ProjectElement.objects.count(), elements)
+
+        changes = benchmark.compare(results, results)
+        self.assertEqual(changes["project_retrieve"]["queries"], 0)
+
+    @override_settings(REPORT_CHUNK_SIZE=100)
+    def test_report_memory(self):
+        scenarios = ["excel_foreman", "excel_purchaser", "excel_estimate"]
+        peaks = []
+        # Projects of one and 15 chunks of elements
+        for constructions in (10, 150):
+            seed(elements=50, constructions=1, projects=1, stages=1, project_constructions=constructions,
+                 project_elements=10)
+            project = Project.objects.latest("pk")
+            results = benchmark.run(scenarios, repeat=1, project_id=project.pk)["results"]
+            peaks.append({name: results[name]["peak_kb"] for name in scenarios})
+
+        for name in scenarios:
+            self.assertLess(peaks[1][name], peaks[0][name] * 1.5, name)
+
+
+class BillOfMaterialsTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("user"))
+
+    def test_bom(self):
+        project = create_project_tree(stages=2, constructions=2, elements=3)
+        construction = ProjectConstruction.objects.filter(stage__project=project).first()
+        ProjectElement.objects.create(
+            construction=construction, title="Доска", measure="м3", second_measure="т",
+            cost=10, price=20, type=Element.Type.MATERIAL, conversion_rate=0.5, weight=1, volume=1, count=2
+        )
+
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("api:projects-bom", args=(project.pk,)))
+        self.assertEqual(response.status_code, 200)
+
+        nail, board = response.data
+        self.assertEqual((board["element"], board["count"], board["converted_count"]), (None, 2, 1))
+        self.assertEqual(nail["occurrences"], 2 * 2 * 3)
+        self.assertEqual(nail["count"], sum(
+            ProjectElement.objects.filter(element__isnull=False).values_list("count", flat=True)
+        ))
+        self.assertAlmostEqual(nail["total_cost"], nail["count"] * 1)
+
+        response = self.client.get(reverse("api:projects-excel/purchaser", args=(project.pk,)))
+        wb = openpyxl.load_workbook(io.BytesIO(b"".join(response.streaming_content)))
+        # Header and one row for every group
+        self.assertEqual(wb.worksheets[1].max_row, 3)
+
+
+class ProcurementTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("user"))
+        self.url = reverse("api:projects-procurement")
+        self.projects = [create_project_tree(stages=1, constructions=2, elements=2) for _ in range(3)]
+        Project.objects.filter(pk=self.projects[2].pk).update(status=Project.Type.FINISH)
+        # Every project has his own catalog element, use the same one
+        ProjectElement.objects.update(element=Element.objects.first())
+        ProjectElement.objects.create(
+            construction=ProjectConstruction.objects.filter(stage__project=self.projects[0]).first(),
+            title="Монтаж", measure="м2", second_measure="м2", cost=5, price=7,
+            type=Element.Type.JOB, conversion_rate=1, weight=0, volume=0, count=3
+        )
+
+    def test_procurement(self):
+        # Projects in work by default
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual([row["count"] for row in response.data], [2 * 2 * 2 * 10])
+
+        # Status isn't filtered, when projects are selected
+        response = self.client.get(self.url, {"ids": f"{self.projects[0].pk},{self.projects[2].pk}"})
+        self.assertEqual([row["occurrences"] for row in response.data], [2 * 2 * 2])
+
+        response = self.client.get(self.url, {"status": Project.Type.FINISH})
+        self.assertEqual([row["occurrences"] for row in response.data], [2 * 2])
+
+        # Jobs are summed only by request, materials by default
+        response = self.client.get(self.url, {"type": Element.Type.JOB})
+        self.assertEqual([(row["title"], row["count"]) for row in response.data], [("Монтаж", 3)])
+
+        self.assertEqual(self.client.get(self.url, {"type": "UNKNOWN"}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {"status": "UNKNOWN"}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {"ids": "1,a"}).status_code, 400)
+
+    def test_outputs(self):
+        response = self.client.get(self.url, {"output": "csv"})
+        lines = b"".join(response.streaming_content).decode("utf-8-sig").splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith("Гвоздь,Гвоздь,80.0,шт,"))
+        self.assertNotIn("Монтаж", "".join(lines))
+
+        response = self.client.get(self.url, {"output": "xlsx"})
+        wb = openpyxl.load_workbook(io.BytesIO(b"".join(response.streaming_content)))
+        self.assertEqual(wb.active["D2"].value, 80)
+
+
+class PricingTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("user"))
+
+    def test_totals(self):
+        project = create_project_tree(stages=2, constructions=2, elements=3)
+        refresh_totals(ProjectStage.objects.values("id"))
+        project.refresh_from_db()
+
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("api:projects-totals", args=(project.pk,)))
+        self.assertEqual(response.status_code, 200)
+
+        total = response.data["total"]
+        self.assertAlmostEqual(total["cost"], project.total_cost)
+        self.assertAlmostEqual(total["margin"], project.total_margin)
+        self.assertAlmostEqual(total["converted_count"], 2 * 2 * 3 * 10 * 0.01)
+        for stage in project.stages.all():
+            self.assertAlmostEqual(response.data["stages"][stage.id]["price"], stage.total_price)
+        self.assertEqual(len(response.data["constructions"]), 4)
+
+    def test_from_project(self):
+        project = create_project_tree(stages=1, constructions=2, elements=2)
+        data = ProjectDetailSerializer(project_tree().get(pk=project.pk)).data
+        pricing = Pricing.from_project(data)
+        elements = Pricing.from_elements(ProjectElement.objects.all())
+
+        self.assertEqual(pricing.constructions(), elements.constructions())
+        self.assertEqual(pricing.elements("weight"), elements.elements("weight"))
+        self.assertEqual(Pricing.from_rows([]).total()["cost"], 0)
+
+    def test_stored_totals(self):
+        seed(elements=20, constructions=2, projects=2, stages=2, project_constructions=3, project_elements=4)
+
+        for project in Project.objects.all():
+            pricing = Pricing.from_elements(ProjectElement.objects.filter(construction__stage__project=project))
+            total = pricing.total()
+            for field in Totals.FIELDS:
+                self.assertAlmostEqual(total[field.removeprefix("total_")], getattr(project, field), places=3)
+            for stage in project.stages.all():
+                self.assertAlmostEqual(pricing.stages()[stage.id]["margin"], stage.total_margin, places=3)
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("admin", is_staff=True))
+        metrics.phase_duration.clear()
+
+    def test_server_timing(self):
+        project = create_project_tree(stages=1, constructions=1, elements=1)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("api:projects-detail", args=(project.pk,)))
+
+        timing = response["Server-Timing"]
+        self.assertIn("db;dur=", timing)
+        self.assertIn(f'desc="{len(queries)} queries"', timing)
+        for phase in ("serialize", "render", "total"):
+            self.assertIn(f"{phase};dur=", timing)
+
+        response = self.client.get(reverse("api:projects-excel/foreman", args=(project.pk,)))
+        self.assertIn("xlsx;dur=", response["Server-Timing"])
+
+    def test_metrics(self):
+        project = create_project_tree(stages=0, constructions=0, elements=0)
+        self.client.get(reverse("api:projects-detail", args=(project.pk,)))
+
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('api_request_phase_duration_seconds_count{view="api:projects-detail",phase="db"} 1', body)
+        self.assertIn("api_token_cache_hit_rate", body)
+
+        self.client.force_authenticate(User.objects.create_user("user"))
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+
+
+class ConnectionPoolTest(SimpleTestCase):
+    def setUp(self):
+        self.pool = ConnectionPool(max_size=2, timeout=0.01, max_lifetime=60, health_check_interval=0)
+
+    def connect(self):
+        return FakeConnection()
+
+    def test_reuse(self):
+        connection = self.pool.checkout(self.connect, lambda c: True)
+        self.pool.checkin(connection)
+        self.assertIs(self.pool.checkout(self.connect, lambda c: True), connection)
+        self.assertEqual(self.pool.stats()["opened"], 1)
+
+    def test_health_check(self):
+        connection = self.pool.checkout(self.connect, lambda c: True)
+        self.pool.checkin(connection)
+        self.assertIsNot(self.pool.checkout(self.connect, lambda c: False), connection)
+        self.assertEqual(self.pool.stats()["discarded"], 1)
+
+    def test_bounded(self):
+        self.pool.checkout(self.connect, lambda c: True)
+        self.pool.checkout(self.connect, lambda c: True)
+        with self.assertRaises(PoolTimeout):
+            self.pool.checkout(self.connect, lambda c: True)
+
+        stats = self.pool.stats()
+        self.assertEqual((stats["size"], stats["in_use"], stats["timeouts"]), (2, 2, 1))
+
+    def test_reset(self):
+        connection = FakeConnection()
+        connection.autocommit = False
+        connection.status = TRANSACTION_STATUS_INTRANS
+
+        self.assertTrue(reset(connection))
+        self.assertEqual((connection.rollbacks, connection.autocommit), (1, True))
+
+        connection.closed = True
+        self.assertFalse(reset(connection))
+
+
+class FakeConnection:
+    """psycopg2 connection with transaction status, autocommit and closing only"""
+    closed = False
+    autocommit = True
+    status = TRANSACTION_STATUS_IDLE
+    rollbacks = 0
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = True
+
+
+class ConditionalRequestTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("user"))
+
+    def test_project(self):
+        project = create_project_tree(stages=1, constructions=1, elements=1)
+        url = reverse("api:projects-detail", args=(project.pk,))
+        etag = self.client.get(url)["ETag"]
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Change of nested structure makes new revision of project
+        stage = project.stages.get()
+        self.client.patch(reverse("api:projects-stages", args=(project.pk, stage.pk)), {"title": "Новый"})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_project_client(self):
+        project = create_project_tree(stages=0, constructions=0, elements=0)
+        url = reverse("api:projects-detail", args=(project.pk,))
+        etag = self.client.get(url)["ETag"]
+
+        project.client.name = "Новый клиент"
+        project.client.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["client"], "Новый клиент")
+
+    def test_elements(self):
+        create_project_tree(stages=0, constructions=0, elements=0)
+        url = reverse("api:elements-list")
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        element = Element.objects.get()
+        element.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_invalid_pk(self):
+        for name in ("api:elements-detail", "api:constructions-detail", "api:projects-detail"):
+            with self.subTest(name):
+                response = self.client.get(reverse(name, args=("abc",)))
+                self.assertEqual(response.status_code, 404)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class BlobTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("user"))
+
+    def upload(self, project, name):
+        file = SimpleUploadedFile(name, b"%PDF-1.4 plan")
+        url = reverse("api:projects-detail", args=(project.pk,))
+        return self.client.patch(url, {"documents": [file]}, format="multipart")
+
+    def test_deduplication(self):
+        first = create_project_tree(stages=0, constructions=0, elements=0)
+        second = create_project_tree(stages=0, constructions=0, elements=0)
+        self.upload(first, "plan.pdf")
+        self.upload(second, "plan-copy.pdf")
+
+        blob = Blob.objects.get()
+        self.assertEqual(ProjectDocument.objects.filter(blob=blob).count(), 2)
+        self.assertEqual(first.documents.get().file.name, second.documents.get().file.name)
+
+        call_command("collect_blobs", stdout=io.StringIO())
+        self.assertTrue(Blob.objects.exists())
+
+        first.delete()
+        second.delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("collect_blobs", stdout=io.StringIO())
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(blob.file.storage.exists(blob.file.name))
+
+
+class CategoryTreeTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("user"))
+        self.url = reverse("api:parent-categories-list")
+
+        # Migrations may create default "Без категории" parent category
+        ParentCategory.get_default_pk()
+        self.initial = len(self.client.get(self.url).data)
+        cache.clear()
+
+        for type in (ParentCategory.Type.ELEMENT, ParentCategory.Type.CONSTRUCTION):
+            parent_category = ParentCategory.objects.create(title=type, description="", type=type)
+            for _ in range(3):
+                category = Category.objects.create(
+                    title="Категория", description="", parent_category=parent_category
+                )
+                SubCategory.objects.create(title="Подкатегория", description="", category=category)
+
+    def parent_category(self, data, type):
+        return next(item for item in data if item["title"] == type)
+
+    def test_list(self):
+        # revision, parent categories, categories, subcategories
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.data), self.initial + 2)
+        element = self.parent_category(response.data, ParentCategory.Type.ELEMENT)
+        self.assertEqual(len(element["categories"]), 3)
+        self.assertEqual(len(element["categories"][0]["subcategories"]), 1)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {"type": ParentCategory.Type.ELEMENT})
+        # Parent categories without type are returned with every type
+        self.assertEqual(
+            [item["title"] for item in response.data if item["type"] != ParentCategory.Type.NO],
+            [ParentCategory.Type.ELEMENT]
+        )
+
+    def test_invalidation(self):
+        self.client.get(self.url)
+
+        category = Category.objects.filter(parent_category__type=ParentCategory.Type.ELEMENT).first()
+        SubCategory.objects.create(title="Новая", description="", category=category)
+        response = self.client.get(self.url)
+        element = self.parent_category(response.data, ParentCategory.Type.ELEMENT)
+        subcategories = next(item for item in element["categories"] if item["id"] == category.id)["subcategories"]
+        self.assertEqual(len(subcategories), 2)
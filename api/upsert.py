@@ -0,0 +1,191 @@
+from collections import defaultdict
+from typing import Dict, List
+
+from django.db import models, transaction
+
+from .models import (
+    ConstructionDocument, ElementDocument,
+    ProjectConstruction, ProjectConstructionDocument,
+    ProjectElement, ProjectElementDocument,
+    TemplateConstruction, TemplateElement,
+)
+
+
+def assign(instance: models.Model, data: dict) -> List[str]:
+    """Set values of `data` to `instance`, return names of changed fields"""
+    changed = []
+    for name, value in data.items():
+        field = instance._meta.get_field(name)
+        if field.is_relation and isinstance(value, models.Model):
+            value = value.pk
+        if getattr(instance, field.attname) != value:
+            setattr(instance, field.attname, value)
+            changed.append(field.name)
+    return changed
+
+
+def documents_map(model, field: str, rows: List[models.Model]) -> Dict[int, list]:
+    """Documents of `model` for catalog objects referenced by `field` of `rows`
+
+    Documents are fetched with one query and grouped by id of catalog object.
+    """
+    documents = defaultdict(list)
+    ids = {getattr(row, f"{field}_id") for row in rows}
+    for document in model.objects.filter(**{f"{field}__in": ids}):
+        documents[getattr(document, f"{field}_id")].append(document)
+    return documents
+
+
+class RowChanges:
+    """Rows of `model` to insert, update and delete"""
+
+    def __init__(self, model):
+        self.model = model
+        self.created = []
+        self.updated = []
+        self.fields = set()
+        self.deleted = []
+
+    def update(self, instance: models.Model, fields: List[str]):
+        if fields:
+            self.updated.append(instance)
+            self.fields.update(fields)
+
+    def counts(self) -> Dict[str, int]:
+        return {
+            "inserted": len(self.created),
+            "updated": len(self.updated),
+            "deleted": len(self.deleted),
+        }
+
+
+class StageUpsert:
+    """Apply nested constructions and elements to `stage` by difference
+
+    Constructions and elements are matched by `id` with rows of the stage:
+    rows with unknown `id` are inserted, changed rows are updated with one
+    `bulk_update` for each table and rows missing in data are deleted.
+    Unchanged rows aren't written at all.
+    """
+    construction_model = None
+    element_model = None
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.constructions = RowChanges(self.construction_model)
+        self.elements = RowChanges(self.element_model)
+
+    def prepare_element(self, data: dict) -> dict:
+        """Hook to change element `data` before it's applied"""
+        return data
+
+    def inserted(self):
+        """Hook called after new rows are inserted"""
+
+    def run(self, constructions: List[dict]) -> Dict[str, dict]:
+        existing = {
+            construction.pk: construction
+            for construction in self.stage.constructions.prefetch_related("elements")
+        }
+
+        for data in constructions:
+            data = dict(data)
+            elements = data.pop("elements", [])
+            construction = existing.pop(data.pop("id", None), None)
+
+            if construction is None:
+                construction = self.construction_model(**data, stage=self.stage)
+                self.constructions.created.append(construction)
+                current = {}
+            else:
+                self.constructions.update(construction, assign(construction, data))
+                current = {element.pk: element for element in construction.elements.all()}
+
+            for data in elements:
+                data = self.prepare_element(dict(data))
+                element = current.pop(data.pop("id", None), None)
+
+                if element is None:
+                    self.elements.created.append(self.element_model(**data, construction=construction))
+                else:
+                    self.elements.update(element, assign(element, data))
+
+            self.elements.deleted.extend(current)
+
+        for construction in existing.values():
+            self.constructions.deleted.append(construction.pk)
+            self.elements.deleted.extend(element.pk for element in construction.elements.all())
+
+        with transaction.atomic():
+            self.save()
+
+        return {
+            "constructions": self.constructions.counts(),
+            "elements": self.elements.counts(),
+        }
+
+    def save(self):
+        if self.elements.deleted:
+            self.element_model.objects.filter(pk__in=self.elements.deleted).delete()
+        if self.constructions.deleted:
+            self.construction_model.objects.filter(pk__in=self.constructions.deleted).delete()
+
+        self.construction_model.objects.bulk_create(self.constructions.created)
+        self.element_model.objects.bulk_create(self.elements.created)
+        self.inserted()
+
+        for rows in (self.constructions, self.elements):
+            if rows.updated:
+                rows.model.objects.bulk_update(rows.updated, sorted(rows.fields))
+
+
+class ProjectStageUpsert(StageUpsert):
+    """Upsert of project stage, which also copies catalog documents to new rows
+
+    Document rows are copied per project row on purpose: documents of project
+    are its snapshot, they are deleted or added without changes of catalog,
+    like price and cost of elements. Copies share file of `Blob`, so a copy
+    is a row of two references, files aren't duplicated.
+    """
+    construction_model = ProjectConstruction
+    element_model = ProjectElement
+
+    def prepare_element(self, data):
+        element = data.get("element")
+        if element:
+            used_elements = self.stage.used_elements
+            # Add price and cost to element from already used element
+            if used_elements.get(str(element.id)):
+                data["price"] = used_elements[str(element.id)]["price"]
+                data["cost"] = used_elements[str(element.id)]["cost"]
+            else:
+                used_elements[str(element.id)] = {
+                    "price": data.get("price", 0),
+                    "cost": data.get("cost", 0),
+                }
+        return data
+
+    def inserted(self):
+        constructions = [c for c in self.constructions.created if c.construction_id]
+        elements = [e for e in self.elements.created if e.element_id]
+
+        documents = documents_map(ConstructionDocument, "construction", constructions)
+        ProjectConstructionDocument.objects.bulk_create([
+            ProjectConstructionDocument(
+                construction=construction, file=document.file, blob_id=document.blob_id
+            )
+            for construction in constructions
+            for document in documents[construction.construction_id]
+        ])
+
+        documents = documents_map(ElementDocument, "element", elements)
+        ProjectElementDocument.objects.bulk_create([
+            ProjectElementDocument(element=element, file=document.file, blob_id=document.blob_id)
+            for element in elements
+            for document in documents[element.element_id]
+        ])
+
+
+class TemplateStageUpsert(StageUpsert):
+    construction_model = TemplateConstruction
+    element_model = TemplateElement
@@ -1,10 +1,14 @@
+from django.urls import path
+
 from rest_framework.routers import DefaultRouter
 
 from .views import (
     ParentCategoryViewSet, CategoryViewSet, SubCategoryViewSet,
     ElementViewSet, ConstructionViewset, ProjectViewset, 
-    TemplateViewset, ClientViewSet
+    TemplateViewset, ClientViewSet, ExportJobViewSet,
+    auth_cache_stats, db_pool_stats
 )
+from . import async_views
 
 
 app_name = 'api'
@@ -18,6 +22,16 @@ router.register(r"constructions", ConstructionViewset, basename="constructions")
 router.register(r"projects", ProjectViewset, basename="projects")
 router.register(r"templates", TemplateViewset, basename="templates")
 router.register(r"clients", ClientViewSet, basename="clients")
+router.register(r"exports", ExportJobViewSet, basename="exports")
 
 urlpatterns = [
+    path("stats/auth-cache/", auth_cache_stats, name="auth-cache-stats"),
+    path("stats/db-pool/", db_pool_stats, name="db-pool-stats"),
+    # Read endpoints for ASGI mode, same as endpoints without `async/`
+    path("async/parent-categories/", async_views.parent_categories, name="async-parent-categories-list"),
+    path("async/elements/", async_views.elements, name="async-elements-list"),
+    path("async/constructions/", async_views.constructions, name="async-constructions-list"),
+    path("async/clients/", async_views.clients, name="async-clients-list"),
+    path("async/projects/<int:pk>/", async_views.project, name="async-projects-detail"),
+    path("async/templates/<int:pk>/", async_views.template, name="async-templates-detail"),
 ] + router.urls
@@ -1,48 +1,66 @@
-from itertools import groupby
-
 from rest_framework import viewsets
 from rest_framework import status
 from rest_framework.response import Response
-from rest_framework.decorators import action, api_view, renderer_classes
+from rest_framework.decorators import action, api_view, permission_classes, renderer_classes
 from rest_framework.renderers import JSONRenderer
-from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework import permissions
 
-from django.http import HttpResponse
-from django.db.models import F
+from django.http import HttpResponse, HttpResponseForbidden, StreamingHttpResponse
 
-from openpyxl.writer.excel import save_virtual_workbook
-from openpyxl import load_workbook
+from main.postgresql_pool.pool import stats as pool_stats
 
 from .models import (
     ParentCategory, Category, SubCategory,
     Element, ElementDocument,
-    Construction, ConstructionDocument, ConstructionElement,
-    Project, ProjectStage, ProjectConstruction,
-    ProjectElement, ProjectDocument,
+    Construction, ConstructionDocument,
+    Project, ProjectDocument, ProjectElement,
     Template, TemplateStage,
-    TemplateConstruction, TemplateElement,
-    Client,
+    Client, ExportJob, Revision,
 )
 
 from . serializers import (
-    ParentCategorySerializer, ParentCategoryDetailSerializer,
-    CategorySerializer, CategoryDetailSerializer,
-    SubCategorySerializer, SubCategoryDetailSerializer,
+    ParentCategorySerializer, CategorySerializer, SubCategorySerializer,
     ElementSerializer, ConstructionDetailSerializer, ConstructionSerializer,
     ProjectSerializer, ProjectStageSerializer, ProjectDetailSerializer, ProjectCreateSerializer,
     TemplateSerializer, TemplateStageSerializer, TemplateDetailSerilaizer,
-    ClientSerializer, ClientDetailSerializer
+    ClientSerializer,
+    ExportJobSerializer, BillOfMaterialsSerializer
 )
 
-from .excel import foreman, purchaser, estimate, export, q_import
-
+# `api.excel` with openpyxl is imported by actions on first use
+from .bom import csv_lines, project_bill_of_materials, projects_bill_of_materials
+from .loaders import project_tree, template_tree
+from .pricing import Pricing
+from .catalog import ELEMENTS, category_tree, element_groups
+from .authentication import CachedTokenAuthentication, token_cache
+from .conditional import conditional, conditional_revision
+from .search import search, paginate
+from .pagination import PaginationMixin
+from .repricing import reprice
+from .rollups import refresh_project_totals
+from .cloning import clone_project, clone_template, clone_construction
+from . import blobs, jobs, media, metrics
+
+
+def accel_redirect_response(file: str) -> HttpResponse:
+    """Response which makes nginx serve media `file` from internal location"""
+    response = HttpResponse()
+    response["Content-Disposition"] = "attachment; filename=" + file
+    # nginx uses this path to serve the file
+    response["X-Accel-Redirect"] = "/internal/" + file # path to file
+    return response
+
+
+def signed_media(request, expires, signature, file):
+    """Handler of media by signed url from `file_url` of documents
+
+    Signature is checked without database, file is served by nginx.
+    """
+    if not media.verify(file, expires, signature):
+        return HttpResponseForbidden()
 
-def get_object_fields(obj) -> dict:
-    kwargs = {}
-    for field in obj._meta.fields[1:]:
-        kwargs[field.name] = getattr(obj, field.name)
-    return kwargs
+    return accel_redirect_response(file)
 
 
 @api_view(("GET",))
@@ -54,49 +72,60 @@ def internal_media(request, file, token):
 
     Current implementation use because frontend developer don't wanted use ajax technology ¯\_(ツ)_/¯
     """
-    has_access = False
-    if request.user.is_authenticated:
-        has_access = True
-    try:
-        Token.objects.get(key=token)
-        has_access = True
-    except Token.DoesNotExist:
-        pass
+    has_access = request.user.is_authenticated
+    if not has_access:
+        try:
+            CachedTokenAuthentication().authenticate_credentials(token)
+            has_access = True
+        except AuthenticationFailed:
+            pass
 
     if has_access:
-        response = HttpResponse()
-        response["Content-Disposition"] = "attachment; filename=" + file
-        # nginx uses this path to serve the file
-        response["X-Accel-Redirect"] = "/internal/" + file # path to file
-        return response
+        return accel_redirect_response(file)
     else:
         return Response(status=status.HTTP_403_FORBIDDEN)
 
 
-class ParentCategoryViewSet(viewsets.GenericViewSet):
+@api_view(("GET",))
+@permission_classes((permissions.IsAdminUser,))
+def auth_cache_stats(request):
+    """Hit rate of token cache of the process, which handles request"""
+    return Response(token_cache.stats(), status=status.HTTP_200_OK)
+
+
+@api_view(("GET",))
+@permission_classes((permissions.IsAdminUser,))
+def db_pool_stats(request):
+    """Size and checkout wait time of database pools of the process, which handles request"""
+    return Response(pool_stats(), status=status.HTTP_200_OK)
+
+
+@api_view(("GET",))
+@permission_classes((permissions.IsAdminUser,))
+def prometheus_metrics(request):
+    """Histograms of requests of the process, which handles request, in Prometheus text format"""
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+class ParentCategoryViewSet(PaginationMixin, viewsets.GenericViewSet):
     queryset = ParentCategory.objects.all()
     serializer_class = ParentCategorySerializer
     permission_classes = (permissions.IsAuthenticated,)
 
-    def get_queryset(self):
-        queryset = ParentCategory.objects.all()
-        type = self.request.query_params.get("type")
-        if type:
-            queryset = queryset.filter(type__in=[type, "NO"])
-
-        return queryset
-
     def retrieve(self, request, pk=None):
-        """Get parent category with `pk`"""
+        """Get parent category with `pk`, with pages of his elements and constructions"""
         category = self.get_object()
-        serializer = ParentCategoryDetailSerializer(category)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        data = self.serializer_class(category).data
+        data.update(self.nested_page(
+            "elements", category.elements.prefetch_related("documents"), ElementSerializer
+        ))
+        data.update(self.nested_page("constructions", category.constructions.all(), ConstructionSerializer))
+        return Response(data, status=status.HTTP_200_OK)
 
     def list(self, request):
-        """Get list of parent categories"""
-        queryset = self.get_queryset()
-        serializer = self.serializer_class(queryset, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        """Get tree of parent categories, filtered by `type`"""
+        tree = category_tree(request.query_params.get("type"))
+        return Response(tree, status=status.HTTP_200_OK)
 
     def create(self, request):
         """Create parent categories by `request.data`"""
@@ -130,16 +159,20 @@ class ParentCategoryViewSet(viewsets.GenericViewSet):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class CategoryViewSet(viewsets.GenericViewSet):
+class CategoryViewSet(PaginationMixin, viewsets.GenericViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = (permissions.IsAuthenticated,)
 
     def retrieve(self, request, pk=None):
-        """Get category with `pk`"""
+        """Get category with `pk`, with pages of his elements and constructions"""
         category = self.get_object()
-        serializer = CategoryDetailSerializer(category)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        data = self.serializer_class(category).data
+        data.update(self.nested_page(
+            "elements", category.elements.prefetch_related("documents"), ElementSerializer
+        ))
+        data.update(self.nested_page("constructions", category.constructions.all(), ConstructionSerializer))
+        return Response(data, status=status.HTTP_200_OK)
 
     def create(self, request):
         """Create category by `request.data`"""
@@ -173,16 +206,20 @@ class CategoryViewSet(viewsets.GenericViewSet):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class SubCategoryViewSet(viewsets.GenericViewSet):
+class SubCategoryViewSet(PaginationMixin, viewsets.GenericViewSet):
     queryset = SubCategory.objects.all()
     serializer_class = SubCategorySerializer
     permission_classes = (permissions.IsAuthenticated,)
 
     def retrieve(self, request, pk=None):
-        """Get subcategory with `pk`"""
+        """Get subcategory with `pk`, with pages of his elements and constructions"""
         category = self.get_object()
-        serializer = SubCategoryDetailSerializer(category)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        data = self.serializer_class(category).data
+        data.update(self.nested_page(
+            "elements", category.elements.prefetch_related("documents"), ElementSerializer
+        ))
+        data.update(self.nested_page("constructions", category.constructions.all(), ConstructionSerializer))
+        return Response(data, status=status.HTTP_200_OK)
 
     def create(self, request):
         """Create subcategory by `request.data`"""
@@ -216,7 +253,7 @@ class SubCategoryViewSet(viewsets.GenericViewSet):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class ElementViewSet(viewsets.GenericViewSet):
+class ElementViewSet(PaginationMixin, viewsets.GenericViewSet):
     queryset = Element.objects.all()
     serializer_class = ElementSerializer
     permission_classes = (permissions.IsAuthenticated,)
@@ -225,21 +262,32 @@ class ElementViewSet(viewsets.GenericViewSet):
         queryset = Element.objects.all()
         title = self.request.query_params.get("title")
         if title:
-            queryset = queryset.filter(title__istartswith=title)[:5]
+            queryset = search(queryset, "title", title, self.request.query_params)
+            if self.action == "list":
+                queryset = paginate(queryset, self.request.query_params)
 
         return queryset
 
     def retrieve(self, request, pk=None):
         """Get element with `pk`"""
+        response, headers = conditional(request, Element.objects.all(), pk)
+        if response:
+            return response
+
         element = self.get_object()
         serializer = self.serializer_class(element)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(serializer.data, status=status.HTTP_200_OK, headers=headers)
 
     def list(self, request):
-        """Get list of elements with `pk`"""
-        elements = self.get_queryset()
-        serializer = self.serializer_class(elements, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        """Get list of elements"""
+        response, headers = conditional_revision(request, ELEMENTS, Revision.get(ELEMENTS))
+        if response:
+            return response
+
+        elements = self.get_queryset().prefetch_related("documents")
+        response = self.list_response(elements, self.serializer_class)
+        response["ETag"] = headers["ETag"]
+        return response
 
     def create(self, request):
         """Create element by `request.data`"""
@@ -248,10 +296,7 @@ class ElementViewSet(viewsets.GenericViewSet):
         if serializer.is_valid(raise_exception=False):
             serializer.save()
 
-            bulk_inserts = []
-            for file in request.FILES.getlist("documents"):
-                bulk_inserts.append(ElementDocument(file=file, element=serializer.instance))
-            ElementDocument.objects.bulk_create(bulk_inserts)
+            blobs.attach(ElementDocument, request.FILES.getlist("documents"), element=serializer.instance)
 
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -267,10 +312,7 @@ class ElementViewSet(viewsets.GenericViewSet):
                 documents_del_urls = request.data.getlist("documents_urls")
                 element.documents.filter(file__in=documents_del_urls).delete()
 
-            bulk_inserts = []
-            for file in request.FILES.getlist("documents"):
-                bulk_inserts.append(ElementDocument(file=file, element=element))
-            ElementDocument.objects.bulk_create(bulk_inserts)
+            blobs.attach(ElementDocument, request.FILES.getlist("documents"), element=element)
 
             serializer.update(element, serializer.validated_data)
             return Response(serializer.data, status=status.HTTP_200_OK)
@@ -285,15 +327,13 @@ class ElementViewSet(viewsets.GenericViewSet):
 
     @action(detail=False, methods=["get"], url_name="filter", url_path="filter")
     def filter(self, request):
-        """Filter and group elements by subcategories"""
-        elements = self.get_queryset()
-        elements = elements.annotate(subcategory_title=F("subcategory__title")).values()
-
-        data = [
-            {"title": key, "elements": list(result)} for key, result in
-            groupby(elements, key=lambda item: item["subcategory_title"])
-        ]
+        """Group elements by subcategories
 
+        Every group has count of elements and page of elements by `limit` and
+        `offset`. Elements can be filtered by `category`, `type` and other
+        categories.
+        """
+        data = element_groups(request.query_params)
         return Response(data, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=["post"], url_name="clone", url_path="clone")
@@ -307,6 +347,16 @@ class ElementViewSet(viewsets.GenericViewSet):
 
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(detail=True, methods=["post"], url_name="update-price", url_path="update-price")
+    def update_price(self, request, pk=None):
+        """Update price of element with `pk` in every project, which uses it
+
+        With `?dry_run=1` only return changes of prices, without saving.
+        """
+        element = self.get_object()
+        changes = reprice(element_ids=[element.pk], dry_run=bool(request.query_params.get("dry_run")))
+        return Response({"changes": changes}, status=status.HTTP_200_OK)
+
     @action(
         detail=False,
         methods=["post"],
@@ -315,18 +365,14 @@ class ElementViewSet(viewsets.GenericViewSet):
     )
     def export(self, request):
         """Export all elements to excel table format"""
-        qs = self.get_queryset()
-        elements = qs.order_by("subcategory__title")
+        from .excel import export, workbook_response
 
-        wb = export(elements)
-
-        response = HttpResponse(
-            content=save_virtual_workbook(wb),
-            content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
-        response["Content-Disposition"] = "attachment; filename=elements.xlsx"
+        qs = self.get_queryset()
+        elements = qs.select_related("subcategory").order_by("subcategory__title")
 
-        return response
+        with metrics.span("xlsx"):
+            wb = export(elements.iterator(chunk_size=2000))
+            return workbook_response(wb, "elements.xlsx")
 
     @action(
         detail=False,
@@ -336,19 +382,17 @@ class ElementViewSet(viewsets.GenericViewSet):
     )
     def q_import(self, request):
         """Import elements from excel table"""
-        file = request.FILES.get("file")
-        wb = load_workbook(file)
-        bulk_create, errors = q_import(wb)
+        from .excel import q_import
 
-        if errors:
-            return Response({"errors": errors}, status=status.HTTP_400_BAD_REQUEST)
+        file = request.FILES.get("file")
+        report = q_import(file)
 
-        elements = Element.objects.bulk_create(bulk_create)
-        serializer = self.serializer_class(elements, many=True)
+        if report["errors"]:
+            return Response(report, status=status.HTTP_400_BAD_REQUEST)
 
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(report, status=status.HTTP_201_CREATED)
 
-class ConstructionViewset(viewsets.GenericViewSet):
+class ConstructionViewset(PaginationMixin, viewsets.GenericViewSet):
     queryset = Construction.objects.all()
     serializer_class = ConstructionDetailSerializer
     permission_classes = (permissions.IsAuthenticated,)
@@ -357,7 +401,9 @@ class ConstructionViewset(viewsets.GenericViewSet):
         queryset = Construction.objects.all()
         title = self.request.query_params.get("title")
         if title:
-            queryset = queryset.filter(title__istartswith=title)[:5]
+            queryset = search(queryset, "title", title, self.request.query_params)
+            if self.action == "list":
+                queryset = paginate(queryset, self.request.query_params)
 
         return queryset
 
@@ -371,16 +417,21 @@ class ConstructionViewset(viewsets.GenericViewSet):
 
     def retrieve(self, request, pk=None):
         """Get construction with `pk`"""
+        response, headers = conditional(
+            request, Construction.objects.all(), pk, elements=Revision.subquery(ELEMENTS)
+        )
+        if response:
+            return response
+
         construction = self.get_object()
         serializer = self.get_serializer_class()
         serializer = serializer(construction)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(serializer.data, status=status.HTTP_200_OK, headers=headers)
 
     def list(self, request):
         """Get list of constructions"""
         queryset = self.get_queryset()
-        serializer = self.serializer_class(queryset, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return self.list_response(queryset, self.serializer_class)
 
     def create(self, request):
         """Create construction by `request.data`"""
@@ -389,10 +440,7 @@ class ConstructionViewset(viewsets.GenericViewSet):
         if serializer.is_valid(raise_exception=False):
             serializer.save()
 
-            bulk_inserts = []
-            for file in request.FILES.getlist("documents"):
-                bulk_inserts.append(ConstructionDocument(file=file, construction=serializer.instance))
-            ConstructionDocument.objects.bulk_create(bulk_inserts)
+            blobs.attach(ConstructionDocument, request.FILES.getlist("documents"), construction=serializer.instance)
 
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -408,10 +456,7 @@ class ConstructionViewset(viewsets.GenericViewSet):
                 documents_del_urls = request.data.getlist("documents_urls")
                 construction.documents.filter(file__in=documents_del_urls).delete()
 
-            bulk_inserts = []
-            for file in request.FILES.getlist("documents"):
-                bulk_inserts.append(ConstructionDocument(file=file, construction=construction))
-            ConstructionDocument.objects.bulk_create(bulk_inserts)
+            blobs.attach(ConstructionDocument, request.FILES.getlist("documents"), construction=construction)
 
             serializer.update(construction, serializer.validated_data)
             return Response(serializer.data, status=status.HTTP_200_OK)
@@ -428,29 +473,28 @@ class ConstructionViewset(viewsets.GenericViewSet):
     def clone(self, request, pk=None):
         """Clone construction with `pk`, with his nested structures"""
         construction: Construction = self.get_object()
-        template_kwargs = get_object_fields(construction)
-        new_construction = Construction(**template_kwargs)
-        new_construction.save()
-
-        bulk_create_elements = []
-
-        for element in construction.elements.all():
-            element_kwargs = get_object_fields(element)
-            element_kwargs["construction"] = new_construction
-            bulk_create_elements.append(ConstructionElement(**element_kwargs))
-
-        ConstructionElement.objects.bulk_create(bulk_create_elements)
+        new_construction = clone_construction(construction)
 
         serializer = self.serializer_class(new_construction)
 
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
-class ProjectViewset(viewsets.GenericViewSet):
+class ProjectViewset(PaginationMixin, viewsets.GenericViewSet):
     queryset = Project.objects.all()
     serializer_class = ProjectSerializer
     permission_classes = (permissions.IsAuthenticated,)
 
+    # Actions that serialize project with his nested structures
+    tree_actions = ("retrieve",)
+
+    def get_queryset(self):
+        queryset = Project.objects.all()
+        if self.action in self.tree_actions:
+            queryset = project_tree(queryset)
+
+        return queryset
+
     def get_serializer_class(self):
         if self.action == "list":
             return ProjectSerializer
@@ -462,17 +506,26 @@ class ProjectViewset(viewsets.GenericViewSet):
             return super().get_serializer_class()
 
     def retrieve(self, request, pk=None):
-        """Get project with `pk`"""
+        """Get project with `pk`
+
+        Revision of project is bumped by changes of his nested structures,
+        so unchanged project is answered with `304 Not Modified`.
+        """
+        response, headers = conditional(
+            request, Project.objects.all(), pk, elements=Revision.subquery(ELEMENTS)
+        )
+        if response:
+            return response
+
         project = self.get_object()
         serializer = self.get_serializer_class()
         serializer = serializer(project)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(serializer.data, status=status.HTTP_200_OK, headers=headers)
 
     def list(self, request):
         """Get projects list"""
-        serializer = self.get_serializer_class()
-        serializer = serializer(self.get_queryset(), many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        queryset = self.get_queryset().select_related("client")
+        return self.list_response(queryset, self.get_serializer_class())
 
     def create(self, request):
         """Create project by `request.data`"""
@@ -482,10 +535,7 @@ class ProjectViewset(viewsets.GenericViewSet):
         if serializer.is_valid(raise_exception=False):
             serializer.save()
 
-            bulk_inserts = []
-            for file in request.FILES.getlist("documents"):
-                bulk_inserts.append(ProjectDocument(file=file, project=serializer.instance))
-            ProjectDocument.objects.bulk_create(bulk_inserts)
+            blobs.attach(ProjectDocument, request.FILES.getlist("documents"), project=serializer.instance)
 
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -501,10 +551,7 @@ class ProjectViewset(viewsets.GenericViewSet):
                 documents_del_urls = request.data.getlist("documents_urls")
                 project.documents.filter(file__in=documents_del_urls).delete()
 
-            bulk_inserts = []
-            for file in request.FILES.getlist("documents"):
-                bulk_inserts.append(ProjectDocument(file=file, project=project))
-            ProjectDocument.objects.bulk_create(bulk_inserts)
+            blobs.attach(ProjectDocument, request.FILES.getlist("documents"), project=project)
 
             serializer.update(project, serializer.validated_data)
             return Response(serializer.data, status=status.HTTP_200_OK)
@@ -527,18 +574,13 @@ class ProjectViewset(viewsets.GenericViewSet):
     )
     def excel_foreman(self, request, pk=None):
         """Export project with nested structures to excel table for foreman"""
-        project = self.get_object()
-        data = ProjectDetailSerializer(project).data
+        from .excel import foreman, workbook_response
 
-        wb = foreman(data)
-
-        response = HttpResponse(
-            content=save_virtual_workbook(wb),
-            content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
-        response["Content-Disposition"] = "attachment; filename=foreman.xlsx"
+        project = self.get_object()
 
-        return response
+        with metrics.span("xlsx"):
+            wb = foreman(project.pk)
+            return workbook_response(wb, "foreman.xlsx")
 
     @action(
         detail=True,
@@ -550,18 +592,13 @@ class ProjectViewset(viewsets.GenericViewSet):
     )
     def excel_purchaser(self, request, pk=None):
         """Export project with nested structures to excel table for purchaser"""
-        project = self.get_object()
-        data = ProjectDetailSerializer(project).data
-
-        wb = purchaser(data)
+        from .excel import purchaser, workbook_response
 
-        response = HttpResponse(
-            content=save_virtual_workbook(wb),
-            content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
-        response["Content-Disposition"] = "attachment; filename=purchaser.xlsx"
+        project = self.get_object()
 
-        return response
+        with metrics.span("xlsx"):
+            wb = purchaser(project.pk)
+            return workbook_response(wb, "purchaser.xlsx")
 
     @action(
         detail=True,
@@ -573,18 +610,105 @@ class ProjectViewset(viewsets.GenericViewSet):
     )
     def excel_estimate(self, request, pk=None):
         """Export project with nested structures to excel table for estimate"""
+        from .excel import estimate, workbook_response
+
         project = self.get_object()
-        data = ProjectDetailSerializer(project).data
 
-        wb = estimate(data)
+        with metrics.span("xlsx"):
+            wb = estimate(project.pk)
+            return workbook_response(wb, "estimate.xlsx")
 
-        response = HttpResponse(
-            content=save_virtual_workbook(wb),
-            content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
-        response["Content-Disposition"] = "attachment; filename=estimate.xlsx"
+    @action(detail=True, methods=["get"], url_name="totals", url_path="totals")
+    def totals(self, request, pk=None):
+        """Cost, price, margin, converted count, weight and volume of project with `pk`
 
-        return response
+        Totals are computed from elements of project, also for every stage and
+        construction with elements.
+        """
+        project = self.get_object()
+        pricing = Pricing.from_elements(ProjectElement.objects.filter(construction__stage__project=project))
+        data = {
+            "total": pricing.total(),
+            "stages": pricing.stages(),
+            "constructions": pricing.constructions(),
+        }
+        return Response(data, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=["get"], url_name="procurement", url_path="procurement")
+    def procurement(self, request):
+        """Materials of several projects summed together
+
+        Projects are selected by `ids` (comma separated), `client` and `status`,
+        by default projects in work. Jobs are summed with `?type=JOB` instead
+        of materials. With `?output=csv` or `?output=xlsx` table is streamed
+        instead of JSON.
+        """
+        params = request.query_params
+        projects = Project.objects.all()
+        try:
+            if params.get("ids"):
+                projects = projects.filter(id__in=[int(i) for i in params["ids"].split(",")])
+            if params.get("client"):
+                projects = projects.filter(client_id=int(params["client"]))
+        except ValueError:
+            return Response({"detail": "`ids` and `client` must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+
+        project_status = params.get("status")
+        if not project_status and not params.get("ids") and not params.get("client"):
+            project_status = Project.Type.WORK
+        if project_status:
+            if project_status not in Project.Type.values:
+                return Response({"detail": f"Unknown status {project_status}"}, status=status.HTTP_400_BAD_REQUEST)
+            projects = projects.filter(status=project_status)
+
+        element_type = params.get("type", ProjectElement.Type.MATERIAL)
+        if element_type not in ProjectElement.Type.values:
+            return Response({"detail": f"Unknown type {element_type}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows = projects_bill_of_materials(projects, element_type)
+        output = params.get("output")
+        if output == "csv":
+            response = StreamingHttpResponse(
+                csv_lines(rows.iterator(chunk_size=2000)), content_type="text/csv; charset=utf-8"
+            )
+            response["Content-Disposition"] = 'attachment; filename="procurement.csv"'
+            return response
+        elif output == "xlsx":
+            from .excel import procurement, workbook_response
+
+            with metrics.span("xlsx"):
+                wb = procurement(rows.iterator(chunk_size=2000))
+                return workbook_response(wb, "procurement.xlsx")
+
+        serializer = BillOfMaterialsSerializer(rows, many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=["get"], url_name="bom", url_path="bom")
+    def bom(self, request, pk=None):
+        """Materials of project with `pk`, summed by catalog element, measures and dimension"""
+        project = self.get_object()
+        rows = project_bill_of_materials(project.pk)
+        serializer = BillOfMaterialsSerializer(rows, many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @action(
+        detail=True,
+        methods=["post"],
+        url_name="exports",
+        url_path="exports",
+        serializer_class=ExportJobSerializer
+    )
+    def exports(self, request, pk=None):
+        """Submit background export of project with `pk` to excel table"""
+        project = self.get_object()
+        serializer = self.serializer_class(data=request.data)
+
+        if serializer.is_valid(raise_exception=False):
+            job = serializer.save(project=project)
+            jobs.submit(job)
+            return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     @action(
         detail=True,
@@ -594,14 +718,18 @@ class ProjectViewset(viewsets.GenericViewSet):
         serializer_class=ProjectDetailSerializer
     )
     def update_price(self, request, pk=None):
-        """Update price for project with `pk`"""
+        """Update price for project with `pk`
+
+        With `?dry_run=1` only return changes of prices, without saving.
+        """
         project = self.get_object()
-        stages = project.stages.all()
-        for stage in stages:
-            for construction in stage.constructions.all():
-                for element in construction.elements.all():
-                    element.update_price()
+        dry_run = bool(request.query_params.get("dry_run"))
+        changes = reprice(project_ids=[project.pk], dry_run=dry_run)
 
+        if dry_run:
+            return Response({"changes": changes}, status=status.HTTP_200_OK)
+
+        project = project_tree().get(pk=project.pk)
         serializer = self.serializer_class(project)
 
         return Response(serializer.data, status=status.HTTP_200_OK)
@@ -641,6 +769,7 @@ class ProjectViewset(viewsets.GenericViewSet):
             project = self.get_object()
             stage = project.stages.get(id=stage_id)
             stage.delete()
+            refresh_project_totals([project.id])
             return Response(status=status.HTTP_204_NO_CONTENT)
         elif request.method == "PATCH":
             project = self.get_object()
@@ -657,52 +786,28 @@ class ProjectViewset(viewsets.GenericViewSet):
     def clone(self, request, pk=None):
         """Clone project with `pk`, with his nested structures"""
         project: Project = self.get_object()
-        project_kwargs = get_object_fields(project)
-        new_project = Project(**project_kwargs)
-        new_project.save()
-
-        bulk_create_stages = []
-        bulk_create_constructions = []
-        bulk_create_elements = []
-
-        for stage in project.stages.all():
-            stage_kwargs = get_object_fields(stage)
-            stage_kwargs["project"] = new_project
-            new_stage = ProjectStage(**stage_kwargs)
-            bulk_create_stages.append(new_stage)
-
-            construction: ProjectConstruction
-            for construction in stage.constructions.all():
-                construction_kwargs = get_object_fields(construction)
-                construction_kwargs["stage"] = new_stage
-                new_construction = ProjectConstruction(**construction_kwargs)
-                bulk_create_constructions.append(new_construction)
-
-                element: ProjectElement
-                for element in construction.elements.all():
-                    element_kwargs = get_object_fields(element)
-                    element_kwargs["construction"] = new_construction
-                    bulk_create_elements.append(ProjectElement(**element_kwargs))
-
-        ProjectStage.objects.bulk_create(bulk_create_stages)
-        ProjectConstruction.objects.bulk_create(bulk_create_constructions)
-        ProjectElement.objects.bulk_create(bulk_create_elements)
+        new_project = clone_project(project)
 
         serializer = self.serializer_class(new_project)
 
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
-class TemplateViewset(viewsets.GenericViewSet):
+class TemplateViewset(PaginationMixin, viewsets.GenericViewSet):
     queryset = Template.objects.all()
     serializer_class = TemplateSerializer
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_queryset(self):
         queryset = Template.objects.all()
+        if self.action == "retrieve":
+            queryset = template_tree(queryset)
+
         title = self.request.query_params.get("title")
         if title:
-            queryset = queryset.filter(title__istartswith=title)[:5]
+            queryset = search(queryset, "title", title, self.request.query_params)
+            if self.action == "list":
+                queryset = paginate(queryset, self.request.query_params)
 
         return queryset
 
@@ -714,8 +819,7 @@ class TemplateViewset(viewsets.GenericViewSet):
 
     def list(self, request):
         """Get list of templates"""
-        serializer = self.serializer_class(self.get_queryset(), many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return self.list_response(self.get_queryset(), self.serializer_class)
 
     def create(self, request):
         """Create template by `request.data`"""
@@ -787,8 +891,8 @@ class TemplateViewset(viewsets.GenericViewSet):
             serializer = self.serializer_class(stage, data=request.data, partial=True)
 
             if serializer.is_valid(raise_exception=False):
-                serializer.update(stage, serializer.validated_data)
-                return Response(serializer.data, status=status.HTTP_200_OK)
+                data = serializer.update(stage, serializer.validated_data)
+                return Response(data, status=status.HTTP_200_OK)
 
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -796,43 +900,14 @@ class TemplateViewset(viewsets.GenericViewSet):
     def clone(self, request, pk=None):
         """Clone template with `pk`, with his nested structures"""
         template: Template = self.get_object()
-        template_kwargs = get_object_fields(template)
-        new_template = Template(**template_kwargs)
-        new_template.save()
-
-        bulk_create_stages = []
-        bulk_create_constructions = []
-        bulk_create_elements = []
-
-        for stage in template.stages.all():
-            stage_kwargs = get_object_fields(stage)
-            stage_kwargs["template"] = new_template
-            new_stage = TemplateStage(**stage_kwargs)
-            bulk_create_stages.append(new_stage)
-
-            construction: TemplateConstruction
-            for construction in stage.constructions.all():
-                construction_kwargs = get_object_fields(construction)
-                construction_kwargs["stage"] = new_stage
-                new_construction = TemplateConstruction(**construction_kwargs)
-                bulk_create_constructions.append(new_construction)
-
-                element: TemplateElement
-                for element in construction.elements.all():
-                    element_kwargs = get_object_fields(element)
-                    element_kwargs["construction"] = new_construction
-                    bulk_create_elements.append(TemplateElement(**element_kwargs))
-
-        TemplateStage.objects.bulk_create(bulk_create_stages)
-        TemplateConstruction.objects.bulk_create(bulk_create_constructions)
-        TemplateElement.objects.bulk_create(bulk_create_elements)
+        new_template = clone_template(template)
 
         serializer = self.serializer_class(new_template)
 
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
-class ClientViewSet(viewsets.GenericViewSet):
+class ClientViewSet(PaginationMixin, viewsets.GenericViewSet):
     queryset = Client.objects.all()
     serializer_class = ClientSerializer
     permission_classes = (permissions.IsAuthenticated,)
@@ -841,20 +916,22 @@ class ClientViewSet(viewsets.GenericViewSet):
         queryset = Client.objects.all()
         name = self.request.query_params.get("name")
         if name:
-            queryset = queryset.filter(name__istartswith=name)[:5]
+            queryset = search(queryset, "name", name, self.request.query_params)
+            if self.action == "list":
+                queryset = paginate(queryset, self.request.query_params)
 
         return queryset
 
     def retrieve(self, request, pk=None):
-        """Get client with `pk`"""
+        """Get client with `pk`, with page of his projects"""
         client = self.get_object()
-        serializer = ClientDetailSerializer(client)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        data = self.serializer_class(client).data
+        data.update(self.nested_page("projects", client.projects.select_related("client"), ProjectSerializer))
+        return Response(data, status=status.HTTP_200_OK)
 
     def list(self, request):
         """Get clients list"""
-        serializer = self.serializer_class(self.get_queryset(), many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return self.list_response(self.get_queryset(), self.serializer_class)
 
     def create(self, request):
         """Create client by `request.data`"""
@@ -871,3 +948,28 @@ class ClientViewSet(viewsets.GenericViewSet):
         client = self.get_object()
         client.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ExportJobViewSet(viewsets.GenericViewSet):
+    queryset = ExportJob.objects.all()
+    serializer_class = ExportJobSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def retrieve(self, request, pk=None):
+        """Get status of export job with `pk`"""
+        job = self.get_object()
+        if jobs.fail_stale(self.queryset.filter(pk=job.pk)):
+            job.refresh_from_db()
+        serializer = self.serializer_class(job)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=["get"], url_name="download", url_path="download")
+    def download(self, request, pk=None):
+        """Download excel table of finished export job with `pk`"""
+        job = self.get_object()
+
+        if job.status != ExportJob.Status.DONE:
+            serializer = self.serializer_class(job)
+            return Response(serializer.data, status=status.HTTP_409_CONFLICT)
+
+        return accel_redirect_response(job.file.name)
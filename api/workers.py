@@ -0,0 +1,14 @@
+"""Initializer of spawned export processes
+
+Processes unpickle initializer by importing its module before Django is
+set up, so this module doesn't import models.
+"""
+import django
+from django.conf import settings
+
+
+def init_worker(database: str, media_root: str):
+    """Setup Django with database and media of web worker, they differ from settings in tests"""
+    settings.DATABASES["default"]["NAME"] = database
+    settings.MEDIA_ROOT = media_root
+    django.setup()
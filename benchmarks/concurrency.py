@@ -0,0 +1,63 @@
+"""Concurrent throughput of read endpoints
+
+Run the server in both modes and compare sync and async endpoints:
+
+    SERVER_MODE=wsgi gunicorn -c gunicorn.conf.py
+    python benchmarks/concurrency.py --token <token> \\
+        http://localhost:8000/api/projects/1/
+
+    SERVER_MODE=asgi gunicorn -c gunicorn.conf.py
+    python benchmarks/concurrency.py --token <token> \\
+        http://localhost:8000/api/projects/1/ \\
+        http://localhost:8000/api/async/projects/1/
+"""
+import argparse
+import statistics
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def fetch(url: str, token: str) -> float:
+    request = urllib.request.Request(url, headers={"Authorization": f"Token {token}"})
+    started = time.perf_counter()
+    with urllib.request.urlopen(request) as response:
+        response.read()
+    return time.perf_counter() - started
+
+
+def run(url: str, token: str, concurrency: int, requests: int) -> dict:
+    with ThreadPoolExecutor(concurrency) as executor:
+        # Warm up connections and caches
+        list(executor.map(lambda _: fetch(url, token), range(concurrency)))
+
+        started = time.perf_counter()
+        latencies = sorted(executor.map(lambda _: fetch(url, token), range(requests)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "url": url,
+        "requests_per_second": round(requests / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("urls", nargs="+")
+    parser.add_argument("--token", required=True, help="API token of user")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=1000)
+    args = parser.parse_args()
+
+    for url in args.urls:
+        result = run(url, args.token, args.concurrency, args.requests)
+        print(
+            f"{result['url']}: {result['requests_per_second']} req/s, "
+            f"p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Latency of requests with new database connection and with pooled one
+
+Every simulated request opens connection, runs query and closes connection,
+like request of sync worker with `CONN_MAX_AGE=0`. Database settings are
+taken from environment, like for the server:
+
+    python benchmarks/db_pool.py --requests 1000
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "main.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connections  # noqa: E402
+from django.db.backends.postgresql.base import DatabaseWrapper  # noqa: E402
+
+from main.postgresql_pool import pool  # noqa: E402
+from main.postgresql_pool.base import DatabaseWrapper as PooledDatabaseWrapper  # noqa: E402
+
+QUERY = "SELECT 1"
+
+
+def request(wrapper_class, settings_dict: dict) -> float:
+    started = time.perf_counter()
+    wrapper = wrapper_class(settings_dict)
+    try:
+        with wrapper.cursor() as cursor:
+            cursor.execute(QUERY)
+            cursor.fetchall()
+    finally:
+        wrapper.close()
+    return time.perf_counter() - started
+
+
+def run(wrapper_class, settings_dict: dict, concurrency: int, requests: int) -> dict:
+    with ThreadPoolExecutor(concurrency) as executor:
+        # Warm up pool
+        list(executor.map(lambda _: request(wrapper_class, settings_dict), range(concurrency)))
+
+        started = time.perf_counter()
+        latencies = sorted(executor.map(lambda _: request(wrapper_class, settings_dict), range(requests)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests_per_second": round(requests / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=1000)
+    args = parser.parse_args()
+
+    settings_dict = {
+        **connections.settings["default"],
+        "CONN_MAX_AGE": 0,
+        "POOL": {**connections.settings["default"].get("POOL", {}), "MAX_SIZE": args.concurrency},
+    }
+
+    for name, wrapper_class in (("new connection", DatabaseWrapper), ("pool", PooledDatabaseWrapper)):
+        result = run(wrapper_class, settings_dict, args.concurrency, args.requests)
+        print(
+            f"{name}: {result['requests_per_second']} req/s, "
+            f"p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms"
+        )
+    print(f"pool: {pool.stats()}")
+
+
+if __name__ == "__main__":
+    main()
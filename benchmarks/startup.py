@@ -0,0 +1,110 @@
+"""Time to first request and resident memory of gunicorn workers
+
+PSS counts memory shared by workers after fork of preloaded master
+divided by count of processes, so it shows the effect of preloading.
+
+Starts gunicorn with `gunicorn.conf.py` with and without preloading of
+application and prints results for every mode:
+
+    python benchmarks/startup.py --workers 4
+    python benchmarks/startup.py --mode asgi
+"""
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_first_response(url: str, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1).read()
+            return True
+        except urllib.error.HTTPError:
+            # Any response of Django, e.g. 401, means worker is ready
+            return True
+        except OSError:
+            time.sleep(0.01)
+    return False
+
+
+def memory_kb(pid: int, name: str) -> int:
+    """`Rss` or `Pss` (resident memory with shared pages divided by processes)"""
+    with open(f"/proc/{pid}/smaps_rollup") as smaps:
+        for line in smaps:
+            if line.startswith(f"{name}:"):
+                return int(line.split()[1])
+    return 0
+
+
+def children(pid: int) -> list:
+    with open(f"/proc/{pid}/task/{pid}/children") as file:
+        return [int(child) for child in file.read().split()]
+
+
+def run(mode: str, preload: bool, workers: int, timeout: float) -> dict:
+    port = free_port()
+    env = {
+        **os.environ,
+        "SERVER_MODE": mode,
+        "GUNICORN_PRELOAD": "1" if preload else "0",
+        "GUNICORN_WORKERS": str(workers),
+        "GUNICORN_BIND": f"127.0.0.1:{port}",
+    }
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        if not wait_first_response(f"http://127.0.0.1:{port}/api/", timeout):
+            raise RuntimeError("Server didn't answer, check settings and environment")
+        first_request = time.perf_counter() - started
+
+        # Let all workers boot before measuring memory
+        time.sleep(1)
+        pids = children(process.pid)
+        return {
+            "mode": mode,
+            "preload": preload,
+            "first_request_ms": round(first_request * 1000),
+            "worker_rss_mb": round(sum(memory_kb(pid, "Rss") for pid in pids) / len(pids) / 1024, 1),
+            "worker_pss_mb": round(sum(memory_kb(pid, "Pss") for pid in pids) / len(pids) / 1024, 1),
+        }
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("wsgi", "asgi"), default="wsgi")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=30)
+    args = parser.parse_args()
+
+    for preload in (False, True):
+        result = run(args.mode, preload, args.workers, args.timeout)
+        print(
+            f"{result['mode']} preload={result['preload']}: first request {result['first_request_ms']} ms, "
+            f"worker RSS {result['worker_rss_mb']} MB, PSS {result['worker_pss_mb']} MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+import os
+
+# `wsgi` runs sync workers, `asgi` runs uvicorn workers with async read endpoints
+SERVER_MODE = os.getenv("SERVER_MODE", default="wsgi")
+
+if SERVER_MODE == "asgi":
+    wsgi_app = "main.asgi:application"
+    worker_class = "uvicorn.workers.UvicornWorker"
+else:
+    wsgi_app = "main.wsgi:application"
+    worker_class = "sync"
+
+bind = os.getenv("GUNICORN_BIND", default="0.0.0.0:8000")
+workers = int(os.getenv("GUNICORN_WORKERS", default=1))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", default=120))
+
+# Load application in master process before forking workers: workers start
+# faster and share memory of imported modules, code must not open database
+# connections or threads at import time
+preload_app = os.getenv("GUNICORN_PRELOAD", default="0") == "1"
+
+
+def post_fork(server, worker):
+    # Workers must not share connections opened by master
+    from django.db import connections
+    connections.close_all()
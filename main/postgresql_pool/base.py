@@ -0,0 +1,75 @@
+"""PostgreSQL backend, which takes connections from pool of process
+
+Pool is configured by `POOL` of database settings. `close()` of Django
+returns connection to the pool, so `CONN_MAX_AGE` should be `0`.
+"""
+from django.db.backends.postgresql import base
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+from .pool import PoolTimeout, get_pool
+
+Database = base.Database
+
+POOL_DEFAULTS = {
+    "MAX_SIZE": 10,
+    "TIMEOUT": 10,
+    "MAX_LIFETIME": 30 * 60,
+    "HEALTH_CHECK_INTERVAL": 30,
+}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    pool = None
+
+    def get_pool(self, conn_params: dict):
+        options = {**POOL_DEFAULTS, **self.settings_dict.get("POOL", {})}
+        # Test and maintenance connections use other database names
+        key = f"{self.alias}:{conn_params.get('database')}"
+        return get_pool(
+            key,
+            max_size=options["MAX_SIZE"],
+            timeout=options["TIMEOUT"],
+            max_lifetime=options["MAX_LIFETIME"],
+            health_check_interval=options["HEALTH_CHECK_INTERVAL"],
+        )
+
+    def get_new_connection(self, conn_params):
+        self.pool = self.get_pool(conn_params)
+        connect = super().get_new_connection
+        try:
+            connection = self.pool.checkout(lambda: connect(conn_params), ping)
+        except PoolTimeout as e:
+            raise Database.OperationalError(str(e)) from e
+
+        self.isolation_level = self.settings_dict["OPTIONS"].get("isolation_level", connection.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.checkin(self.connection, reset(self.connection))
+
+
+def ping(connection) -> bool:
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+    except Database.Error:
+        return False
+    return True
+
+
+def reset(connection) -> bool:
+    """Roll back unfinished transaction of `connection` and restore autocommit, return if it can be reused"""
+    if connection.closed:
+        return False
+
+    try:
+        if connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            connection.rollback()
+        # Connections are checked in from `atomic()` blocks with autocommit off
+        if not connection.autocommit:
+            connection.autocommit = True
+    except Database.Error:
+        return False
+    return True
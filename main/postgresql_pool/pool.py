@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+from typing import Callable, Dict
+
+
+class PoolTimeout(Exception):
+    """No connection was returned to the pool in time"""
+
+
+class ConnectionPool:
+    """Bounded pool of database connections of one process
+
+    At most `max_size` connections are checked out at once, other threads
+    wait for a free slot up to `timeout` seconds. Idle connections are
+    reused in LIFO order, connections older than `max_lifetime` seconds
+    are closed, and connections idle for more than `health_check_interval`
+    seconds are checked before reuse.
+    """
+
+    def __init__(self, max_size: int, timeout: float, max_lifetime: float, health_check_interval: float):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.health_check_interval = health_check_interval
+        self.pid = os.getpid()
+
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        # Idle connections with time of creation and of return to pool
+        self._idle = []
+        # Time of creation of checked out connections by their ids
+        self._in_use = {}
+
+        self.checkouts = 0
+        self.timeouts = 0
+        self.opened = 0
+        self.discarded = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def checkout(self, connect: Callable, check: Callable):
+        """Take idle connection, which passes `check`, or open new one by `connect`"""
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise PoolTimeout(f"No free database connection in {self.timeout} seconds")
+
+        waited = time.monotonic() - started
+        try:
+            connection, created = self._take(check)
+            if connection is None:
+                connection, created = connect(), time.monotonic()
+                with self._lock:
+                    self.opened += 1
+        except BaseException:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use[id(connection)] = created
+            self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+        return connection
+
+    def _take(self, check: Callable):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None, None
+                connection, created, returned = self._idle.pop()
+
+            now = time.monotonic()
+            if now - created > self.max_lifetime:
+                self._discard(connection)
+            elif now - returned > self.health_check_interval and not check(connection):
+                self._discard(connection)
+            else:
+                return connection, created
+
+    def checkin(self, connection, usable: bool = True):
+        """Return checked out `connection`, unusable connection is closed"""
+        with self._lock:
+            created = self._in_use.pop(id(connection), None)
+
+        try:
+            if created is None or not usable or time.monotonic() - created > self.max_lifetime:
+                self._discard(connection)
+            else:
+                with self._lock:
+                    self._idle.append((connection, created, time.monotonic()))
+        finally:
+            if created is not None:
+                self._slots.release()
+
+    def _discard(self, connection):
+        with self._lock:
+            self.discarded += 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "size": len(self._idle) + len(self._in_use),
+                "idle": len(self._idle),
+                "in_use": len(self._in_use),
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "opened": self.opened,
+                "discarded": self.discarded,
+                "wait_avg_ms": round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0,
+                "wait_max_ms": round(self.wait_max * 1000, 3),
+            }
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(key: str, **options) -> ConnectionPool:
+    """Pool of current process by `key`
+
+    Pools inherited from parent process by fork are dropped without closing
+    their connections, because sockets are shared with the parent.
+    """
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool.pid != os.getpid():
+            pool = _pools[key] = ConnectionPool(**options)
+        return pool
+
+
+def stats() -> Dict[str, dict]:
+    """Stats of pools of current process"""
+    with _pools_lock:
+        pools = {key: pool for key, pool in _pools.items() if pool.pid == os.getpid()}
+    return {key: pool.stats() for key, pool in pools.items()}
@@ -11,6 +11,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
 
     # Third party apps
     "rest_framework",
@@ -23,6 +24,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "api.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -54,23 +56,58 @@ USE_TZ = True
 TIME_ZONE = "Europe/Moscow"
 
 # Postgres
+# With `DB_POOL=1` connections are taken from pool of every process,
+# else Django keeps connection of thread for `DB_CONN_MAX_AGE` seconds
+DB_POOL = os.getenv("DB_POOL", default="0") == "1"
+
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql",
+        "ENGINE": "main.postgresql_pool" if DB_POOL else "django.db.backends.postgresql",
         "NAME": os.getenv("DB_NAME"),
         "USER": os.getenv("DB_USER"),
         "PASSWORD": os.getenv("DB_PASSWORD"),
         "HOST": os.getenv("DB_HOST"),
         "PORT": os.getenv("DB_PORT"),
+        "CONN_MAX_AGE": 0 if DB_POOL else int(os.getenv("DB_CONN_MAX_AGE", default=0)),
+        "POOL": {
+            "MAX_SIZE": int(os.getenv("DB_POOL_SIZE", default=10)),
+            "TIMEOUT": float(os.getenv("DB_POOL_TIMEOUT", default=10)),
+            "MAX_LIFETIME": float(os.getenv("DB_POOL_MAX_LIFETIME", default=30 * 60)),
+            "HEALTH_CHECK_INTERVAL": float(os.getenv("DB_POOL_HEALTH_CHECK_INTERVAL", default=30)),
+        },
     }
 }
 
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "construction",
+    }
+}
+
+# Cached tree of categories is versioned, so timeout only frees memory
+CATEGORY_TREE_TIMEOUT = int(os.getenv("CATEGORY_TREE_TIMEOUT", default=24 * 60 * 60))
+
+# Elements grouped by subcategories, cached by revision of elements
+ELEMENT_GROUPS_TIMEOUT = int(os.getenv("ELEMENT_GROUPS_TIMEOUT", default=60 * 60))
+ELEMENT_GROUP_SIZE = int(os.getenv("ELEMENT_GROUP_SIZE", default=20))
+ELEMENT_GROUP_MAX_SIZE = int(os.getenv("ELEMENT_GROUP_MAX_SIZE", default=100))
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework.authentication.TokenAuthentication",
+        "api.authentication.CachedTokenAuthentication",
     ),
 }
 
+# Default size of pages of `api.pagination.IdCursorPagination`, lists of
+# other views aren't paginated
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", default=50))
+
+# Users of tokens are cached in every process, changes made in other
+# processes, e.g. logout, are seen after TTL seconds
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", default=1024))
+TOKEN_CACHE_TTL = int(os.getenv("TOKEN_CACHE_TTL", default=60))
+
 # Static files (CSS, JavaScript, Images)
 STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
 STATICFILES_DIRS = []
@@ -83,6 +120,24 @@ STATICFILES_FINDERS = (
 # Media files
 MEDIA_ROOT = os.path.join(BASE_DIR, "mediafiles")
 MEDIA_URL = "/media/"
+# Signed urls of documents are valid from TTL to twice of TTL seconds
+MEDIA_URL_TTL = int(os.getenv("MEDIA_URL_TTL", default=60 * 60))
+
+# Phases of requests in `Server-Timing` header and histograms of `/metrics`
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", default="1") == "1"
+
+# Search
+SEARCH_LIMIT = int(os.getenv("SEARCH_LIMIT", default=5))
+SEARCH_MAX_LIMIT = int(os.getenv("SEARCH_MAX_LIMIT", default=100))
+
+# Rows of project elements read from database at once by excel reports
+REPORT_CHUNK_SIZE = int(os.getenv("REPORT_CHUNK_SIZE", default=1000))
+
+# Background export of projects to excel tables
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", default=2))
+# Jobs are kept only in memory of web workers, jobs which aren't finished
+# in this time are lost by restart of worker and marked as failed
+EXPORT_TIMEOUT = int(os.getenv("EXPORT_TIMEOUT", default=10 * 60))
 
 TEMPLATES = [
     {
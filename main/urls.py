@@ -4,7 +4,7 @@ from django.views.generic import TemplateView
 
 from rest_framework.routers import DefaultRouter
 
-from api.views import internal_media
+from api.views import internal_media, prometheus_metrics, signed_media
 
 router = DefaultRouter()
 
@@ -13,6 +13,8 @@ urlpatterns = [
     path("api/", include("api.urls", namespace="api")),
     path("api/auth/", include("djoser.urls")),
     path("api/auth/", include("djoser.urls.authtoken")),
+    path("metrics", prometheus_metrics, name="metrics"),
     path("docs/", TemplateView.as_view(template_name="elements.html")),
+    path("media/signed/<int:expires>/<str:signature>/<path:file>", signed_media, name="signed_media"),
     re_path(r"^media/(?P<file>.*)/(?P<token>.*)$", internal_media, name="internal_media")
 ]